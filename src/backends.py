@@ -0,0 +1,347 @@
+"""
+Embedding and generation backends for the PDF Document Processor
+----------------------------------------------------------------
+The processor selects one embedding backend and one generation backend by
+name, so that ingestion and querying can run against the Gemini API or
+entirely on the local CPU.
+
+Embedding backends:
+    gemini   - Gemini text-embedding-004 through the shared client
+    local    - sentence-transformers model on the CPU, encoded in batches
+    hashing  - hashed bag-of-words vectors with numpy; no model, no network
+
+Generation backends:
+    gemini   - Gemini generative model through the shared client
+    local    - extractive stub that answers with the best matching context sentences
+"""
+
+import re
+import os
+import hashlib
+import logging
+
+import numpy as np
+from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from gemini_client import DEFAULT_EMBEDDING_MODEL, DEFAULT_GENERATION_MODEL, get_client
+from scheduler import get_scheduler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCAL_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+EMBEDDING_BACKENDS = ("gemini", "local", "hashing")
+GENERATION_BACKENDS = ("gemini", "local")
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+
+
+class EmbeddingError(RuntimeError):
+    """Raised when an embedding cannot be computed."""
+
+
+class CustomGeminiEmbedding(BaseEmbedding):
+    """Custom embedding class using Google's Generative AI API."""
+
+    # Define class variable for embedding dimension
+    embedding_dimension: int = 768  # Default embedding dimension for Gemini text-embedding-004
+
+    _client = PrivateAttr(default=None)
+
+    def __init__(self, api_key=None, model_name=DEFAULT_EMBEDDING_MODEL, client=None):
+        """Initialize with Google API key, model name and optional Gemini client."""
+        super().__init__(model_name=model_name)
+        # The shared client configures the Gemini API once per process
+        self._client = client or get_client(api_key)
+
+        # Ensure embedding_dimension is set
+        self.__class__.embedding_dimension = 768
+
+    @property
+    def dimension(self) -> int:
+        """Return the embedding dimension."""
+        return self.__class__.embedding_dimension
+
+    def _get_query_embedding(self, query: str) -> list:
+        """Get embedding for a query string."""
+        try:
+            return self._client.embed_one(query, "RETRIEVAL_QUERY", self.model_name)
+        except Exception as e:
+            logger.error(f"Error getting query embedding: {e}")
+            raise EmbeddingError(f"Error getting query embedding: {e}") from e
+
+    def get_query_embedding_batch(self, queries: list) -> list:
+        """Get embeddings for multiple query strings in as few requests as possible."""
+        try:
+            return self._client.embed(queries, "RETRIEVAL_QUERY", self.model_name)
+        except Exception as e:
+            logger.error(f"Error getting query embeddings: {e}")
+            raise EmbeddingError(f"Error getting query embeddings: {e}") from e
+
+    async def _aget_query_embedding(self, query: str) -> list:
+        """Async version of get_query_embedding."""
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> list:
+        """Get embedding for a text string."""
+        try:
+            return self._client.embed_one(text, "RETRIEVAL_DOCUMENT", self.model_name)
+        except Exception as e:
+            logger.error(f"Error getting text embedding: {e}")
+            raise EmbeddingError(f"Error getting text embedding: {e}") from e
+
+    async def _aget_text_embedding(self, text: str) -> list:
+        """Async version of get_text_embedding."""
+        return self._get_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: list) -> list:
+        """Get embeddings for multiple text strings."""
+        try:
+            return self._client.embed(texts, "RETRIEVAL_DOCUMENT", self.model_name)
+        except Exception as e:
+            logger.error(f"Error getting text embeddings: {e}")
+            raise EmbeddingError(f"Error getting text embeddings: {e}") from e
+
+    async def _aget_text_embeddings(self, texts: list) -> list:
+        """Async version of get_text_embeddings."""
+        return self._get_text_embeddings(texts)
+
+
+class LocalEmbedding(BaseEmbedding):
+    """CPU-only embedding backend using a sentence-transformers model."""
+
+    _model = PrivateAttr(default=None)
+    _dimension = PrivateAttr(default=0)
+
+    def __init__(self, model_name=DEFAULT_LOCAL_EMBEDDING_MODEL, batch_size=64):
+        """
+        Load the model on the CPU.
+
+        Args:
+            model_name (str): A sentence-transformers model name or local path
+            batch_size (int): Number of texts encoded per forward pass
+        """
+        super().__init__(model_name=model_name, embed_batch_size=batch_size)
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError(
+                "The local embedding backend requires sentence-transformers. "
+                "Install it with: pip install sentence-transformers"
+            )
+        self._model = SentenceTransformer(model_name, device="cpu")
+        self._dimension = self._model.get_sentence_embedding_dimension()
+        logger.info(f"Loaded local embedding model {model_name} ({self._dimension} dimensions)")
+
+    @property
+    def dimension(self) -> int:
+        """Return the embedding dimension."""
+        return self._dimension
+
+    def _encode(self, texts: list) -> list:
+        with get_scheduler().cpu_slot():
+            vectors = self._model.encode(
+                texts,
+                batch_size=self.embed_batch_size,
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+        return vectors.tolist()
+
+    def _get_query_embedding(self, query: str) -> list:
+        """Get embedding for a query string."""
+        return self._encode([query])[0]
+
+    def get_query_embedding_batch(self, queries: list) -> list:
+        """Get embeddings for multiple query strings in one batch."""
+        return self._encode(queries)
+
+    async def _aget_query_embedding(self, query: str) -> list:
+        """Async version of get_query_embedding."""
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> list:
+        """Get embedding for a text string."""
+        return self._encode([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> list:
+        """Async version of get_text_embedding."""
+        return self._get_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: list) -> list:
+        """Get embeddings for multiple text strings in one batch."""
+        return self._encode(texts)
+
+    async def _aget_text_embeddings(self, texts: list) -> list:
+        """Async version of get_text_embeddings."""
+        return self._get_text_embeddings(texts)
+
+
+class HashingEmbedding(BaseEmbedding):
+    """
+    Dependency-free embedding backend based on hashed bag-of-words vectors.
+
+    Retrieval quality is lexical only; it is meant for offline benchmarking of
+    the pipeline and for environments without a model download.
+    """
+
+    _dimension = PrivateAttr(default=512)
+
+    def __init__(self, dimension=512, batch_size=256):
+        """Initialize with the vector dimension."""
+        super().__init__(model_name=f"hashing-{dimension}", embed_batch_size=batch_size)
+        self._dimension = dimension
+
+    @property
+    def dimension(self) -> int:
+        """Return the embedding dimension."""
+        return self._dimension
+
+    def _encode(self, texts: list) -> list:
+        vectors = np.zeros((len(texts), self._dimension), dtype=np.float32)
+        with get_scheduler().cpu_slot():
+            for row, text in enumerate(texts):
+                buckets = [
+                    int.from_bytes(hashlib.md5(token.encode("utf-8")).digest()[:4], "little") % self._dimension
+                    for token in TOKEN_PATTERN.findall(text.lower())
+                ]
+                np.add.at(vectors[row], buckets, 1.0)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).tolist()
+
+    def _get_query_embedding(self, query: str) -> list:
+        """Get embedding for a query string."""
+        return self._encode([query])[0]
+
+    def get_query_embedding_batch(self, queries: list) -> list:
+        """Get embeddings for multiple query strings in one batch."""
+        return self._encode(queries)
+
+    async def _aget_query_embedding(self, query: str) -> list:
+        """Async version of get_query_embedding."""
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> list:
+        """Get embedding for a text string."""
+        return self._encode([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> list:
+        """Async version of get_text_embedding."""
+        return self._get_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: list) -> list:
+        """Get embeddings for multiple text strings in one batch."""
+        return self._encode(texts)
+
+    async def _aget_text_embeddings(self, texts: list) -> list:
+        """Async version of get_text_embeddings."""
+        return self._get_text_embeddings(texts)
+
+
+class GenerationBackend:
+    """Interface for answer generation backends."""
+
+    model_name = None
+
+    def generate(self, prompt):
+        """
+        Generate text for a prompt.
+
+        Args:
+            prompt (str): The prompt
+
+        Returns:
+            str: The generated text
+        """
+        raise NotImplementedError
+
+
+class GeminiGenerator(GenerationBackend):
+    """Generates answers with a Gemini model through the shared client."""
+
+    def __init__(self, client=None, model_name=DEFAULT_GENERATION_MODEL):
+        """Initialize with a Gemini client and model name."""
+        self.client = client or get_client()
+        self.model_name = model_name
+
+    def generate(self, prompt):
+        """Generate text for a prompt."""
+        return self.client.generate(prompt, self.model_name)
+
+
+class LocalGenerator(GenerationBackend):
+    """
+    Local generation stub that needs no model.
+
+    Answers with the context sentences sharing the most words with the
+    question, which is enough to exercise the full pipeline offline.
+    """
+
+    model_name = "local-extractive"
+
+    def __init__(self, max_sentences=3):
+        """Initialize with the number of sentences to return."""
+        self.max_sentences = max_sentences
+
+    def generate(self, prompt):
+        """Answer a prompt built by PDFProcessor.generate_answer."""
+        context, _, question = prompt.partition("Please answer this question:")
+        question = question.split("\n")[0]
+        context = context.partition("from the document:")[2] or context
+        question_tokens = set(TOKEN_PATTERN.findall(question.lower()))
+        sentences = [s.strip() for s in SENTENCE_PATTERN.split(" ".join(context.split())) if s.strip()]
+        scored = [
+            (len(question_tokens & set(TOKEN_PATTERN.findall(sentence.lower()))), -i, sentence)
+            for i, sentence in enumerate(sentences)
+        ]
+        best = [item for item in sorted(scored, reverse=True)[:self.max_sentences] if item[0] > 0]
+        if not best:
+            return "The answer cannot be found in the provided information."
+        # Keep the chosen sentences in document order
+        return " ".join(sentence for _, _, sentence in sorted(best, key=lambda item: -item[1]))
+
+
+def create_embed_model(backend, client=None, api_key=None):
+    """
+    Build the embedding model for a backend name.
+
+    Args:
+        backend (str): One of EMBEDDING_BACKENDS
+        client: Gemini client for the gemini backend
+        api_key (str): API key for the gemini backend if no client is given
+
+    Returns:
+        BaseEmbedding: The embedding model
+    """
+    if backend == "gemini":
+        return CustomGeminiEmbedding(model_name=DEFAULT_EMBEDDING_MODEL, api_key=api_key, client=client)
+    if backend == "local":
+        return LocalEmbedding(
+            model_name=os.getenv("LOCAL_EMBEDDING_MODEL", DEFAULT_LOCAL_EMBEDDING_MODEL),
+            batch_size=int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "64"))
+        )
+    if backend == "hashing":
+        return HashingEmbedding()
+    raise ValueError(f"Unknown embedding backend '{backend}'; expected one of {', '.join(EMBEDDING_BACKENDS)}")
+
+
+def create_generator(backend, client=None):
+    """
+    Build the generation backend for a backend name.
+
+    Args:
+        backend (str): One of GENERATION_BACKENDS
+        client: Gemini client for the gemini backend
+
+    Returns:
+        GenerationBackend: The generator
+    """
+    if backend == "gemini":
+        return GeminiGenerator(client)
+    if backend == "local":
+        return LocalGenerator()
+    raise ValueError(f"Unknown generation backend '{backend}'; expected one of {', '.join(GENERATION_BACKENDS)}")
@@ -0,0 +1,282 @@
+"""
+Query expansion for the PDF Document Processor
+----------------------------------------------
+Builds several variants of a question (content keywords, local synonym
+expansion and optionally a HyDE-style draft answer), retrieves for all of
+them concurrently and merges the result lists with reciprocal rank fusion.
+
+Retrieval for the original question runs alongside the variants. If its
+best chunk already scores above ``early_answer_score`` the answer is not
+held back: the original results are fused with whichever variants have
+finished at that moment, the others are told to stop before their next
+model call, and generation starts immediately. The HyDE draft is started
+speculatively at the same time, since its generator call is the slowest
+step; it is cancelled as soon as the question or any cheap variant reaches
+that score, and is only waited for when none does.
+"""
+
+import os
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils import content_words, tokenize
+
+logger = logging.getLogger(__name__)
+
+# Scores are exp(-squared L2 distance) of unit vectors, i.e. exp(2 * cosine - 2).
+# 0.55 corresponds to a cosine similarity of about 0.70, where a chunk that
+# directly answers a question typically lands with current embedding models;
+# 0.7 would need a cosine of about 0.82, which few questions ever reach.
+DEFAULT_EARLY_ANSWER_SCORE = 0.55
+
+# Small built-in synonym list; extend it with a JSON file of {"word": ["synonym", ...]}
+DEFAULT_SYNONYMS = {
+    "ai": ["artificial intelligence"],
+    "ml": ["machine learning"],
+    "nn": ["neural network"],
+    "dl": ["deep learning"],
+    "nlp": ["natural language processing"],
+    "llm": ["large language model"],
+    "algorithm": ["method", "technique"],
+    "method": ["technique", "approach"],
+    "example": ["instance", "use case"],
+    "use": ["application", "usage"],
+    "benefit": ["advantage"],
+    "advantage": ["benefit"],
+    "drawback": ["disadvantage", "limitation"],
+    "problem": ["issue", "challenge"],
+    "cost": ["price"],
+    "price": ["cost"],
+    "buy": ["purchase"],
+    "error": ["failure", "fault"],
+    "fast": ["quick", "efficient"],
+    "goal": ["objective", "purpose"],
+    "type": ["kind", "category"],
+    "define": ["definition", "meaning"],
+}
+
+HYDE_PROMPT = (
+    "Write a short factual passage (two or three sentences) that would answer the "
+    "following question. Do not mention the question.\n\nQuestion: {query}"
+)
+
+
+def load_synonyms(path=None):
+    """
+    Load the synonym list.
+
+    Args:
+        path (str): Optional JSON file mapping words to lists of synonyms,
+            merged over the built-in list
+
+    Returns:
+        dict: Word to synonyms
+    """
+    synonyms = {word: list(values) for word, values in DEFAULT_SYNONYMS.items()}
+    if path and os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for word, values in json.load(f).items():
+                    synonyms[word.lower()] = [str(value) for value in values]
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read synonyms from {path}: {e}")
+    return synonyms
+
+
+def keyword_variant(query):
+    """Return the content words of a query, or None if that changes nothing useful."""
+    keywords = content_words(query)
+    if not keywords or keywords == tokenize(query):
+        return None
+    return " ".join(keywords)
+
+
+def synonym_variant(query, synonyms):
+    """Return the query with synonyms of its words appended, or None if none are known."""
+    additions = []
+    for word in content_words(query):
+        for candidate in (word, word.rstrip("s")):
+            if candidate in synonyms:
+                additions.extend(synonyms[candidate])
+                break
+    if not additions:
+        return None
+    return f"{query} {' '.join(dict.fromkeys(additions))}"
+
+
+def reciprocal_rank_fusion(result_lists, top_k, k=60):
+    """
+    Merge ranked result lists.
+
+    Each chunk scores the sum of 1 / (k + rank) over the lists it appears in.
+    The returned NodeWithScore objects keep their best similarity score, so
+    scores stay comparable with unfused retrieval; only the order comes from
+    the fusion.
+
+    Args:
+        result_lists (list): Lists of NodeWithScore, each best first
+        top_k (int): Number of chunks to return
+        k (int): Rank offset dampening the influence of top ranks
+
+    Returns:
+        list: The fused NodeWithScore results, best first
+    """
+    fused = {}
+    best = {}
+    for results in result_lists:
+        for rank, result in enumerate(results):
+            node_id = result.node.node_id
+            fused[node_id] = fused.get(node_id, 0.0) + 1.0 / (k + rank + 1)
+            if node_id not in best or (result.score or 0.0) > (best[node_id].score or 0.0):
+                best[node_id] = result
+    ranked = sorted(fused, key=fused.get, reverse=True)[:top_k]
+    return [best[node_id] for node_id in ranked]
+
+
+class QueryExpander:
+    """
+    Retrieves for a question and its variants concurrently and fuses the results.
+    """
+
+    def __init__(self, processor, synonyms=None, use_hyde=False, early_answer_score=DEFAULT_EARLY_ANSWER_SCORE,
+                 max_workers=8):
+        """
+        Initialize the expander.
+
+        Args:
+            processor (PDFProcessor): The processor to retrieve from
+            synonyms (dict): Word to synonyms (defaults to the built-in list)
+            use_hyde (bool): Also retrieve with a draft answer from the generator; the
+                draft starts with the other variants and is cancelled once the question
+                or a variant reaches ``early_answer_score``
+            early_answer_score (float): Best score at which the original retrieval
+                answers without waiting for the variants, and at which a variant makes
+                the HyDE draft unnecessary
+            max_workers (int): Number of concurrent retrievals
+        """
+        self.processor = processor
+        self.synonyms = synonyms if synonyms is not None else load_synonyms()
+        self.use_hyde = use_hyde
+        self.early_answer_score = early_answer_score
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="expansion")
+        self.early_answers = 0
+        self.fused_answers = 0
+        self.hyde_drafts = 0
+        self.hyde_cancelled = 0
+
+    def variants(self, query):
+        """
+        Build the variants of a question.
+
+        Args:
+            query (str): The question
+
+        Returns:
+            dict: Variant name to query text, without duplicates of the question
+        """
+        variants = {}
+        seen = {" ".join(tokenize(query))}
+        for name, text in (("keywords", keyword_variant(query)),
+                           ("synonyms", synonym_variant(query, self.synonyms))):
+            key = " ".join(tokenize(text)) if text else ""
+            if key and key not in seen:
+                variants[name] = text
+                seen.add(key)
+        return variants
+
+    def _retrieve_variant(self, text, filters, top_k, cancel):
+        # A running future cannot be cancelled, so the variant checks the event itself
+        if cancel.is_set():
+            return []
+        # Embedded directly so variants do not count as asked queries
+        embedding = self.processor.embed_model.get_query_embedding(text)
+        if cancel.is_set():
+            return []
+        return self.processor.retrieve(text, filters, top_k, query_embedding=embedding)
+
+    def _retrieve_hyde(self, query, filters, top_k, cancel):
+        if cancel.is_set():
+            return []
+        draft = self.processor.generator.generate(HYDE_PROMPT.format(query=query))
+        # The draft may finish after it was cancelled; it is then not embedded
+        return self._retrieve_variant(draft, filters, top_k, cancel)
+
+    @staticmethod
+    def _best_score(result_lists):
+        """Return the highest similarity score over result lists."""
+        return max((node.score or 0.0 for results in result_lists for node in results), default=0.0)
+
+    def retrieve(self, query, filters=None, top_k=None, query_embedding=None):
+        """
+        Retrieve for a question and its variants concurrently.
+
+        Args:
+            query (str): The question
+            filters (QueryFilter): Optional metadata filter applied to every variant
+            top_k (int): Number of chunks to return
+            query_embedding (list): Precomputed embedding of the question, if available
+
+        Returns:
+            list: The fused NodeWithScore results, best first
+        """
+        top_k = top_k or self.processor.similarity_top_k
+        cancel = threading.Event()
+        original = self.executor.submit(self.processor.retrieve, query, filters, top_k, query_embedding)
+        futures = [
+            self.executor.submit(self._retrieve_variant, text, filters, top_k, cancel)
+            for text in self.variants(query).values()
+        ]
+        hyde = None
+        hyde_cancel = threading.Event()
+        if self.use_hyde:
+            # Started speculatively so that the draft's generator call overlaps the other retrievals
+            hyde = self.executor.submit(self._retrieve_hyde, query, filters, top_k, hyde_cancel)
+
+        result_lists = [original.result()]
+        best_score = self._best_score(result_lists)
+        if best_score >= self.early_answer_score:
+            # Good enough: use only the variants that are already done
+            cancel.set()
+            hyde_cancel.set()
+            done = [future for future in futures if future.done()]
+            for future in futures:
+                future.cancel()
+            self.early_answers += 1
+            logger.info(f"Starting answer early (best score {best_score:.2f}, "
+                        f"{len(done)} of {len(futures)} variants ready)")
+        else:
+            done = []
+            for future in as_completed(futures):
+                done.append(future)
+                if (hyde is not None and future.exception() is None
+                        and self._best_score([future.result()]) >= self.early_answer_score):
+                    # A cheap variant is good enough, so the draft is not needed
+                    hyde_cancel.set()
+            self.fused_answers += 1
+        result_lists.extend(self._results(done))
+
+        if hyde is not None:
+            if hyde_cancel.is_set():
+                hyde.cancel()
+                self.hyde_cancelled += 1
+            else:
+                result_lists.extend(self._results([hyde]))
+                self.hyde_drafts += 1
+        return reciprocal_rank_fusion(result_lists, top_k)
+
+    @staticmethod
+    def _results(futures):
+        """Return the result lists of finished futures, skipping failed variants."""
+        result_lists = []
+        for future in futures:
+            try:
+                result_lists.append(future.result())
+            except Exception as e:
+                logger.warning(f"Query variant retrieval failed: {e}")
+        return result_lists
+
+    def close(self):
+        """Stop the worker threads without waiting for running variants."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
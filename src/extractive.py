@@ -0,0 +1,177 @@
+"""
+Extractive answers for the PDF Document Processor
+-------------------------------------------------
+Many questions are direct lookups whose answer is a sentence of one of the
+retrieved chunks. This stage splits the retrieved chunks into sentences,
+scores all of them against the question at once (cosine similarity of their
+embeddings as one matrix product, blended with the share of question words
+each sentence contains) and, when the best sentence is confident enough,
+answers with it and its page citation instead of calling a model.
+"""
+
+import re
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from utils import content_words, tokenize
+
+logger = logging.getLogger(__name__)
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+TERMINAL_PUNCTUATION = (".", "!", "?", ":", ";", ",")
+# Number of the next list item left at the end of a sentence, as in "applications: 1."
+LIST_MARKER_PATTERN = re.compile(r"\s+\d{1,2}\.$")
+
+
+def split_sentences(text):
+    """
+    Split chunk text into candidate answer sentences.
+
+    PDF text breaks lines inside sentences, so lines are joined first. Short
+    lines without closing punctuation that are followed by a capitalized line
+    are headings, and lines ending in a question mark are kept on their own;
+    neither is returned, as they do not answer anything. Neither are sentences
+    introducing a list.
+
+    Args:
+        text (str): The chunk text
+
+    Returns:
+        list: The sentences, in order
+    """
+    segments = []
+    current = []
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    for i, line in enumerate(lines):
+        next_line = lines[i + 1] if i + 1 < len(lines) else ""
+        after_sentence = not current or current[-1].endswith((".", "!", "?", ":"))
+        is_heading = (not line.endswith(TERMINAL_PUNCTUATION) and len(line.split()) <= 8
+                      and next_line[:1].isupper() and after_sentence)
+        if line.endswith("?") or is_heading:
+            if current:
+                segments.append(" ".join(current))
+                current = []
+            continue
+        current.append(line)
+    if current:
+        segments.append(" ".join(current))
+
+    sentences = []
+    for segment in segments:
+        for sentence in SENTENCE_PATTERN.split(segment):
+            sentence = LIST_MARKER_PATTERN.sub("", sentence.strip())
+            # Questions and list introductions do not answer anything
+            if len(sentence.split()) >= 4 and not sentence.endswith(("?", ":")):
+                sentences.append(sentence)
+    return sentences
+
+
+class ExtractiveAnswerer:
+    """Answers lookups with the best matching sentence of the retrieved chunks."""
+
+    def __init__(self, embed_model, threshold=0.6, min_overlap=0.6, lexical_weight=0.5, lead_bonus=0.1,
+                 cache_size=20000):
+        """
+        Initialize the answerer.
+
+        Args:
+            embed_model (BaseEmbedding): Embeds the question and the sentences; should
+                be a local model so that answers stay fast
+            threshold (float): Blended score the best sentence needs to be returned
+            min_overlap (float): Share of question words the best sentence must contain
+            lexical_weight (float): Weight of word overlap against embedding similarity
+            lead_bonus (float): Added for sentences that open with all question words,
+                as definitions do ("Machine learning is ...")
+            cache_size (int): Number of sentence embeddings kept for reuse
+        """
+        self.embed_model = embed_model
+        self.threshold = threshold
+        self.min_overlap = min_overlap
+        self.lexical_weight = lexical_weight
+        self.lead_bonus = lead_bonus
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.answered = 0
+        self.declined = 0
+
+    def _embed_sentences(self, sentences):
+        with self._lock:
+            vectors = {sentence: self._cache.get(sentence) for sentence in sentences}
+        missing = [sentence for sentence, vector in vectors.items() if vector is None]
+        if missing:
+            embedded = np.asarray(self.embed_model.get_text_embedding_batch(missing), dtype=np.float32)
+            norms = np.linalg.norm(embedded, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            embedded /= norms
+            with self._lock:
+                for sentence, vector in zip(missing, embedded):
+                    vectors[sentence] = vector
+                    self._cache[sentence] = vector
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return np.stack([vectors[sentence] for sentence in sentences])
+
+    def best_span(self, query, nodes):
+        """
+        Score the sentences of the retrieved chunks against a question.
+
+        Args:
+            query (str): The question
+            nodes (list): Retrieved NodeWithScore results
+
+        Returns:
+            tuple: (sentence, blended score, word overlap, NodeWithScore it came from),
+                or None if the chunks contain no candidate sentences
+        """
+        words = set(content_words(query))
+        if not words:
+            return None
+        candidates = [
+            (sentence, node)
+            for node in nodes
+            for sentence in split_sentences(node.node.get_content())
+        ]
+        if not candidates:
+            return None
+
+        sentences = [sentence for sentence, _ in candidates]
+        query_vector = np.asarray(self.embed_model.get_query_embedding(query), dtype=np.float32)
+        query_vector /= np.linalg.norm(query_vector) or 1.0
+        similarity = self._embed_sentences(sentences) @ query_vector
+        tokens = [tokenize(sentence) for sentence in sentences]
+        overlap = np.array([len(words & set(sentence_tokens)) / len(words) for sentence_tokens in tokens])
+        leads = np.array([words <= set(sentence_tokens[:len(words) + 2]) for sentence_tokens in tokens])
+        scores = (self.lexical_weight * overlap + (1.0 - self.lexical_weight) * similarity
+                  + self.lead_bonus * leads)
+        best = int(np.argmax(scores))
+        return sentences[best], float(scores[best]), float(overlap[best]), candidates[best][1]
+
+    def answer(self, query, nodes):
+        """
+        Answer a question from the retrieved chunks if a sentence is confident enough.
+
+        Args:
+            query (str): The question
+            nodes (list): Retrieved NodeWithScore results
+
+        Returns:
+            str: The sentence with its source and page, or None to fall back to generation
+        """
+        span = self.best_span(query, nodes)
+        if span is None or span[1] < self.threshold or span[2] < self.min_overlap:
+            self.declined += 1
+            if span is not None:
+                logger.info(f"No extractive answer (best score {span[1]:.2f}, overlap {span[2]:.2f})")
+            return None
+        sentence, score, _, node = span
+        self.answered += 1
+        metadata = node.node.metadata
+        citation = metadata.get("file_name", "the document")
+        if metadata.get("page_label"):
+            citation += f", page {metadata['page_label']}"
+        logger.info(f"Extractive answer (score {score:.2f}) from {citation}")
+        return f"{sentence}\n\n(Source: {citation})"
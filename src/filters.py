@@ -0,0 +1,454 @@
+"""
+Metadata filtering for the PDF Document Processor
+-------------------------------------------------
+Keeps per-field indexes over the ingested chunks (file name, page number,
+ingest date, tags and document type) so that scoped queries can be resolved
+to a candidate set *before* the vector search runs.
+
+Fields are stored as flat integer columns indexed by chunk ordinal and are
+filtered with vectorized numpy comparisons.
+"""
+
+import re
+import sys
+import uuid
+import logging
+from array import array
+from datetime import date
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Metadata keys added to every document during ingestion. They are used for
+# filtering only and are kept out of the embedding and LLM text.
+FILTER_METADATA_KEYS = ["ingest_date", "ingest_day", "page_number", "doc_type", "tags"]
+
+FILTER_PATTERN = re.compile(r"@(file|page|since|until|date|tag|type):(\S+)", re.IGNORECASE)
+
+
+def date_to_day(value):
+    """
+    Convert an ISO date string (YYYY-MM-DD) to an integer day key (YYYYMMDD).
+
+    Args:
+        value (str): The date to convert
+
+    Returns:
+        int: The day key
+    """
+    return int(date.fromisoformat(value).strftime("%Y%m%d"))
+
+
+def parse_page_number(page_label):
+    """Return the page label as an int, or -1 if it is not numeric."""
+    try:
+        return int(str(page_label).strip())
+    except (TypeError, ValueError):
+        return -1
+
+
+class QueryFilter:
+    """
+    A metadata filter for scoping a query.
+
+    Values within a field are OR-ed (any of the given files), fields are
+    AND-ed together, and all tags must be present on a chunk.
+    """
+
+    def __init__(self, file_names=None, page_min=None, page_max=None, since=None,
+                 until=None, tags=None, doc_types=None):
+        """Initialize the filter; every argument is optional."""
+        self.file_names = set(file_names or [])
+        self.page_min = page_min
+        self.page_max = page_max
+        self.since = since
+        self.until = until
+        self.tags = set(tags or [])
+        self.doc_types = set(t.lower().lstrip(".") for t in (doc_types or []))
+
+    def is_empty(self):
+        """Return True if the filter does not restrict anything."""
+        return not (self.file_names or self.tags or self.doc_types
+                    or self.page_min is not None or self.page_max is not None
+                    or self.since or self.until)
+
+    def to_chroma_where(self):
+        """
+        Translate the filter into a ChromaDB ``where`` clause.
+
+        Returns:
+            dict: The where clause, or an empty dict if the filter is empty
+        """
+        clauses = []
+        if self.file_names:
+            clauses.append({"file_name": {"$in": sorted(self.file_names)}})
+        if self.doc_types:
+            clauses.append({"doc_type": {"$in": sorted(self.doc_types)}})
+        if self.page_min is not None:
+            clauses.append({"page_number": {"$gte": self.page_min}})
+        if self.page_max is not None:
+            clauses.append({"page_number": {"$lte": self.page_max}})
+        if self.since:
+            clauses.append({"ingest_day": {"$gte": date_to_day(self.since)}})
+        if self.until:
+            clauses.append({"ingest_day": {"$lte": date_to_day(self.until)}})
+        for tag in sorted(self.tags):
+            clauses.append({f"tag_{tag}": True})
+        if not clauses:
+            return {}
+        if len(clauses) == 1:
+            return clauses[0]
+        return {"$and": clauses}
+
+    def matches(self, metadata):
+        """
+        Check a metadata dict against the filter, for items kept outside ChromaDB.
+
+        Args:
+            metadata (dict): Metadata with the fields added at ingestion
+
+        Returns:
+            bool: True if the metadata passes every condition
+        """
+        if self.file_names and metadata.get("file_name") not in self.file_names:
+            return False
+        if self.doc_types and metadata.get("doc_type") not in self.doc_types:
+            return False
+        page = metadata.get("page_number")
+        if self.page_min is not None and (page is None or page < self.page_min):
+            return False
+        if self.page_max is not None and (page is None or page > self.page_max):
+            return False
+        day = metadata.get("ingest_day")
+        if self.since and (day is None or day < date_to_day(self.since)):
+            return False
+        if self.until and (day is None or day > date_to_day(self.until)):
+            return False
+        return all(metadata.get(f"tag_{tag}") for tag in self.tags)
+
+    def __repr__(self):
+        parts = []
+        if self.file_names:
+            parts.append(f"files={sorted(self.file_names)}")
+        if self.page_min is not None or self.page_max is not None:
+            parts.append(f"pages={self.page_min}-{self.page_max}")
+        if self.since or self.until:
+            parts.append(f"dates={self.since}..{self.until}")
+        if self.tags:
+            parts.append(f"tags={sorted(self.tags)}")
+        if self.doc_types:
+            parts.append(f"types={sorted(self.doc_types)}")
+        return f"QueryFilter({', '.join(parts)})"
+
+
+def parse_query_filters(text):
+    """
+    Split console input into the question and its metadata filter.
+
+    Supported tokens: ``@file:name.pdf``, ``@page:3`` or ``@page:3-7``,
+    ``@since:YYYY-MM-DD``, ``@until:YYYY-MM-DD``, ``@date:YYYY-MM-DD``,
+    ``@tag:name`` and ``@type:pdf``.
+
+    Args:
+        text (str): The raw user input
+
+    Returns:
+        tuple: (query, QueryFilter)
+
+    Raises:
+        ValueError: If a filter value cannot be parsed
+    """
+    query_filter = QueryFilter()
+    for field, value in FILTER_PATTERN.findall(text):
+        field = field.lower()
+        if field == "file":
+            query_filter.file_names.add(value)
+        elif field == "page":
+            start, sep, end = value.partition("-")
+            try:
+                query_filter.page_min = int(start) if start else None
+                if end:
+                    query_filter.page_max = int(end)
+                else:
+                    query_filter.page_max = None if sep else query_filter.page_min
+            except ValueError:
+                raise ValueError(f"Invalid page filter: {value}")
+        elif field in ("since", "until", "date"):
+            try:
+                date.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f"Invalid date filter (expected YYYY-MM-DD): {value}")
+            if field in ("since", "date"):
+                query_filter.since = value
+            if field in ("until", "date"):
+                query_filter.until = value
+        elif field == "tag":
+            query_filter.tags.add(value)
+        elif field == "type":
+            query_filter.doc_types.add(value.lower().lstrip("."))
+    query = " ".join(FILTER_PATTERN.sub("", text).split())
+    return query, query_filter
+
+
+class NodeIdTable:
+    """
+    Node IDs by ordinal, with a lookup from ID to ordinal.
+
+    UUID node IDs, as assigned by llama_index, are packed into 16 bytes each
+    rather than kept as str objects; other IDs are kept as strings. The lookup
+    is a sorted copy of the packed IDs with their ordinals, binary-searched with
+    numpy, plus a small dict of the IDs added since it was last sorted.
+    """
+
+    # IDs collected in the dict before they are merged into the sorted array
+    merge_min = 1024
+
+    def __init__(self):
+        """Initialize an empty table."""
+        self._packed = np.zeros(0, dtype="S16")
+        self._count = 0
+        self._sorted_ids = np.zeros(0, dtype="S16")
+        self._sorted_ordinals = np.zeros(0, dtype=np.uint32)
+        self._recent = {}
+        # Non-UUID IDs by ordinal and by ID; their packed slot stays empty
+        self._other = {}
+        self._other_ordinals = {}
+
+    def __len__(self):
+        return self._count
+
+    @staticmethod
+    def _pack(node_id):
+        """Return the 16 bytes of a canonical UUID string, or None for any other ID."""
+        # Only the lowercase, hyphenated form that str(uuid.UUID) gives back is packed
+        if not isinstance(node_id, str) or len(node_id) != 36 or node_id.count("-") != 4:
+            return None
+        if node_id[8] != "-" or node_id[13] != "-" or node_id[18] != "-" or node_id[23] != "-":
+            return None
+        digits = node_id.replace("-", "")
+        if digits != digits.lower():
+            return None
+        try:
+            packed = bytes.fromhex(digits)
+        except ValueError:
+            return None
+        # The nil UUID would be indistinguishable from the empty slot of a string ID
+        return packed if any(packed) else None
+
+    def _packed_at(self, ordinal):
+        # Element access on an S16 array strips trailing zero bytes
+        return self._packed[ordinal:ordinal + 1].tobytes()
+
+    def _merge(self):
+        """Sort all packed IDs into the lookup array and empty the dict."""
+        order = np.argsort(self._packed[:self._count], kind="stable")
+        self._sorted_ids = self._packed[order]
+        self._sorted_ordinals = order.astype(np.uint32)
+        self._recent = {}
+
+    def append(self, node_id):
+        """
+        Add an ID that is not in the table yet.
+
+        Args:
+            node_id (str): The node ID
+
+        Returns:
+            int: Its ordinal
+        """
+        ordinal = self._count
+        if ordinal == len(self._packed):
+            grown = np.zeros(max(16, ordinal + ordinal // 2), dtype="S16")
+            grown[:ordinal] = self._packed[:ordinal]
+            self._packed = grown
+        packed = self._pack(node_id)
+        if packed is None:
+            self._other[ordinal] = node_id
+            self._other_ordinals[node_id] = ordinal
+        else:
+            self._packed[ordinal] = packed
+            self._recent[packed] = ordinal
+        self._count += 1
+        if len(self._recent) >= max(self.merge_min, self._count // 16):
+            self._merge()
+        return ordinal
+
+    def ordinal(self, node_id):
+        """Return the ordinal of an ID, or None if it is not in the table."""
+        packed = self._pack(node_id)
+        if packed is None:
+            return self._other_ordinals.get(node_id)
+        ordinal = self._recent.get(packed)
+        if ordinal is not None:
+            return ordinal
+        position = int(self._sorted_ids.searchsorted(packed))
+        if position < len(self._sorted_ids):
+            ordinal = int(self._sorted_ordinals[position])
+            if self._packed_at(ordinal) == packed:
+                return ordinal
+        return None
+
+    def node_id(self, ordinal):
+        """Return the ID stored at an ordinal."""
+        if ordinal in self._other:
+            return self._other[ordinal]
+        return str(uuid.UUID(bytes=self._packed_at(ordinal)))
+
+    def memory_usage(self):
+        """
+        Estimate the memory held by the table.
+
+        Returns:
+            dict: Bytes of the packed IDs, of the lookup (the sorted IDs with their
+                ordinals and the dict of recent IDs) and of the IDs kept as strings
+        """
+        recent_bytes = sys.getsizeof(self._recent) + sum(sys.getsizeof(key) for key in self._recent)
+        other_bytes = (sys.getsizeof(self._other) + sys.getsizeof(self._other_ordinals)
+                       + sum(sys.getsizeof(node_id) for node_id in self._other_ordinals))
+        return {
+            "packed_bytes": self._packed.nbytes,
+            "lookup_bytes": self._sorted_ids.nbytes + self._sorted_ordinals.nbytes + recent_bytes,
+            "string_bytes": other_bytes,
+        }
+
+
+class MetadataIndex:
+    """
+    In-memory indexes over chunk metadata.
+
+    Each chunk is assigned an integer ordinal in insertion order. File names
+    and document types are stored as one integer ID per chunk, page numbers and
+    ingest days as integer columns, and tags as arrays of ordinals. Adding a
+    chunk only appends to these columns; filters are evaluated over whole
+    columns with numpy into a boolean mask of ordinals.
+    """
+
+    def __init__(self):
+        """Initialize empty indexes."""
+        self.node_ids = NodeIdTable()
+        self.file_ids = {}
+        self.type_ids = {}
+        self.tag_ordinals = {}
+        self.files = array("i")
+        self.types = array("i")
+        self.pages = array("q")
+        # Ingest days as YYYYMMDD, 0 where unknown
+        self.days = array("q")
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def add(self, node_id, metadata):
+        """
+        Index a chunk.
+
+        Args:
+            node_id (str): The node ID as stored in the vector store
+            metadata (dict): The chunk metadata
+        """
+        if self.node_ids.ordinal(node_id) is not None:
+            return
+        ordinal = self.node_ids.append(node_id)
+
+        file_name = metadata.get("file_name")
+        self.files.append(self.file_ids.setdefault(file_name, len(self.file_ids)) if file_name else -1)
+        doc_type = metadata.get("doc_type")
+        self.types.append(self.type_ids.setdefault(doc_type, len(self.type_ids)) if doc_type else -1)
+        for tag in filter(None, str(metadata.get("tags", "")).split(",")):
+            self.tag_ordinals.setdefault(tag, array("q")).append(ordinal)
+
+        page = metadata.get("page_number")
+        if page is None:
+            page = parse_page_number(metadata.get("page_label"))
+        self.pages.append(int(page))
+        self.days.append(int(metadata.get("ingest_day") or 0))
+
+    @staticmethod
+    def _in_ids(column, ids):
+        """Return the mask of a categorical column's entries that hold one of the IDs."""
+        return np.isin(np.array(column), list(ids))
+
+    @staticmethod
+    def _in_range(column, low, high):
+        """Return the mask of a numeric column's entries within [low, high]."""
+        values = np.array(column)
+        mask = np.ones(len(values), dtype=bool)
+        if low is not None:
+            mask &= values >= low
+        if high is not None:
+            mask &= values <= high
+        return mask
+
+    def select(self, query_filter):
+        """
+        Resolve a filter to a mask of matching ordinals.
+
+        Args:
+            query_filter (QueryFilter): The filter to apply
+
+        Returns:
+            numpy.ndarray: Boolean mask indexed by chunk ordinal
+        """
+        mask = np.ones(len(self.node_ids), dtype=bool)
+        if query_filter.file_names:
+            ids = [self.file_ids[name] for name in query_filter.file_names if name in self.file_ids]
+            mask &= self._in_ids(self.files, ids)
+        if query_filter.doc_types:
+            ids = [self.type_ids[name] for name in query_filter.doc_types if name in self.type_ids]
+            mask &= self._in_ids(self.types, ids)
+        for tag in query_filter.tags:
+            tagged = np.zeros(len(self.node_ids), dtype=bool)
+            tagged[np.array(self.tag_ordinals.get(tag, array("q")), dtype=np.intp)] = True
+            mask &= tagged
+        if mask.any() and (query_filter.page_min is not None or query_filter.page_max is not None):
+            mask &= self._in_range(self.pages, query_filter.page_min, query_filter.page_max)
+        if mask.any() and (query_filter.since or query_filter.until):
+            low = date_to_day(query_filter.since) if query_filter.since else 1
+            high = date_to_day(query_filter.until) if query_filter.until else None
+            mask &= self._in_range(self.days, low, high)
+        return mask
+
+    def ordinal(self, node_id):
+        """Return the ordinal of a node ID, or None if the chunk is not indexed."""
+        return self.node_ids.ordinal(node_id)
+
+    def count(self, mask):
+        """Return the number of chunks in a mask."""
+        return int(np.count_nonzero(mask))
+
+    def node_ids_for(self, mask):
+        """Return the node IDs whose ordinals are set in a mask."""
+        return [self.node_ids.node_id(int(ordinal)) for ordinal in np.flatnonzero(mask)]
+
+    def file_counts(self):
+        """Return the number of chunks per file name."""
+        files = np.array(self.files)
+        counts = np.bincount(files[files >= 0], minlength=len(self.file_ids))
+        return {name: int(counts[file_id]) for name, file_id in self.file_ids.items()}
+
+    def memory_usage(self):
+        """
+        Estimate the memory held by the indexes.
+
+        Returns:
+            dict: Bytes of the node IDs, of the ID-to-ordinal and value lookups, of
+                the integer columns and tag arrays, and the per-chunk total
+        """
+        id_usage = self.node_ids.memory_usage()
+        id_bytes = id_usage["packed_bytes"] + id_usage["string_bytes"]
+        lookup_bytes = id_usage["lookup_bytes"] + sum(
+            sys.getsizeof(ids) + sum(sys.getsizeof(value) for value in ids)
+            for ids in (self.file_ids, self.type_ids, self.tag_ordinals)
+        )
+        columns = [self.files, self.types, self.pages, self.days, *self.tag_ordinals.values()]
+        column_bytes = sum(len(column) * column.itemsize for column in columns)
+        count = len(self.node_ids)
+        total = id_bytes + lookup_bytes + column_bytes
+        return {
+            "chunks": count,
+            "id_bytes": id_bytes,
+            "lookup_bytes": lookup_bytes,
+            "column_bytes": column_bytes,
+            "bytes_per_chunk": total / count if count else 0.0,
+        }
@@ -0,0 +1,459 @@
+"""
+Shared Gemini client for the PDF Document Processor
+---------------------------------------------------
+Owns the process-wide Gemini configuration and the long-lived API clients for
+generation and embedding, so that no query pays for client or connection
+setup. The underlying transport (gRPC by default, or REST) keeps its
+connections open between calls.
+
+Every call goes through the same wrapper, which checks a circuit breaker,
+waits for the shared API rate budget of the scheduler, retries transient
+errors with exponential backoff and records per-call latency. The deadline
+of each attempt is passed to the API call itself, so a timed-out request is
+cancelled by the transport rather than left running. The breaker opens after
+repeated calls fail with server, timeout or connection errors.
+
+Use ``set_client(StubClient())`` to run without network access.
+"""
+
+import os
+import time
+import random
+import hashlib
+import logging
+import threading
+from collections import deque
+
+import numpy as np
+import google.generativeai as genai
+import google.ai.generativelanguage as glm
+from google.api_core import exceptions as api_exceptions
+from google.generativeai import client as genai_client
+from google.generativeai.types import content_types, generation_types
+
+from scheduler import get_scheduler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GENERATION_MODEL = "models/gemini-1.5-pro-001"
+DEFAULT_EMBEDDING_MODEL = "models/text-embedding-004"
+
+# Maximum number of texts the embedding API accepts in one request
+EMBED_BATCH_SIZE = 100
+
+RETRYABLE_ERRORS = (
+    api_exceptions.ResourceExhausted,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.InternalServerError,
+    TimeoutError,
+    ConnectionError,
+)
+
+# Errors showing the service itself is failing; only these count towards the
+# circuit breaker, while rejected requests (4xx, including 429) do not
+BREAKER_ERRORS = (
+    api_exceptions.ServerError,
+    api_exceptions.DeadlineExceeded,
+    TimeoutError,
+    ConnectionError,
+)
+
+
+class CircuitBreakerOpenError(RuntimeError):
+    """Raised when a call is rejected because the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Rejects calls for a cool-down period after repeated consecutive failures.
+
+    After ``reset_timeout`` seconds one trial call is let through (half-open);
+    its success closes the breaker again, its failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        """Initialize a closed breaker."""
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """Return 'closed', 'open' or 'half-open'."""
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def before_call(self):
+        """
+        Check whether a call may proceed.
+
+        Raises:
+            CircuitBreakerOpenError: If the breaker is open
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return
+            elapsed = time.monotonic() - self.opened_at
+            if elapsed >= self.reset_timeout and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            raise CircuitBreakerOpenError(
+                f"Gemini API circuit breaker is open after {self.failures} failures; "
+                f"retrying in {max(self.reset_timeout - elapsed, 0):.0f}s"
+            )
+
+    def record_success(self):
+        """Close the breaker after a successful call."""
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """End a half-open trial call that failed for a reason unrelated to the service's health."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        """Count a failed call and open the breaker if the threshold is reached."""
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class LatencyStats:
+    """Keeps a rolling window of call latencies and error counts for one operation."""
+
+    def __init__(self, window=1000):
+        """Initialize empty statistics."""
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds, error=False):
+        """Record one call."""
+        with self._lock:
+            self.calls += 1
+            if error:
+                self.errors += 1
+            else:
+                self.latencies.append(seconds)
+
+    def summary(self):
+        """
+        Summarize the recorded calls.
+
+        Returns:
+            dict: Call and error counts and latency mean, p50 and p95 in milliseconds
+        """
+        with self._lock:
+            latencies = sorted(self.latencies)
+            calls, errors = self.calls, self.errors
+        summary = {"calls": calls, "errors": errors}
+        if latencies:
+            summary["mean_ms"] = 1000 * sum(latencies) / len(latencies)
+            summary["p50_ms"] = 1000 * latencies[len(latencies) // 2]
+            summary["p95_ms"] = 1000 * latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+        return summary
+
+
+class BaseClient:
+    """Call wrapper shared by the real and stub clients."""
+
+    def __init__(self, timeout=60.0, max_retries=3, backoff=0.5, breaker=None):
+        """
+        Initialize the call wrapper.
+
+        Args:
+            timeout (float): Deadline in seconds for a single attempt
+            max_retries (int): Number of retries for transient errors
+            backoff (float): Initial backoff in seconds, doubled on every retry
+            breaker (CircuitBreaker): Breaker shared by all calls
+        """
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+    def _stats_for(self, operation):
+        with self._stats_lock:
+            return self.stats.setdefault(operation, LatencyStats())
+
+    def _record_failure(self, error):
+        """Report a failed call to the breaker, which counts only service failures."""
+        if isinstance(error, BREAKER_ERRORS):
+            self.breaker.record_failure()
+        else:
+            self.breaker.release_trial()
+
+    def call(self, operation, fn, *args, **kwargs):
+        """
+        Run an API call with retries, circuit breaker and latency tracking.
+
+        The breaker is checked once per call, before any rate budget is used,
+        and a call that fails after all its retries counts as one failure.
+        ``fn`` runs on the calling thread and must apply ``self.timeout`` to
+        the request it makes.
+
+        Args:
+            operation (str): Name used for the latency statistics
+            fn (callable): The call to make
+
+        Returns:
+            The result of ``fn``
+
+        Raises:
+            CircuitBreakerOpenError: If the breaker is open
+        """
+        stats = self._stats_for(operation)
+        self.breaker.before_call()
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            # Interactive calls are served first from the shared rate budget
+            get_scheduler().acquire_api()
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                stats.record(time.perf_counter() - start, error=True)
+                if attempt == self.max_retries:
+                    self._record_failure(e)
+                    raise
+                logger.warning(f"{operation} failed ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay + random.uniform(0, delay / 2))
+                delay *= 2
+                continue
+            except Exception as e:
+                stats.record(time.perf_counter() - start, error=True)
+                self._record_failure(e)
+                raise
+            elapsed = time.perf_counter() - start
+            stats.record(elapsed)
+            self.breaker.record_success()
+            logger.debug(f"{operation} took {elapsed * 1000:.0f} ms")
+            return result
+
+    def latency_report(self):
+        """Return the latency summary of every operation."""
+        with self._stats_lock:
+            operations = dict(self.stats)
+        return {operation: stats.summary() for operation, stats in operations.items()}
+
+    def embed(self, texts, task_type="RETRIEVAL_DOCUMENT", model_name=None):
+        """
+        Embed a batch of texts.
+
+        Args:
+            texts (list): The texts to embed
+            task_type (str): RETRIEVAL_DOCUMENT or RETRIEVAL_QUERY
+            model_name (str): The embedding model (defaults to the client's)
+
+        Returns:
+            list: One embedding per text
+        """
+        embeddings = []
+        for start in range(0, len(texts), EMBED_BATCH_SIZE):
+            batch = list(texts[start:start + EMBED_BATCH_SIZE])
+            embeddings.extend(self.call("embed", self._embed_batch, batch, task_type, model_name))
+        return embeddings
+
+    def embed_one(self, text, task_type="RETRIEVAL_QUERY", model_name=None):
+        """Embed a single text."""
+        return self.embed([text], task_type, model_name)[0]
+
+    def generate(self, prompt, model_name=None):
+        """
+        Generate text for a prompt.
+
+        Args:
+            prompt (str): The prompt
+            model_name (str): The generative model (defaults to the client's)
+
+        Returns:
+            str: The generated text
+        """
+        return self.call("generate", self._generate, prompt, model_name)
+
+    def list_models(self):
+        """Return the names of the models available to the client."""
+        return self.call("list_models", self._list_models)
+
+    def _embed_batch(self, texts, task_type, model_name):
+        raise NotImplementedError
+
+    def _generate(self, prompt, model_name):
+        raise NotImplementedError
+
+    def _list_models(self):
+        raise NotImplementedError
+
+
+class GeminiClient(BaseClient):
+    """Long-lived client for the Gemini generation and embedding APIs."""
+
+    def __init__(self, api_key, generation_model=DEFAULT_GENERATION_MODEL,
+                 embedding_model=DEFAULT_EMBEDDING_MODEL, transport=None, **kwargs):
+        """
+        Configure the Gemini API once for the whole process.
+
+        Args:
+            api_key (str): The Google API key
+            generation_model (str): Default generative model
+            embedding_model (str): Default embedding model
+            transport (str): 'grpc' (default) or 'rest'
+            **kwargs: Timeout, retry and breaker settings passed to BaseClient
+        """
+        super().__init__(**kwargs)
+        if not api_key:
+            raise ValueError("GOOGLE_API_KEY environment variable not set")
+        self.api_key = api_key
+        self.generation_model = generation_model
+        self.embedding_model = embedding_model
+        genai.configure(api_key=api_key, transport=transport)
+        self._available_models = None
+
+    # The SDK's module-level helpers (genai.embed_content, GenerativeModel)
+    # accept no deadline in the pinned release, so requests go to the
+    # generated API clients, whose methods take a per-call ``timeout``.
+    # Retries are left to BaseClient.call.
+
+    def _embed_batch(self, texts, task_type, model_name):
+        model = model_name or self.embedding_model
+        request = glm.BatchEmbedContentsRequest(
+            model=model,
+            requests=[
+                glm.EmbedContentRequest(
+                    model=model,
+                    content=content_types.to_content(text),
+                    task_type=task_type
+                )
+                for text in texts
+            ]
+        )
+        response = genai_client.get_default_generative_client().batch_embed_contents(
+            request, timeout=self.timeout, retry=None
+        )
+        return [list(embedding.values) for embedding in response.embeddings]
+
+    def _generate(self, prompt, model_name):
+        request = glm.GenerateContentRequest(
+            model=model_name or self.generation_model,
+            contents=[content_types.to_content(prompt)]
+        )
+        response = genai_client.get_default_generative_client().generate_content(
+            request, timeout=self.timeout, retry=None
+        )
+        return generation_types.GenerateContentResponse.from_response(response).text
+
+    def _list_models(self):
+        if self._available_models is None:
+            pages = genai_client.get_default_model_client().list_models(
+                glm.ListModelsRequest(page_size=50), timeout=self.timeout, retry=None
+            )
+            self._available_models = [m.name for m in pages]
+        return self._available_models
+
+
+class StubClient(BaseClient):
+    """
+    Offline stand-in for GeminiClient.
+
+    Embeddings are deterministic hashed bag-of-words vectors, so similar texts
+    still retrieve each other; generation echoes the question.
+    """
+
+    def __init__(self, dimension=768, latency=0.0, **kwargs):
+        """
+        Initialize the stub.
+
+        Args:
+            dimension (int): Embedding dimension
+            latency (float): Seconds each call sleeps to simulate network time;
+                a latency above the timeout fails the call with DeadlineExceeded
+        """
+        kwargs.setdefault("max_retries", 0)
+        super().__init__(**kwargs)
+        self.dimension = dimension
+        self.latency = latency
+        self.generation_model = "stub-generation"
+        self.embedding_model = "stub-embedding"
+
+    def _wait(self):
+        if self.latency > self.timeout:
+            time.sleep(self.timeout)
+            raise api_exceptions.DeadlineExceeded(f"stub call exceeded {self.timeout}s")
+        time.sleep(self.latency)
+
+    def _vector(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for token in str(text).lower().split():
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dimension] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _embed_batch(self, texts, task_type, model_name):
+        self._wait()
+        return [self._vector(text) for text in texts]
+
+    def _generate(self, prompt, model_name):
+        self._wait()
+        question = prompt.split("Please answer this question:")[-1].split("\n")[0].strip()
+        return f"Stub answer to: {question}"
+
+    def _list_models(self):
+        return [self.generation_model, self.embedding_model]
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client(api_key=None):
+    """
+    Return the shared client, creating a GeminiClient on first use.
+
+    Settings are read from GEMINI_TIMEOUT, GEMINI_MAX_RETRIES and GEMINI_TRANSPORT.
+
+    Args:
+        api_key (str): API key to use if the client does not exist yet
+            (defaults to GOOGLE_API_KEY)
+
+    Returns:
+        BaseClient: The shared client
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = GeminiClient(
+                api_key or os.getenv("GOOGLE_API_KEY"),
+                transport=os.getenv("GEMINI_TRANSPORT") or None,
+                timeout=float(os.getenv("GEMINI_TIMEOUT", "60")),
+                max_retries=int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+            )
+        return _client
+
+
+def set_client(client):
+    """
+    Replace the shared client, for example with a StubClient in tests.
+
+    Args:
+        client (BaseClient): The client to use, or None to recreate it on next use
+    """
+    global _client
+    with _client_lock:
+        _client = client
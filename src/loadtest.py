@@ -0,0 +1,635 @@
+#!/usr/bin/env python3
+"""
+Load testing for the PDF Document Processor
+-------------------------------------------
+Replays a query workload against a PDFProcessor in this process, or against
+a server endpoint, and reports throughput, latency percentiles overall and
+per stage, error rates and queue depths.
+
+Two arrival models are supported:
+
+    open loop    queries arrive at a fixed rate (--rate), Poisson or evenly
+                 spaced, whether or not earlier ones have finished; latency
+                 is measured from the scheduled arrival, so queueing counts
+    closed loop  a fixed number of clients (--concurrency) each send the next
+                 query as soon as the previous answer arrives
+
+In-process runs use fake backends by default: hashed embeddings and the
+extractive generator, delayed by configurable latency distributions and
+failing at a configurable rate, so runs are cheap and repeatable. The query
+embedding cache is disabled unless --query-cache is given, so that a small
+workload replayed many times measures the embed stage like unique traffic.
+
+Examples:
+
+    python src/loadtest.py --rate 20 --duration 60 --embed-latency lognormal:40,0.5 \\
+        --generate-latency lognormal:900,0.4
+    python src/loadtest.py --concurrency 16 --requests 2000 --background-ingest
+    python src/loadtest.py --serve 8080
+    python src/loadtest.py --url http://localhost:8080/query --rate 5
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import tempfile
+import argparse
+import threading
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from backends import EmbeddingError, HashingEmbedding, LocalGenerator
+from filters import parse_query_filters
+from scheduler import get_scheduler
+from warmup import QueryEmbeddingCache, load_queries
+
+logger = logging.getLogger(__name__)
+
+# Prefix of the answers query_documents returns when a query fails
+ERROR_PREFIX = "Error processing your query:"
+
+DEFAULT_QUERIES = [
+    "What is artificial intelligence?",
+    "What are neural networks?",
+    "What is machine learning?",
+    "What are the applications of machine learning?",
+    "What is deep learning?",
+    "What is the difference between supervised and unsupervised learning?",
+]
+
+
+class LatencyDistribution:
+    """
+    A latency distribution parsed from a spec in milliseconds.
+
+    Specs: ``0``, ``constant:MS``, ``uniform:LOW,HIGH``, ``normal:MEAN,STDDEV``,
+    ``exponential:MEAN`` and ``lognormal:MEDIAN,SIGMA``.
+    """
+
+    KINDS = ("constant", "uniform", "normal", "exponential", "lognormal")
+
+    def __init__(self, spec="0", seed=None):
+        """
+        Parse a spec.
+
+        Args:
+            spec (str): The distribution spec
+            seed (int): Seed of the random generator
+        """
+        self.spec = spec
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        kind, _, params = str(spec).partition(":")
+        if not params:
+            kind, params = "constant", kind
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency distribution '{kind}'; expected one of {', '.join(self.KINDS)}")
+        self.kind = kind
+        self.params = [float(value) for value in params.split(",")]
+
+    def sample(self):
+        """Return one latency in seconds."""
+        with self._lock:
+            if self.kind == "constant":
+                ms = self.params[0]
+            elif self.kind == "uniform":
+                ms = self._random.uniform(*self.params[:2])
+            elif self.kind == "normal":
+                ms = self._random.gauss(*self.params[:2])
+            elif self.kind == "exponential":
+                ms = self._random.expovariate(1.0 / self.params[0]) if self.params[0] else 0.0
+            else:
+                ms = self._random.lognormvariate(0.0, self.params[1]) * self.params[0]
+        return max(ms, 0.0) / 1000.0
+
+    def __repr__(self):
+        return f"LatencyDistribution('{self.spec}')"
+
+
+class FakeEmbedding(HashingEmbedding):
+    """Hashed embeddings whose query calls take a sampled time and fail at a given rate."""
+
+    _latency = PrivateAttr(default=None)
+    _error_rate = PrivateAttr(default=0.0)
+
+    def __init__(self, latency=None, error_rate=0.0, dimension=512):
+        """
+        Initialize the fake.
+
+        Args:
+            latency (LatencyDistribution): Time taken by each query embedding call
+            error_rate (float): Probability that a query embedding call fails
+            dimension (int): The embedding dimension
+        """
+        super().__init__(dimension=dimension)
+        self._latency = latency or LatencyDistribution()
+        self._error_rate = error_rate
+
+    def _simulate(self):
+        time.sleep(self._latency.sample())
+        if self._error_rate and random.random() < self._error_rate:
+            raise EmbeddingError("Simulated embedding failure")
+
+    def _get_query_embedding(self, query: str) -> list:
+        """Get embedding for a query string after the simulated delay."""
+        self._simulate()
+        return super()._get_query_embedding(query)
+
+    def get_query_embedding_batch(self, queries: list) -> list:
+        """Get embeddings for multiple query strings after the simulated delay."""
+        self._simulate()
+        return super().get_query_embedding_batch(queries)
+
+
+class FakeGenerator(LocalGenerator):
+    """Extractive generator whose calls take a sampled time and fail at a given rate."""
+
+    model_name = "fake-generator"
+
+    def __init__(self, latency=None, error_rate=0.0):
+        """
+        Initialize the fake.
+
+        Args:
+            latency (LatencyDistribution): Time taken by each generation call
+            error_rate (float): Probability that a generation call fails
+        """
+        super().__init__()
+        self.latency = latency or LatencyDistribution()
+        self.error_rate = error_rate
+
+    def generate(self, prompt):
+        """Answer a prompt after the simulated delay."""
+        time.sleep(self.latency.sample())
+        if self.error_rate and random.random() < self.error_rate:
+            raise RuntimeError("Simulated generation failure")
+        return super().generate(prompt)
+
+
+def percentiles(values):
+    """
+    Summarize latencies.
+
+    Args:
+        values (list): Latencies in seconds
+
+    Returns:
+        dict: Count, mean, p50, p90, p95, p99 and max in milliseconds
+    """
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def at(fraction):
+        return 1000 * ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": 1000 * sum(ordered) / len(ordered),
+        "p50_ms": at(0.50),
+        "p90_ms": at(0.90),
+        "p95_ms": at(0.95),
+        "p99_ms": at(0.99),
+        "max_ms": 1000 * ordered[-1],
+    }
+
+
+class InProcessTarget:
+    """Sends queries to a PDFProcessor in this process and times its stages."""
+
+    def __init__(self, processor):
+        """Observe the query stages of ``processor`` so their durations are recorded per query."""
+        self.processor = processor
+        self._current = threading.local()
+        processor.stage_observer = self._record
+
+    def _record(self, stage, seconds):
+        # Called in the thread that ran the stage; retrieve includes embed when it embeds itself
+        timings = getattr(self._current, "timings", None)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+    def answer(self, query):
+        """
+        Answer one query.
+
+        Returns:
+            tuple: (answer, error message or None, stage timings in seconds)
+        """
+        self._current.timings = {}
+        try:
+            text, filters = parse_query_filters(query)
+            answer = self.processor.query_documents(text, filters)
+            error = answer[len(ERROR_PREFIX):].strip() if answer.startswith(ERROR_PREFIX) else None
+            return answer, error, self._current.timings
+        finally:
+            self._current.timings = None
+
+    def __call__(self, query):
+        """Answer one query and return (error message or None, stage timings in seconds)."""
+        _, error, timings = self.answer(query)
+        return error, timings
+
+
+class HttpTarget:
+    """Sends queries to a server endpoint as JSON POST requests."""
+
+    def __init__(self, url, timeout=60.0):
+        """
+        Initialize the target.
+
+        Args:
+            url (str): Endpoint accepting {"question": ...} and returning {"answer": ...},
+                optionally with "timings" in seconds per stage
+            timeout (float): Request timeout in seconds
+        """
+        self.url = url
+        self.timeout = timeout
+
+    def __call__(self, query):
+        """
+        Answer one query.
+
+        Returns:
+            tuple: (error message or None, stage timings in seconds)
+        """
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps({"question": query}).encode("utf-8"),
+            headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            body = json.loads(response.read().decode("utf-8"))
+        answer = body.get("answer", "")
+        error = body.get("error") or (answer[len(ERROR_PREFIX):].strip() if answer.startswith(ERROR_PREFIX) else None)
+        return error, body.get("timings", {})
+
+
+class LoadTest:
+    """Drives a target with an open-loop arrival rate or a closed-loop concurrency."""
+
+    def __init__(self, target, queries, rate=None, concurrency=None, duration=30.0, max_requests=None,
+                 arrival="poisson", max_workers=256, sample_interval=0.1, sample_scheduler=True, seed=0):
+        """
+        Initialize the test.
+
+        Args:
+            target (callable): Answers a query and returns (error or None, stage timings)
+            queries (Counter): Queries with their relative frequency
+            rate (float): Open-loop arrivals per second
+            concurrency (int): Closed-loop number of clients (used if no rate is given)
+            duration (float): Seconds to generate load for
+            max_requests (int): Stop after this many requests
+            arrival (str): poisson or uniform spacing of open-loop arrivals
+            max_workers (int): Open-loop worker threads; arrivals beyond them queue
+            sample_interval (float): Seconds between queue depth samples
+            sample_scheduler (bool): Also sample the queues of this process's scheduler
+            seed (int): Seed for query selection and arrival times
+        """
+        if not rate and not concurrency:
+            raise ValueError("Either a rate or a concurrency is required")
+        self.target = target
+        self.queries = list(queries)
+        self.weights = [queries[query] for query in self.queries]
+        self.rate = rate
+        self.concurrency = concurrency
+        self.duration = duration
+        self.max_requests = max_requests
+        self.arrival = arrival
+        self.max_workers = max_workers
+        self.sample_interval = sample_interval
+        self.sample_scheduler = sample_scheduler
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.latencies = []
+        self.stage_latencies = {}
+        self.errors = Counter()
+        self.sent = 0
+        self.completed = 0
+        self.pending = 0
+        self.in_flight = 0
+        self.depth_samples = {}
+
+    def _next_query(self):
+        with self._lock:
+            return self._random.choices(self.queries, self.weights)[0]
+
+    def _run_one(self, query, scheduled):
+        with self._lock:
+            self.pending -= 1
+            self.in_flight += 1
+        error = None
+        timings = {}
+        try:
+            error, timings = self.target(query)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        elapsed = time.perf_counter() - scheduled
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+            if error:
+                self.errors[error[:120]] += 1
+            else:
+                self.latencies.append(elapsed)
+            for stage, seconds in timings.items():
+                self.stage_latencies.setdefault(stage, []).append(seconds)
+
+    def _sample_depths(self, stopped):
+        scheduler = get_scheduler()
+        while not stopped.wait(self.sample_interval):
+            with self._lock:
+                depths = {"waiting to start": self.pending, "in flight": self.in_flight}
+            if self.sample_scheduler:
+                depths.update({f"scheduler {name}": waiting for name, waiting in scheduler.queue_depths().items()})
+            with self._lock:
+                for name, depth in depths.items():
+                    self.depth_samples.setdefault(name, []).append(depth)
+
+    def _take_request(self, deadline):
+        with self._lock:
+            if time.perf_counter() >= deadline or (self.max_requests and self.sent >= self.max_requests):
+                return False
+            self.sent += 1
+            self.pending += 1
+            return True
+
+    def _open_loop(self, deadline):
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="load") as executor:
+            scheduled = time.perf_counter()
+            while True:
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                if scheduled >= deadline or not self._take_request(deadline):
+                    break
+                executor.submit(self._run_one, self._next_query(), scheduled)
+                if self.arrival == "poisson":
+                    scheduled += self._random.expovariate(self.rate)
+                else:
+                    scheduled += 1.0 / self.rate
+
+    def _closed_loop(self, deadline):
+        def client():
+            while self._take_request(deadline):
+                self._run_one(self._next_query(), time.perf_counter())
+
+        threads = [threading.Thread(target=client, name=f"load-{i}") for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run(self):
+        """
+        Run the test.
+
+        Returns:
+            dict: The report
+        """
+        self._reset()
+        stopped = threading.Event()
+        sampler = threading.Thread(target=self._sample_depths, args=(stopped,), name="load-sampler", daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        deadline = start + self.duration if self.duration else float("inf")
+        if self.rate:
+            self._open_loop(deadline)
+        else:
+            self._closed_loop(deadline)
+        elapsed = time.perf_counter() - start
+        stopped.set()
+        sampler.join()
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        """
+        Summarize the last run.
+
+        Args:
+            elapsed (float): Wall-clock seconds from the first request to the last answer
+
+        Returns:
+            dict: Throughput, latency percentiles overall and per stage, errors and queue depths
+        """
+        with self._lock:
+            error_count = sum(self.errors.values())
+            return {
+                "mode": f"open loop at {self.rate}/s ({self.arrival})" if self.rate
+                        else f"closed loop with {self.concurrency} clients",
+                "elapsed_s": elapsed,
+                "requests": self.completed,
+                "succeeded": self.completed - error_count,
+                "errors": error_count,
+                "error_rate": error_count / self.completed if self.completed else 0.0,
+                "throughput_rps": (self.completed - error_count) / elapsed if elapsed else 0.0,
+                "latency": percentiles(self.latencies),
+                "stages": {stage: percentiles(values) for stage, values in self.stage_latencies.items()},
+                "error_types": dict(self.errors.most_common(10)),
+                "queue_depths": {
+                    name: {"mean": sum(samples) / len(samples), "max": max(samples)}
+                    for name, samples in self.depth_samples.items() if samples
+                },
+            }
+
+
+def format_report(report):
+    """Return a load test report as lines of text."""
+
+    def latency(summary):
+        if not summary.get("count"):
+            return "no samples"
+        return (f"p50 {summary['p50_ms']:.0f} ms, p90 {summary['p90_ms']:.0f} ms, p95 {summary['p95_ms']:.0f} ms, "
+                f"p99 {summary['p99_ms']:.0f} ms, max {summary['max_ms']:.0f} ms ({summary['count']} samples)")
+
+    lines = [
+        f"Mode: {report['mode']}",
+        f"Requests: {report['requests']} in {report['elapsed_s']:.1f} s, {report['throughput_rps']:.2f} answers/s",
+        f"Errors: {report['errors']} ({report['error_rate']:.1%})",
+        f"Latency: {latency(report['latency'])}",
+        "Stages:",
+    ]
+    lines.extend(f"  {stage}: {latency(summary)}" for stage, summary in report["stages"].items())
+    if report["error_types"]:
+        lines.append("Error types:")
+        lines.extend(f"  {count} x {error}" for error, count in report["error_types"].items())
+    lines.append("Queue depths:")
+    lines.extend(f"  {name}: mean {depth['mean']:.1f}, max {depth['max']}"
+                 for name, depth in report["queue_depths"].items())
+    return lines
+
+
+def serve(processor, port, host="127.0.0.1"):
+    """
+    Serve a processor over HTTP for load tests through an endpoint.
+
+    POST /query with {"question": ...} returns {"answer": ..., "timings": {...}}.
+
+    Args:
+        processor (PDFProcessor): The processor to serve
+        port (int): Port to listen on
+        host (str): Interface to listen on
+    """
+    target = InProcessTarget(processor)
+
+    class QueryHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != "/query":
+                self.send_error(404)
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                answer, error, timings = target.answer(str(body.get("question", "")))
+                status, payload = 200, {"answer": answer, "error": error, "timings": timings}
+            except Exception as e:
+                status, payload = 500, {"error": str(e)}
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    logger.warning(f"Serving queries on http://{host}:{port}/query")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def build_processor(args):
+    """Build and load the processor for an in-process run."""
+    from main import PDFProcessor
+
+    # Without the cache every query is embedded, as if each one were asked for the first time
+    query_cache = None if args.query_cache else QueryEmbeddingCache(max_entries=0)
+    if args.real_backends:
+        processor = PDFProcessor(document_dir=args.documents, query_cache=query_cache)
+    else:
+        processor = PDFProcessor(
+            document_dir=args.documents,
+            embedding_backend="hashing",
+            generation_backend="local",
+            query_cache=query_cache
+        )
+        processor.embed_model = FakeEmbedding(LatencyDistribution(args.embed_latency, args.seed), args.error_rate)
+        processor.generator = FakeGenerator(LatencyDistribution(args.generate_latency, args.seed), args.error_rate)
+    if not processor.load_documents():
+        raise SystemExit(f"No documents could be indexed from {processor.document_dir}")
+    return processor
+
+
+def background_ingest(args, stopped):
+    """Re-ingest the documents into a separate collection until ``stopped`` is set."""
+    from main import PDFProcessor
+
+    backends = {} if args.real_backends else {"embedding_backend": "hashing", "generation_backend": "local"}
+    # Its own retry queue, so re-ingesting never clears or fills the queue of the real documents
+    queue_dir = tempfile.mkdtemp(prefix="loadtest_ingest_")
+    processor = PDFProcessor(
+        collection_name="loadtest_ingest",
+        document_dir=args.documents,
+        retry_queue_path=os.path.join(queue_dir, PDFProcessor.retry_queue_file),
+        **backends
+    )
+    rounds = 0
+    try:
+        while not stopped.is_set():
+            processor.reset_collection()
+            processor.load_documents()
+            rounds += 1
+    finally:
+        shutil.rmtree(queue_dir, ignore_errors=True)
+    logger.warning(f"Background ingestion completed {rounds} rounds")
+
+
+def main():
+    """Run a load test from the command line."""
+    parser = argparse.ArgumentParser(description="Load test the PDF Document Processor query path.")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--rate", type=float, help="open loop: queries per second")
+    load.add_argument("--concurrency", type=int, help="closed loop: number of concurrent clients")
+    load.add_argument("--serve", type=int, metavar="PORT", help="serve the processor over HTTP instead")
+    parser.add_argument("--arrival", choices=("poisson", "uniform"), default="poisson",
+                        help="spacing of open-loop arrivals")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to generate load for")
+    parser.add_argument("--requests", type=int, help="stop after this many requests")
+    parser.add_argument("--queries", help="workload file (query or count<TAB>query per line)")
+    parser.add_argument("--url", help="send queries to this endpoint instead of an in-process processor")
+    parser.add_argument("--documents", help="Document directory for in-process runs")
+    parser.add_argument("--real-backends", action="store_true",
+                        help="use the configured backends instead of fakes")
+    parser.add_argument("--embed-latency", default="lognormal:40,0.5", help="fake query embedding latency (ms)")
+    parser.add_argument("--generate-latency", default="lognormal:800,0.4", help="fake generation latency (ms)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fake backend failure probability")
+    parser.add_argument("--query-cache", action="store_true",
+                        help="keep the query embedding cache, so repeated queries skip the embed stage")
+    parser.add_argument("--background-ingest", action="store_true",
+                        help="re-ingest the documents in the background during the test")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--json", help="also write the report to this JSON file")
+    args = parser.parse_args()
+
+    # Configured before main is imported so that per-query INFO logging stays off
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    if args.serve:
+        serve(build_processor(args), args.serve)
+        return
+    if not args.rate and not args.concurrency:
+        parser.error("one of --rate, --concurrency or --serve is required")
+
+    queries = load_queries(args.queries) if args.queries else Counter(DEFAULT_QUERIES)
+    if not queries:
+        parser.error(f"no queries found in {args.queries}")
+    target = HttpTarget(args.url) if args.url else InProcessTarget(build_processor(args))
+
+    stopped = threading.Event()
+    ingest = None
+    if args.background_ingest:
+        ingest = threading.Thread(target=background_ingest, args=(args, stopped), name="ingest", daemon=True)
+        ingest.start()
+
+    test = LoadTest(
+        target,
+        queries,
+        rate=args.rate,
+        concurrency=args.concurrency,
+        duration=args.duration,
+        max_requests=args.requests,
+        arrival=args.arrival,
+        sample_scheduler=not args.url,
+        seed=args.seed
+    )
+    try:
+        report = test.run()
+    finally:
+        stopped.set()
+        if ingest:
+            ingest.join()
+
+    for line in format_report(report):
+        print(line)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    main()
@@ -7,16 +7,22 @@ It allows users to upload PDFs and ask questions about the content through a cha
 """
 
 import os
+import gc
 import sys
+import json
+import time
 import logging
+from itertools import islice
+from contextlib import contextmanager
+from datetime import date, datetime
 from dotenv import load_dotenv
-import google.generativeai as genai
 from llama_index.core import SimpleDirectoryReader
 from llama_index.core.node_parser import SentenceSplitter
 from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.core.storage.storage_context import StorageContext
 from llama_index.core import VectorStoreIndex
-from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.schema import MetadataMode, NodeWithScore, TextNode
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
 import chromadb
 import numpy as np
 
@@ -34,7 +40,22 @@ else:
     print(f".env file not found at {env_file}")
 from typing import List, Optional
 
-from utils import check_environment, display_header, display_message, get_user_input
+from utils import check_environment, display_header, display_message, get_rss_mb, get_user_input
+from gemini_client import get_client
+from backends import HashingEmbedding, create_embed_model, create_generator
+from shards import ShardManager, parse_shard_selection
+from session import ChatSession
+from expansion import DEFAULT_EARLY_ANSWER_SCORE, QueryExpander, load_synonyms
+from node_store import NodeStore
+from extractive import ExtractiveAnswerer
+from tables import TableStore
+from router import create_router
+from scheduler import BULK, get_scheduler, priority
+from profiling import MemoryBudget, MemoryProfiler
+from warmup import PopularityTracker, QueryEmbeddingCache, load_queries
+from snapshot import Snapshot, SnapshotError, export_snapshot
+from retry_queue import RetryQueue, cache_dir, invalid_embedding_reason
+from filters import FILTER_METADATA_KEYS, MetadataIndex, parse_page_number, parse_query_filters
 
 
 
@@ -46,129 +67,97 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class CustomGeminiEmbedding(BaseEmbedding):
-    """Custom embedding class using Google's Generative AI API."""
-    
-    # Define class variable for embedding dimension
-    embedding_dimension: int = 768  # Default embedding dimension for Gemini text-embedding-004
-    
-    def __init__(self, api_key=None, model_name="models/text-embedding-004"):
-        """Initialize with Google API key and model name."""
-        super().__init__(model_name=model_name)
-        # Use the provided API key or get it from environment
-        if api_key is None:
-            api_key = os.getenv("GOOGLE_API_KEY")
-            if not api_key:
-                raise ValueError("GOOGLE_API_KEY environment variable not set")
-        
-        # Configure the Gemini API
-        genai.configure(api_key=api_key)
-        
-        # Ensure embedding_dimension is set
-        self.__class__.embedding_dimension = 768
-        
-    @property
-    def dimension(self) -> int:
-        """Return the embedding dimension."""
-        return self.__class__.embedding_dimension
-        
-    def _get_query_embedding(self, query: str) -> list:
-        """Get embedding for a query string."""
-        try:
-            result = genai.embed_content(
-                model=self.model_name,
-                content=query,
-                task_type="RETRIEVAL_QUERY"
-            )
-            # Extract the embedding from the response
-            if hasattr(result, 'embedding'):
-                return result.embedding
-            elif isinstance(result, dict) and 'embedding' in result:
-                return result['embedding']
-            else:
-                logger.error(f"Unexpected embedding response format: {result}")
-                return [0.0] * self.embedding_dimension
-        except Exception as e:
-            logger.error(f"Error getting query embedding: {e}")
-            # Return a zero vector as fallback
-            return [0.0] * self.embedding_dimension
-    
-    async def _aget_query_embedding(self, query: str) -> list:
-        """Async version of get_query_embedding."""
-        return self._get_query_embedding(query)
-            
-    def _get_text_embedding(self, text: str) -> list:
-        """Get embedding for a text string."""
-        try:
-            result = genai.embed_content(
-                model=self.model_name,
-                content=text,
-                task_type="RETRIEVAL_DOCUMENT"
-            )
-            # Extract the embedding from the response
-            if hasattr(result, 'embedding'):
-                return result.embedding
-            elif isinstance(result, dict) and 'embedding' in result:
-                return result['embedding']
-            else:
-                logger.error(f"Unexpected embedding response format: {result}")
-                return [0.0] * self.embedding_dimension
-        except Exception as e:
-            logger.error(f"Error getting text embedding: {e}")
-            # Return a zero vector as fallback
-            return [0.0] * self.embedding_dimension
-    
-    async def _aget_text_embedding(self, text: str) -> list:
-        """Async version of get_text_embedding."""
-        return self._get_text_embedding(text)
-            
-    def _get_text_embeddings(self, texts: list) -> list:
-        """Get embeddings for multiple text strings."""
-        embeddings = []
-        for text in texts:
-            embeddings.append(self._get_text_embedding(text))
-        return embeddings
-        
-    async def _aget_text_embeddings(self, texts: list) -> list:
-        """Async version of get_text_embeddings."""
-        return self._get_text_embeddings(texts)
-
 class PDFProcessor:
     """
     A class to process PDF documents using Llama Index, ChromaDB, and Google Gemini API.
     """
-    def __init__(self):
-        """Initialize the PDFProcessor with necessary components."""
-        self.api_key = os.getenv("GOOGLE_API_KEY")
-        if not self.api_key:
-            raise ValueError("GOOGLE_API_KEY environment variable not set")
-        
-        logger.info(f"Attempting to initialize with API key: {self.api_key[:5]}...{self.api_key[-4:]}")
+    # Number of chunks to retrieve for each query
+    similarity_top_k = 3
+
+    # Filtered queries whose candidate set is at most this size are scored
+    # exactly over the candidate vectors instead of going through the ANN index
+    exact_search_limit = 2000
+
+    # Optional JSON file in the Document directory mapping file names to tags
+    tags_file = "tags.json"
+
+    # Chunking settings used by load_documents
+    chunk_size = 1024
+    chunk_overlap = 20
+
+    # Number of chunks embedded per request during ingestion
+    embed_batch_size = 100
+
+    # Chunks whose embedding failed are queued in this file, kept in the
+    # persistent store directory or else in the user's cache directory
+    retry_queue_file = ".embedding_retry_queue.jsonl"
+
+    # Extracted tables are saved in this file in the persistent store directory
+    tables_file = "tables.json"
+
+    def __init__(self, collection_name="pdf_documents", document_dir=None, persist_dir=None, client=None,
+                 embedding_backend=None, generation_backend=None, profile_memory=None, memory_budget_mb=None,
+                 extract_tables=None, query_cache=None, retry_queue_path=None):
+        """
+        Initialize the PDFProcessor with necessary components.
+
+        Args:
+            collection_name (str): Name of the ChromaDB collection holding the chunks
+            document_dir (str): Directory to load PDFs from (defaults to the project Document folder)
+            persist_dir (str): Directory for a persistent ChromaDB store (in-memory if not given)
+            client: Gemini client to use (defaults to the shared client)
+            embedding_backend (str): gemini, local or hashing (defaults to EMBEDDING_BACKEND)
+            generation_backend (str): gemini or local (defaults to GENERATION_BACKEND)
+            profile_memory (bool): Measure memory per ingest stage and file (defaults to PROFILE_MEMORY)
+            memory_budget_mb (float): RSS limit at which ingestion indexes its batches early
+                (defaults to MEMORY_BUDGET_MB; no limit if unset)
+            extract_tables (bool): Keep the tables found during ingestion in a side store
+                and answer questions about them from it (defaults to TABLE_EXTRACTION)
+            query_cache (QueryEmbeddingCache): Cache of query embeddings to use
+                (defaults to a new cache; one with max_entries=0 embeds every query)
+            retry_queue_path (str): File of the embedding retry queue (defaults to
+                retry_queue_file in the persist directory or the user's cache directory)
+        """
+        self.embedding_backend = embedding_backend or os.getenv("EMBEDDING_BACKEND", "gemini")
+        self.generation_backend = generation_backend or os.getenv("GENERATION_BACKEND", "gemini")
+        uses_gemini = "gemini" in (self.embedding_backend, self.generation_backend)
         
-        # Initialize Gemini API
-        genai.configure(api_key=self.api_key)
+        self.api_key = os.getenv("GOOGLE_API_KEY")
+        if client is None and uses_gemini:
+            if not self.api_key:
+                raise ValueError("GOOGLE_API_KEY environment variable not set")
+            logger.info(f"Attempting to initialize with API key: {self.api_key[:5]}...{self.api_key[-4:]}")
         
         try:
-            # Log available models
-            models = [m.name for m in genai.list_models()]
-            logger.info(f"Available models: {models}")
+            # Initialize the shared Gemini client and log available models
+            self.client = client
+            if self.client is None and uses_gemini:
+                self.client = get_client(self.api_key)
+            if self.client is not None:
+                models = self.client.list_models()
+                logger.info(f"Available models: {models}")
             
             # Initialize ChromaDB
-            self.chroma_client = chromadb.Client()
-            self.chroma_collection = self.chroma_client.get_or_create_collection("pdf_documents")
-            logger.info("ChromaDB collection 'pdf_documents' initialized")
+            self.persist_dir = persist_dir
+            if persist_dir:
+                self.chroma_client = chromadb.PersistentClient(path=persist_dir)
+            else:
+                self.chroma_client = chromadb.Client()
+            self.collection_name = collection_name
+            self.chroma_collection = self.chroma_client.get_or_create_collection(collection_name)
+            logger.info(f"ChromaDB collection '{collection_name}' initialized")
             
-            # Initialize embedding model
-            self.embed_model = CustomGeminiEmbedding(
-                model_name="models/text-embedding-004",
-                api_key=self.api_key
-            )
-            logger.info("Successfully initialized embedding model")
+            # Initialize embedding model and answer generator
+            self.embed_model = create_embed_model(self.embedding_backend, client=self.client, api_key=self.api_key)
+            self.generator = create_generator(self.generation_backend, client=self.client)
+            logger.info(f"Successfully initialized {self.embedding_backend} embedding model "
+                        f"and {self.generation_backend} generator")
         except Exception as e:
             logger.error(f"Error during initialization: {e}")
             print(f"Error: {e}")
-            print("Please check your GOOGLE_API_KEY environment variable.")
-            print("Make sure the API key is valid and has access to the Gemini API.")
+            if uses_gemini:
+                print("Please check your GOOGLE_API_KEY environment variable.")
+                print("Make sure the API key is valid and has access to the Gemini API.")
             raise ValueError(f"Initialization failed: {e}")
         
         # Initialize vector store
@@ -176,13 +165,190 @@ class PDFProcessor:
         self.storage_context = StorageContext.from_defaults(vector_store=self.vector_store)
         
         # Document directory
-        self.document_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Document")
+        if document_dir is None:
+            document_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Document")
+        self.document_dir = document_dir
+        
+        # Durable queue of chunks waiting to be embedded, kept next to the store
+        # or, for an in-memory store, in the user's cache directory
+        self.retry_queue = RetryQueue(
+            retry_queue_path or os.path.join(persist_dir or cache_dir(document_dir), self.retry_queue_file)
+        )
         
         # Initialize index
         self.index = None
         
-    def load_documents(self):
-        """Load PDF documents from the Document directory."""
+        # Incremented whenever the index is built or replaced, so that cached
+        # conversation turns from an earlier index are not reused
+        self.index_version = 0
+
+        # Metadata indexes used to pre-filter scoped queries
+        self.metadata_index = MetadataIndex()
+        
+        # Compact copy of chunk texts and metadata, addressed by metadata index ordinal
+        self.node_store = NodeStore()
+        
+        # Description of what was ingested, included in index snapshots
+        self.manifest = None
+        
+        # Query embeddings of common questions, and the tracker that finds them
+        self.query_cache = query_cache if query_cache is not None else QueryEmbeddingCache()
+        self.popular_queries = None
+
+        # Optional callable(stage, seconds) told how long each query stage
+        # (embed, retrieve, generate) took, in the thread that ran it
+        self.stage_observer = None
+
+        # Memory measurement and limit for ingestion
+        if profile_memory is None:
+            profile_memory = os.getenv("PROFILE_MEMORY", "").lower() in ("1", "true", "yes")
+        if memory_budget_mb is None:
+            memory_budget_mb = float(os.getenv("MEMORY_BUDGET_MB", "0")) or None
+        self.memory_budget = MemoryBudget(memory_budget_mb)
+        self.memory_profiler = MemoryProfiler(enabled=profile_memory, budget=self.memory_budget)
+        
+        # Concurrent retrieval of query variants, off unless enabled
+        self.expander = None
+        
+        # Per-question choice between extractive, fast and large generation, off unless enabled
+        self.router = None
+        
+        # Answers lookups from the retrieved sentences without a model call, off unless enabled
+        self.extractive = None
+        
+        # Tables found during ingestion, held column by column, off unless enabled
+        if extract_tables is None:
+            extract_tables = os.getenv("TABLE_EXTRACTION", "off").lower() == "on"
+        self.tables = TableStore() if extract_tables else None
+        
+    def load_index(self):
+        """
+        Attach to chunks already present in the ChromaDB collection.
+
+        Returns:
+            bool: True if the collection contained an index to attach to
+        """
+        if self.chroma_collection.count() == 0:
+            return False
+        self.index = VectorStoreIndex.from_vector_store(
+            self.vector_store,
+            embed_model=self.embed_model
+        )
+        self._rebuild_local_indexes()
+        self.index_version += 1
+        tables_path = os.path.join(self.persist_dir, self.tables_file) if self.persist_dir else None
+        if self.tables is not None and tables_path and os.path.exists(tables_path):
+            self.tables.load(tables_path)
+            logger.info(f"Loaded {len(self.tables)} tables from {tables_path}")
+        logger.info(f"Attached to existing index with {len(self.metadata_index)} chunks")
+        return True
+
+    def indexed_files(self):
+        """
+        Describe the files the indexed chunks were read from.
+
+        Returns:
+            dict: File name to (size in bytes, modification time) as recorded at
+                ingestion; the time is the exact mtime, or the day for chunks
+                indexed before it was recorded
+        """
+        files = np.array(self.metadata_index.files)
+        indexed = {}
+        for name, file_id in self.metadata_index.file_ids.items():
+            metadata = self.node_store.metadata(int(np.argmax(files == file_id)))
+            indexed[name] = (metadata.get("file_size"),
+                             metadata.get("file_mtime", metadata.get("last_modified_date")))
+        return indexed
+
+    def changed_files(self):
+        """
+        Compare the Document directory with the files in the index.
+
+        Returns:
+            tuple: (PDFs that are new or changed since they were indexed, sorted;
+                indexed files that are no longer in the directory, sorted)
+        """
+        indexed = self.indexed_files()
+        current = []
+        if os.path.isdir(self.document_dir):
+            current = sorted(f for f in os.listdir(self.document_dir) if f.lower().endswith('.pdf'))
+        changed = []
+        for name in current:
+            if name not in indexed:
+                changed.append(name)
+                continue
+            size, modified = indexed[name]
+            stat = os.stat(os.path.join(self.document_dir, name))
+            if isinstance(modified, int):
+                current_modified = int(stat.st_mtime)
+            else:
+                current_modified = datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d")
+            if size != stat.st_size or modified != current_modified:
+                changed.append(name)
+        removed = sorted(set(indexed) - set(current))
+        return changed, removed
+
+    def sync_documents(self):
+        """
+        Bring an attached index up to date with the Document directory.
+
+        The chunks of changed and removed files are deleted, then new and
+        changed files are ingested next to the chunks that are still current.
+
+        Returns:
+            tuple: (files ingested, files removed)
+        """
+        changed, removed = self.changed_files()
+        stale = [name for name in changed + removed if name in self.metadata_index.file_ids]
+        for name in stale:
+            self.chroma_collection.delete(where={"file_name": name})
+        if stale:
+            self._rebuild_local_indexes()
+            self.index_version += 1
+            if self.tables is not None:
+                self.tables.remove_files(stale)
+                self._save_tables()
+            if self.manifest is not None:
+                for name in stale:
+                    self.manifest["files"].pop(name, None)
+        if removed:
+            logger.info(f"Removed the chunks of {len(removed)} deleted files: {', '.join(removed)}")
+        if changed:
+            logger.info(f"Ingesting {len(changed)} new or changed files: {', '.join(changed)}")
+            self.load_documents(file_names=changed)
+        return changed, removed
+
+    def close(self):
+        """Release the ChromaDB client held by this processor."""
+        if self.expander is not None:
+            self.expander.close()
+            self.expander = None
+        self.index = None
+        self.metadata_index = MetadataIndex()
+        self.node_store.clear()
+        if self.tables is not None:
+            self.tables.clear()
+        if self.persist_dir:
+            # Persistent clients are cached per path by ChromaDB; clearing the
+            # cache lets this client's segments be freed once it is dropped.
+            # Open clients keep their own reference and are unaffected.
+            chromadb.api.client.SharedSystemClient.clear_system_cache()
+        self.vector_store = None
+        self.storage_context = None
+        self.chroma_collection = None
+        self.chroma_client = None
+
+    def load_documents(self, file_names=None):
+        """
+        Load PDF documents from the Document directory.
+
+        Args:
+            file_names (list): Only ingest these files of the directory, adding them
+                to the chunks already indexed (all PDFs if not given)
+
+        Returns:
+            bool: True if any chunk was indexed
+        """
         # Check if Document directory exists
         if not os.path.exists(self.document_dir):
             os.makedirs(self.document_dir)
@@ -190,71 +356,776 @@ class PDFProcessor:
             return False
         
         # Check if there are PDF files in the Document directory
-        pdf_files = [f for f in os.listdir(self.document_dir) if f.lower().endswith('.pdf')]
+        if file_names is None:
+            pdf_files = [f for f in os.listdir(self.document_dir) if f.lower().endswith('.pdf')]
+        else:
+            pdf_files = list(file_names)
         if not pdf_files:
             logger.warning("No PDF files found in the Document directory")
             return False
         
         logger.info(f"Found {len(pdf_files)} PDF files: {', '.join(pdf_files)}")
         
+        # A store that is rebuilt from scratch re-embeds every chunk, so older queued chunks are obsolete
+        if file_names is None and (not self.persist_dir or self.chroma_collection.count() == 0):
+            self.retry_queue.clear()
+        
+        parser = SentenceSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+        self.index_version += 1
+        if self.tables is not None and file_names is None:
+            self.tables.clear()
+        self.memory_profiler.start()
         try:
-            # Load documents using SimpleDirectoryReader
-            documents = SimpleDirectoryReader(
-                self.document_dir
-            ).load_data()
+            # Files are read, split, embedded and indexed one at a time so that
+            # only one file's pages and chunks are held in memory
+            files = {}
+            total_chunks = 0
+            indexed = 0
+            for pdf_file in sorted(pdf_files):
+                # Each file is a top-level stage that contains the stages below
+                with self.memory_profiler.stage("file"):
+                    # Parsing and splitting take CPU slots at bulk priority
+                    with self.memory_profiler.stage("read", pdf_file), priority(BULK), get_scheduler().cpu_slot():
+                        documents = SimpleDirectoryReader(
+                            input_files=[os.path.join(self.document_dir, pdf_file)]
+                        ).load_data()
+                        self._add_filter_metadata(documents)
+                    
+                    # Keep the tables of the pages before the splitter cuts them apart
+                    table_count = None
+                    if self.tables is not None:
+                        with self.memory_profiler.stage("tables", pdf_file), priority(BULK), get_scheduler().cpu_slot():
+                            table_count = self.tables.extract(documents, os.path.join(self.document_dir, pdf_file))
+                    
+                    # Split documents into chunks
+                    with self.memory_profiler.stage("split", pdf_file), priority(BULK), get_scheduler().cpu_slot():
+                        nodes = parser.get_nodes_from_documents(documents)
+                    entry = self._describe_file(documents)
+                    if table_count is not None:
+                        entry["tables"] = table_count
+                    total_chunks += len(nodes)
+                    del documents
+                    
+                    # Embed the chunks; failures are queued for retry instead of being indexed
+                    pending = []
+                    for start in range(0, len(nodes), self.embed_batch_size):
+                        with self.memory_profiler.stage("embed", pdf_file):
+                            embedded, failed = self._embed_nodes(nodes[start:start + self.embed_batch_size])
+                        for failed_nodes, error in failed:
+                            self.retry_queue.add(failed_nodes, error)
+                        pending.extend(embedded)
+                        entry["chunks"] += len(embedded)
+                        # Index what is held so far instead of growing past the budget
+                        if pending and self.memory_budget.near_limit():
+                            with self.memory_profiler.stage("index", pdf_file):
+                                self._index_nodes(pending)
+                            indexed += len(pending)
+                            pending = []
+                            gc.collect()
+                    
+                    with self.memory_profiler.stage("index", pdf_file):
+                        self._index_nodes(pending)
+                    indexed += len(pending)
+                    del nodes, pending
+                    files[pdf_file] = entry
             
-            # Split documents into chunks
-            parser = SentenceSplitter(chunk_size=1024, chunk_overlap=20)
-            nodes = parser.get_nodes_from_documents(documents)
+            if file_names is None:
+                self.manifest = self._build_manifest(files, total_chunks - indexed)
+            elif self.manifest is not None:
+                # Added files join the manifest of the ingest they extend
+                self.manifest["files"].update(files)
+                self.manifest["failed_chunks"] += total_chunks - indexed
+            if self.tables is not None:
+                logger.info(f"Extracted {len(self.tables)} tables")
+                self._save_tables()
             
-            # Create index
-            self.index = VectorStoreIndex(
-                nodes, 
-                storage_context=self.storage_context,
-                embed_model=self.embed_model
-            )
-            
-            logger.info(f"Successfully loaded and stored {len(documents)} documents")
-            return True
+            failed_count = total_chunks - indexed
+            if failed_count:
+                logger.warning(f"{failed_count} of {total_chunks} chunks could not be embedded and were "
+                               f"queued for retry in {self.retry_queue.path}")
+            logger.info(f"Successfully loaded and stored {len(files)} files")
+            if self.memory_profiler.enabled:
+                for line in self.memory_profiler.format_report():
+                    logger.info(line)
+            return indexed > 0
         except Exception as e:
             logger.error(f"Error loading documents: {str(e)}")
             return False
+        finally:
+            self.memory_profiler.stop()
+    
+    def _describe_file(self, documents):
+        """Describe one loaded file for the manifest; chunks are counted as they are indexed."""
+        metadata = documents[0].metadata if documents else {}
+        return {
+            "size": metadata.get("file_size"),
+            "last_modified": metadata.get("last_modified_date"),
+            "pages": len(documents),
+            "chunks": 0
+        }
     
-    def query_documents(self, query):
-        """Query the indexed documents using Gemini API."""
+    def _build_manifest(self, files, failed_count):
+        """Describe an ingest: settings used and pages and chunks per file."""
+        return {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "embedding_backend": self.embedding_backend,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "failed_chunks": failed_count,
+            "files": files
+        }
+
+    def export_snapshot(self, path):
+        """
+        Export the built index to a snapshot file.
+
+        Args:
+            path (str): Where to write the snapshot
+
+        Returns:
+            dict: The snapshot header
+        """
+        manifest = self.manifest
+        if manifest is None:
+            # Attached to an existing store: describe it from the metadata index
+            manifest = {
+                "created": None,
+                "embedding_backend": self.embedding_backend,
+                "files": {
+                    name: {"chunks": count}
+                    for name, count in self.metadata_index.file_counts().items()
+                }
+            }
+        return export_snapshot(
+            path,
+            self.chroma_collection,
+            self.embed_model.model_name,
+            self.embed_model.dimension,
+            manifest,
+            tables=self.tables.to_list() if self.tables is not None else None
+        )
+
+    def reset_collection(self):
+        """Drop all stored chunks and start with an empty collection."""
+        empty = self.chroma_client.get_or_create_collection(f"{self.collection_name}_empty")
+        self._replace_collection(empty)
+
+    def _replace_collection(self, collection):
+        """
+        Serve from another collection, dropping the chunks of the current one.
+
+        Args:
+            collection: A ChromaDB collection of this client; it is renamed to the
+                processor's collection name
+        """
+        self.chroma_client.delete_collection(self.collection_name)
+        collection.modify(name=self.collection_name)
+        self.chroma_collection = collection
+        self.vector_store = ChromaVectorStore(chroma_collection=self.chroma_collection)
+        self.storage_context = StorageContext.from_defaults(vector_store=self.vector_store)
+        self.index = None
+        self.manifest = None
+        self.index_version += 1
+        self._rebuild_local_indexes()
+        # Tables belong to the chunks that were just dropped
+        if self.tables is not None:
+            self.tables.clear()
+            self._save_tables()
+
+    def _save_tables(self):
+        """Write the tables next to a persistent store, so they are reloaded with it."""
+        if self.tables is not None and self.persist_dir:
+            self.tables.save(os.path.join(self.persist_dir, self.tables_file))
+
+    def import_snapshot(self, path, verify=True, batch_size=5000):
+        """
+        Replace the index with the contents of a snapshot file.
+
+        No documents are parsed and no embeddings are computed. The snapshot is
+        loaded into a staging collection first, so a snapshot that turns out to
+        be invalid leaves the current index untouched.
+
+        Args:
+            path (str): The snapshot file
+            verify (bool): Check the snapshot checksum before loading
+            batch_size (int): Number of chunks added to ChromaDB per request
+
+        Returns:
+            int: Number of chunks loaded
+
+        Raises:
+            SnapshotError: If the snapshot is invalid, corrupted or was built with a
+                different embedding model or dimension
+        """
+        snapshot = Snapshot(path)
+        snapshot.check_compatible(self.embed_model.model_name, self.embed_model.dimension)
+        if verify:
+            snapshot.verify()
+        
+        staging_name = f"{self.collection_name}_import"
+        if staging_name in [collection.name for collection in self.chroma_client.list_collections()]:
+            self.chroma_client.delete_collection(staging_name)
+        staging = self.chroma_client.create_collection(staging_name)
+        try:
+            vectors = snapshot.vectors()
+            records = snapshot.records()
+            start = 0
+            while True:
+                batch = list(islice(records, batch_size))
+                if not batch:
+                    break
+                ids, documents, metadatas = (list(column) for column in zip(*batch))
+                if start + len(ids) > len(vectors):
+                    raise SnapshotError(f"Snapshot {path} has more records than vectors")
+                staging.add(
+                    ids=ids,
+                    embeddings=vectors[start:start + len(ids)].tolist(),
+                    documents=documents,
+                    metadatas=metadatas
+                )
+                start += len(ids)
+            if start != snapshot.header["count"]:
+                raise SnapshotError(f"Snapshot {path} has {start} records, expected {snapshot.header['count']}")
+        except Exception as e:
+            self.chroma_client.delete_collection(staging_name)
+            if isinstance(e, SnapshotError):
+                raise
+            raise SnapshotError(f"Could not import snapshot {path}: {e}")
+        
+        # Swap the complete import in for the current index
+        self._replace_collection(staging)
+        self.index = VectorStoreIndex.from_vector_store(self.vector_store, embed_model=self.embed_model)
+        self.manifest = snapshot.header.get("manifest")
+        if self.tables is not None:
+            # Snapshots without tables leave table answers with nothing to match
+            self.tables.from_list(snapshot.header.get("tables", []))
+            self._save_tables()
+        logger.info(f"Imported {len(self.metadata_index)} chunks from snapshot {path}")
+        return len(self.metadata_index)
+
+    def _embed_nodes(self, nodes):
+        """
+        Embed chunks in batches and validate the returned vectors.
+
+        Args:
+            nodes (list): The TextNodes to embed
+
+        Returns:
+            tuple: (nodes with a valid embedding set, list of (failed nodes, error) pairs)
+        """
+        embedded = []
+        failed = []
+        for start in range(0, len(nodes), self.embed_batch_size):
+            batch = nodes[start:start + self.embed_batch_size]
+            texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch]
+            try:
+                # Ingest batches yield to interactive queries for API budget and CPU
+                with priority(BULK):
+                    embeddings = self.embed_model.get_text_embedding_batch(texts)
+            except Exception as e:
+                failed.append((batch, str(e)))
+                continue
+            invalid = []
+            for node, embedding in zip(batch, embeddings):
+                reason = invalid_embedding_reason(embedding, self.embed_model.dimension)
+                if reason:
+                    invalid.append(node)
+                else:
+                    node.embedding = embedding
+                    embedded.append(node)
+            if invalid:
+                failed.append((invalid, "Embedding API returned invalid vectors"))
+        return embedded, failed
+
+    def _index_nodes(self, nodes):
+        """Add embedded chunks to the vector index and the metadata indexes."""
+        if self.index is None:
+            self.index = VectorStoreIndex(
+                nodes,
+                storage_context=self.storage_context,
+                embed_model=self.embed_model
+            )
+        elif nodes:
+            self.index.insert_nodes(nodes)
+        for node in nodes:
+            self._add_local_node(node)
+
+    def _add_local_node(self, node):
+        """Register an indexed chunk with the metadata indexes and the node store."""
+        if self.metadata_index.ordinal(node.node_id) is not None:
+            return
+        self.metadata_index.add(node.node_id, node.metadata)
+        self.node_store.append(node)
+
+    def _add_local_record(self, node_id, text, metadata):
+        """Register a chunk read back from ChromaDB."""
+        if metadata and "_node_content" in metadata:
+            node = metadata_dict_to_node(metadata)
+        else:
+            node = TextNode(id_=node_id, metadata=metadata or {})
+        node.set_content(text or "")
+        self._add_local_node(node)
+
+    def _rebuild_local_indexes(self, batch_size=1000):
+        """Rebuild the metadata indexes and the node store from the ChromaDB collection."""
+        self.metadata_index = MetadataIndex()
+        self.node_store.clear()
+        total = self.chroma_collection.count()
+        for offset in range(0, total, batch_size):
+            batch = self.chroma_collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+            for node_id, text, metadata in zip(batch["ids"], batch["documents"], batch["metadatas"]):
+                self._add_local_record(node_id, text, metadata)
+        logger.info(f"Rebuilt metadata index and node store with {len(self.metadata_index)} chunks")
+
+    def retry_failed_embeddings(self, max_rounds=5, backoff=2.0):
+        """
+        Re-embed queued chunks in batches and add them to the index.
+
+        Args:
+            max_rounds (int): Number of passes over the still-failing chunks
+            backoff (float): Seconds to wait before the second pass, doubled after each pass
+
+        Returns:
+            tuple: (number of chunks indexed, number still queued)
+        """
+        nodes = [node for node, _ in self.retry_queue.pending()]
+        if not nodes:
+            return 0, 0
+        
+        indexed = 0
+        error = None
+        delay = backoff
+        for attempt in range(max_rounds):
+            if attempt:
+                time.sleep(delay)
+                delay *= 2
+            embedded, failed = self._embed_nodes(nodes)
+            if embedded:
+                self._index_nodes(embedded)
+                self.retry_queue.resolve([node.node_id for node in embedded], [])
+                indexed += len(embedded)
+            nodes = [node for failed_nodes, _ in failed for node in failed_nodes]
+            if not nodes:
+                break
+            error = failed[-1][1]
+            logger.warning(f"{len(nodes)} chunks still failing to embed: {error}")
+        
+        if nodes:
+            self.retry_queue.resolve([], [node.node_id for node in nodes], error)
+        logger.info(f"Re-embedded {indexed} queued chunks, {len(nodes)} still queued")
+        return indexed, len(nodes)
+
+    def index_health(self, batch_size=1000):
+        """
+        Check the stored vectors and the retry queue.
+
+        Args:
+            batch_size (int): Number of vectors fetched per request
+
+        Returns:
+            dict: Counts of total, valid, missing, wrong-dimension, non-finite and
+                zero vectors, and the number of chunks pending retry
+        """
+        report = {"total": 0, "valid": 0, "missing": 0, "dimension": 0, "non-finite": 0, "zero": 0}
+        dimension = self.embed_model.dimension
+        total = self.chroma_collection.count()
+        for offset in range(0, total, batch_size):
+            batch = self.chroma_collection.get(include=["embeddings"], limit=batch_size, offset=offset)
+            for embedding in batch["embeddings"] or [None] * len(batch["ids"]):
+                report["total"] += 1
+                report[invalid_embedding_reason(embedding, dimension) or "valid"] += 1
+        report["expected_dimension"] = dimension
+        report["pending_retry"] = self.retry_queue.summary()["pending"]
+        return report
+
+    def _load_tags(self):
+        """Load the optional file name to tags mapping from the Document directory."""
+        tags_path = os.path.join(self.document_dir, self.tags_file)
+        if not os.path.exists(tags_path):
+            return {}
+        try:
+            with open(tags_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read {tags_path}: {e}")
+            return {}
+
+    def _add_filter_metadata(self, documents):
+        """Add the metadata used for filtering to each loaded document."""
+        tags_by_file = self._load_tags()
+        today = date.today()
+        for doc in documents:
+            file_name = doc.metadata.get("file_name", "")
+            tags = [str(tag) for tag in tags_by_file.get(file_name, [])]
+            doc.metadata["ingest_date"] = today.isoformat()
+            doc.metadata["ingest_day"] = int(today.strftime("%Y%m%d"))
+            doc.metadata["page_number"] = parse_page_number(doc.metadata.get("page_label"))
+            doc.metadata["doc_type"] = os.path.splitext(file_name)[1].lower().lstrip(".")
+            doc.metadata["tags"] = ",".join(tags)
+            excluded = list(FILTER_METADATA_KEYS)
+            # The exact modification time lets a restart notice files edited since ingestion
+            file_path = doc.metadata.get("file_path")
+            if file_path and os.path.exists(file_path):
+                doc.metadata["file_mtime"] = int(os.path.getmtime(file_path))
+                excluded.append("file_mtime")
+            for tag in tags:
+                doc.metadata[f"tag_{tag}"] = True
+                excluded.append(f"tag_{tag}")
+            doc.excluded_embed_metadata_keys.extend(excluded)
+            doc.excluded_llm_metadata_keys.extend(excluded)
+
+    def _exact_search(self, query_embedding, node_ids, top_k):
+        """Score the candidate chunks exactly against the query embedding."""
+        records = self.chroma_collection.get(ids=node_ids, include=["embeddings"])
+        if not records["ids"]:
+            return []
+        vectors = np.asarray(records["embeddings"], dtype=np.float32)
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        # Same squared L2 distance and score as the Chroma query path
+        distances = np.sum((vectors - query_vector) ** 2, axis=1)
+        best = np.argsort(distances)[:top_k]
+        return self._materialize(
+            [records["ids"][i] for i in best],
+            [float(np.exp(-distances[i])) for i in best]
+        )
+
+    def _materialize(self, node_ids, scores):
+        """
+        Build TextNodes for retrieved chunks.
+
+        Chunks are read from the node store; any it does not hold (for example
+        chunks added to a persistent store by another process) are fetched from
+        ChromaDB.
+
+        Args:
+            node_ids (list): Retrieved node IDs, best first
+            scores (list): Their similarity scores
+
+        Returns:
+            list: NodeWithScore results in the given order
+        """
+        nodes = {}
+        for node_id in node_ids:
+            ordinal = self.metadata_index.ordinal(node_id)
+            if ordinal is not None and ordinal < len(self.node_store):
+                nodes[node_id] = self.node_store.node(ordinal, node_id)
+        missing = [node_id for node_id in node_ids if node_id not in nodes]
+        if missing:
+            records = self.chroma_collection.get(ids=missing, include=["documents", "metadatas"])
+            for node_id, text, metadata in zip(records["ids"], records["documents"], records["metadatas"]):
+                node = metadata_dict_to_node(metadata)
+                node.set_content(text)
+                nodes[node_id] = node
+        return [
+            NodeWithScore(node=nodes[node_id], score=score)
+            for node_id, score in zip(node_ids, scores)
+            if node_id in nodes
+        ]
+
+    def embed_query(self, query):
+        """
+        Embed a query for retrieval.
+
+        Args:
+            query (str): The question
+
+        Returns:
+            list: The query embedding
+        """
+        with self._stage("embed"):
+            if self.popular_queries is not None:
+                self.popular_queries.record(query)
+            embedding = self.query_cache.get(query)
+            if embedding is None:
+                embedding = self.embed_model.get_query_embedding(query)
+                self.query_cache.put(query, embedding)
+            return embedding
+
+    @contextmanager
+    def _stage(self, name):
+        """Report the duration of the enclosed query stage to the stage observer, if any."""
+        if self.stage_observer is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_observer(name, time.perf_counter() - start)
+
+    def warm_up(self, path, track=True):
+        """
+        Pre-embed frequent queries so they skip the query embedding call.
+
+        Args:
+            path (str): Warm-up file with one query per line (or count<TAB>query)
+            track (bool): Start a background tracker that saves the most popular
+                queries back to ``path`` and pre-embeds them
+
+        Returns:
+            int: Number of queries embedded
+        """
+        counts = load_queries(path)
+        warmed = 0
+        if counts:
+            with priority(BULK):
+                warmed = self.query_cache.warm(list(counts), self.embed_model.get_query_embedding_batch)
+            logger.info(f"Pre-embedded {warmed} queries from {path}")
+        if track and self.popular_queries is None:
+            self.popular_queries = PopularityTracker(
+                path,
+                self.query_cache,
+                self.embed_model.get_query_embedding_batch,
+                initial_counts=counts
+            )
+        return warmed
+
+    def enable_query_expansion(self, use_hyde=False, synonyms_file=None,
+                               early_answer_score=DEFAULT_EARLY_ANSWER_SCORE):
+        """
+        Retrieve for query variants concurrently and fuse the results.
+
+        Args:
+            use_hyde (bool): Also retrieve with a draft answer from the generator
+            synonyms_file (str): JSON file of extra synonyms (defaults to synonyms.json
+                in the Document directory)
+            early_answer_score (float): Best score of the original query's retrieval
+                at which the answer starts without waiting for the variants
+        """
+        if self.expander is not None:
+            self.expander.close()
+        synonyms_file = synonyms_file or os.path.join(self.document_dir, "synonyms.json")
+        self.expander = QueryExpander(
+            self,
+            synonyms=load_synonyms(synonyms_file),
+            use_hyde=use_hyde,
+            early_answer_score=early_answer_score
+        )
+        logger.info(f"Query expansion enabled{' with HyDE drafts' if use_hyde else ''}")
+
+    def enable_model_routing(self, fast_model=None):
+        """
+        Route each question to an extractive answer, a fast model or the large model.
+
+        Args:
+            fast_model (str): Model for the fast route (defaults to FAST_GENERATION_MODEL
+                or gemini-1.5-flash; only used with the gemini generation backend)
+        """
+        # The extractive route is served by the extractive answer stage
+        if self.extractive is None:
+            self.enable_extractive_answers()
+        self.router = create_router(self.generation_backend, self.generator, self.client, fast_model,
+                                    extractive=True)
+        logger.info(f"Model routing enabled with routes: {', '.join(self.router.generators)}")
+
+    def enable_extractive_answers(self, threshold=0.6, min_overlap=0.6):
+        """
+        Answer lookups with the best matching retrieved sentence when it is confident enough.
+
+        Sentences are embedded with the local embedding model, or with hashed
+        vectors when embeddings come from the Gemini API, so that no API call is made.
+
+        Args:
+            threshold (float): Blended similarity the best sentence needs
+            min_overlap (float): Share of question words the best sentence must contain
+        """
+        embed_model = HashingEmbedding() if self.embedding_backend == "gemini" else self.embed_model
+        self.extractive = ExtractiveAnswerer(embed_model, threshold=threshold, min_overlap=min_overlap)
+        logger.info(f"Extractive answers enabled (threshold {threshold})")
+
+    def retrieve_for_answer(self, query, filters=None, query_embedding=None):
+        """
+        Retrieve the context for an answer, with query expansion if it is enabled.
+
+        Args:
+            query (str): The question
+            filters (QueryFilter): Optional metadata filter applied before the vector search
+            query_embedding (list): Precomputed embedding of the query, if available
+
+        Returns:
+            list: NodeWithScore results, best first
+        """
+        with self._stage("retrieve"):
+            if self.expander is not None:
+                return self.expander.retrieve(query, filters, query_embedding=query_embedding)
+            return self.retrieve(query, filters, query_embedding=query_embedding)
+
+    def retrieve(self, query, filters=None, top_k=None, query_embedding=None):
+        """
+        Retrieve the chunks most relevant to a query.
+
+        Args:
+            query (str): The question
+            filters (QueryFilter): Optional metadata filter applied before the vector search
+            top_k (int): Number of chunks to return
+            query_embedding (list): Precomputed embedding of the query, if available
+
+        Returns:
+            list: NodeWithScore results, best first
+        """
+        top_k = top_k or self.similarity_top_k
+        if filters is None or filters.is_empty():
+            if query_embedding is None:
+                query_embedding = self.embed_query(query)
+            results = self.chroma_collection.query(
+                query_embeddings=[query_embedding],
+                n_results=min(top_k, self.chroma_collection.count()) or 1,
+                include=["distances"]
+            )
+            return self._materialize(
+                results["ids"][0],
+                [float(np.exp(-distance)) for distance in results["distances"][0]]
+            )
+
+        candidates = self.metadata_index.select(filters)
+        candidate_count = self.metadata_index.count(candidates)
+        logger.info(f"{filters} matched {candidate_count} chunks")
+        if candidate_count == 0:
+            return []
+
+        if query_embedding is None:
+            query_embedding = self.embed_query(query)
+        if candidate_count <= self.exact_search_limit:
+            node_ids = self.metadata_index.node_ids_for(candidates)
+            return self._exact_search(query_embedding, node_ids, top_k)
+
+        # Large candidate sets are filtered inside Chroma before the ANN search
+        results = self.chroma_collection.query(
+            query_embeddings=[query_embedding],
+            n_results=min(top_k, candidate_count),
+            where=filters.to_chroma_where(),
+            include=["distances"]
+        )
+        return self._materialize(
+            results["ids"][0],
+            [float(np.exp(-distance)) for distance in results["distances"][0]]
+        )
+
+    def query_documents(self, query, filters=None):
+        """
+        Query the indexed documents using Gemini API.
+
+        Args:
+            query (str): The question
+            filters (QueryFilter): Optional metadata filter restricting which chunks are searched
+
+        Returns:
+            str: The answer
+        """
         if not self.index:
             logger.error("No documents indexed. Please load documents first.")
             return "No documents have been indexed. Please add PDF files to the Document directory."
         
         try:
-            # Use Gemini directly for better responses
-            model = genai.GenerativeModel('models/gemini-1.5-pro-001')
+            # Questions about extracted tables are answered from their rows alone
+            if self.tables is not None:
+                answer = self.answer_from_tables(query, filters)
+                if answer is not None:
+                    return answer
             
             # Create a context from the relevant chunks
-            retriever = self.index.as_retriever(similarity_top_k=3)
-            nodes = retriever.retrieve(query)
-            
-            # Extract text from nodes
-            context = "\n\n".join([node.text for node in nodes])
-            
-            # Create a prompt with the context and query
-            prompt = f"""
-            Based on the following information from the document:
-            
-            {context}
-            
-            Please answer this question: {query}
-            
-            If the answer cannot be found in the provided information, please say so.
-            """
-            
-            # Generate response
-            response = model.generate_content(prompt)
-            return response.text
+            nodes = self.retrieve_for_answer(query, filters)
+            if not nodes:
+                return "No indexed content matches the given filters."
+            return self.generate_answer(query, nodes)
         except Exception as e:
             logger.error(f"Error querying documents: {str(e)}")
             return f"Error processing your query: {str(e)}"
 
+    def answer_from_tables(self, query, filters=None, history=None):
+        """
+        Answer a question from the extracted tables if one of them covers it.
+
+        Lookups and aggregates (total, average, highest, lowest, count) are
+        computed on the table, and only the matching rows and the computed
+        value are passed to the prompt instead of retrieved chunks.
+
+        Args:
+            query (str): The question
+            filters (QueryFilter): Optional metadata filter on the table's page
+            history (str): Earlier turns of the conversation, if any
+
+        Returns:
+            str: The answer, or None if no table answers the question
+        """
+        match = self.tables.match(query, filters)
+        if match is None:
+            return None
+        logger.info(f"Answering from {match.summary()}")
+        
+        history_section = f"Conversation so far:\n{history}\n\n" if history else ""
+        prompt = f"""
+        {history_section}Based on the following table from the document:
+        
+        {match.context(self.tables.max_prompt_rows)}
+        
+        Please answer this question: {query}
+        
+        If the answer cannot be found in the provided information, please say so.
+        """
+        
+        # The short table prompt suits the fast route when routing is enabled
+        if self.router is not None:
+            return self.router.generate(self.router.fallback("extractive"), prompt)
+        return self.generator.generate(prompt)
+
+    def generate_answer(self, query, nodes, history=None, follow_up=False):
+        """
+        Generate an answer to a query from retrieved chunks.
+
+        Args:
+            query (str): The question
+            nodes (list): NodeWithScore results to use as context
+            history (str): Earlier turns of the conversation, if any
+            follow_up (bool): Whether the question refers back to earlier turns; follow-ups
+                are always generated, since a retrieved sentence cannot resolve the reference
+
+        Returns:
+            str: The answer
+        """
+        with self._stage("generate"):
+            return self._generate_answer(query, nodes, history, follow_up)
+
+    def _generate_answer(self, query, nodes, history, follow_up):
+        # Easy questions are answered without the large model when routing is enabled
+        route = None
+        if self.router is not None:
+            route, signals = self.router.choose(query, nodes, follow_up)
+            logger.info(f"Routing to {route}: {signals}")
+        
+        # Direct lookups are answered with a retrieved sentence when confident enough
+        if self.extractive is not None and not follow_up and route in (None, "extractive"):
+            start = time.perf_counter()
+            answer = self.extractive.answer(query, nodes)
+            if answer is not None:
+                if route is not None:
+                    self.router.record(route, time.perf_counter() - start)
+                return answer
+        if route == "extractive":
+            route = self.router.fallback(route)
+        
+        # Extract text from nodes
+        context = "\n\n".join([node.text for node in nodes])
+        
+        # Earlier turns let the model resolve references in follow-up questions
+        history_section = f"Conversation so far:\n{history}\n\n" if history else ""
+        
+        # Create a prompt with the context and query
+        prompt = f"""
+        {history_section}Based on the following information from the document:
+        
+        {context}
+        
+        Please answer this question: {query}
+        
+        If the answer cannot be found in the provided information, please say so.
+        """
+        
+        # Generate response with the configured backend
+        if route is not None:
+            return self.router.generate(route, prompt)
+        return self.generator.generate(prompt)
+
 def main():
     """Main function to run the PDF Document Processor."""
     # Check environment
@@ -264,9 +1135,22 @@ def main():
     # Display header
     display_header()
     
+    # Serve sharded corpora if a shards directory is configured
+    shards_dir = os.getenv("PDF_SHARDS_DIR")
+    shard_manager = None
+    
     # Initialize PDF processor
     try:
-        processor = PDFProcessor()
+        if shards_dir:
+            shard_manager = ShardManager(
+                shards_dir,
+                max_loaded=int(os.getenv("PDF_MAX_LOADED_SHARDS", "8")),
+                memory_limit_mb=float(os.getenv("PDF_SHARD_MEMORY_LIMIT_MB", "0")) or None
+            )
+        else:
+            # A persistent store keeps the index, and the retry queue next to it, across restarts;
+            # on later starts new, changed and deleted PDFs are synced into it
+            processor = PDFProcessor(persist_dir=os.getenv("PDF_PERSIST_DIR") or None)
     except ValueError as e:
         display_message(f"Error: {str(e)}", "error")
         display_message("Please set the GOOGLE_API_KEY environment variable.", "info")
@@ -278,13 +1162,88 @@ def main():
         sys.exit(1)
     
     # Load documents
-    if not processor.load_documents():
-        display_message("No PDF files found in the Document directory.", "warning")
-        display_message("Please add PDF files to the Document directory and restart the application.", "info")
-        display_message(f"Document directory: {processor.document_dir}", "info")
+    if shard_manager:
+        shards = shard_manager.list_shards()
+        if not shards:
+            display_message(f"No shards found in {shards_dir}.", "warning")
+            display_message("Each shard needs a directory with a Document folder of PDF files.", "info")
+            sys.exit(1)
+        display_message(f"Serving {len(shards)} shards: {', '.join(shards)}", "info")
+        display_message("Shards are loaded on first use; select them with @shard:name.", "info")
+    elif processor.persist_dir and processor.load_index():
+        display_message(f"Attached to the stored index with {len(processor.metadata_index)} chunks", "info")
+        if os.getenv("PDF_SNAPSHOT"):
+            # The store was filled from the snapshot on an earlier start and mirrors it, not the Document folder
+            display_message("Using the stored snapshot import; clear PDF_PERSIST_DIR to import the snapshot again.",
+                            "info")
+        else:
+            ingested, removed = processor.sync_documents()
+            if ingested or removed:
+                display_message(f"Ingested {len(ingested)} new or changed files and removed {len(removed)} "
+                                "deleted files.", "info")
+        # Chunks that failed to embed in an earlier run are retried now
+        if len(processor.retry_queue):
+            indexed, remaining = processor.retry_failed_embeddings()
+            display_message(f"Indexed {indexed} chunks queued by an earlier run; {remaining} still queued.",
+                            "warning" if remaining else "info")
+    elif os.getenv("PDF_SNAPSHOT") and os.path.exists(os.getenv("PDF_SNAPSHOT")):
+        # Start from a prebuilt index instead of parsing and embedding the PDFs
+        try:
+            count = processor.import_snapshot(os.getenv("PDF_SNAPSHOT"))
+            display_message(f"Loaded {count} chunks from snapshot {os.getenv('PDF_SNAPSHOT')}", "info")
+        except SnapshotError as e:
+            display_message(f"Error: {str(e)}", "error")
+            sys.exit(1)
+    elif not processor.load_documents():
+        queued = processor.retry_queue.summary()
+        if queued["pending"]:
+            # Every chunk failed to embed; the documents exist but nothing could be indexed
+            display_message(f"None of the {queued['pending']} chunks could be embedded, so nothing was indexed.",
+                            "error")
+            display_message(f"Last error: {queued['last_error']}", "info")
+            display_message(f"The chunks are queued in {processor.retry_queue.path}; restart once the embedding "
+                            "API is reachable.", "info")
+        else:
+            display_message("No PDF files found in the Document directory.", "warning")
+            display_message("Please add PDF files to the Document directory and restart the application.", "info")
+            display_message(f"Document directory: {processor.document_dir}", "info")
         sys.exit(1)
     
-    display_message("\nDocuments loaded and indexed successfully!", "success")
+    # Retrieve for several variants of each question when enabled
+    expansion = os.getenv("QUERY_EXPANSION", "off").lower()
+    if not shard_manager and expansion in ("on", "hyde"):
+        processor.enable_query_expansion(
+            use_hyde=expansion == "hyde",
+            synonyms_file=os.getenv("SYNONYMS_FILE"),
+            early_answer_score=float(os.getenv("EARLY_ANSWER_SCORE", DEFAULT_EARLY_ANSWER_SCORE))
+        )
+    
+    # Answer direct lookups from the retrieved text and send easy questions to cheaper routes when enabled
+    if not shard_manager and os.getenv("EXTRACTIVE_ANSWERS", "off").lower() == "on":
+        processor.enable_extractive_answers(threshold=float(os.getenv("EXTRACTIVE_THRESHOLD", "0.6")))
+    if not shard_manager and os.getenv("MODEL_ROUTING", "off").lower() == "on":
+        processor.enable_model_routing()
+    
+    # Follow-up questions reuse the context of earlier turns
+    session = None if shard_manager else ChatSession(processor)
+    
+    # Pre-embed frequent questions and keep track of the popular ones
+    if not shard_manager:
+        warmup_file = os.getenv("WARMUP_QUERIES_FILE") or os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "warmup_queries.txt"
+        )
+        try:
+            processor.warm_up(warmup_file)
+        except Exception as e:
+            display_message(f"Warning: could not warm up common queries: {str(e)}", "warning")
+    
+    queued = 0 if shard_manager else len(processor.retry_queue)
+    if queued:
+        display_message(f"\nDocuments loaded, but {queued} chunks could not be embedded and are not searchable yet.",
+                        "warning")
+        display_message("Type 'retry' to embed them again.", "info")
+    else:
+        display_message("\nDocuments loaded and indexed successfully!", "success")
     display_message("You can now ask questions about the content of your PDF documents.", "info")
     display_message("Type 'help' for available commands or 'exit' to quit the application.", "info")
     
@@ -293,16 +1252,132 @@ def main():
         query = get_user_input("\nYour question:")
         
         if query.lower() == 'exit':
+            if not shard_manager and processor.popular_queries is not None:
+                processor.popular_queries.stop()
             display_message("Thank you for using the PDF Document Processor!", "info")
             break
         elif query.lower() == 'help':
             display_message("Available commands:", "info")
             display_message("  help - Display this help message", "info")
+            display_message("  stats - Show Gemini API call latencies and scheduler waits", "info")
+            display_message("  memory - Show memory use, and peak memory per ingest stage when profiling", "info")
+            display_message("  tables - List the tables extracted from the documents", "info")
+            display_message("  reset - Start a new conversation", "info")
+            display_message("  health - Check stored vectors and chunks waiting for embedding", "info")
+            display_message("  retry - Re-embed chunks whose embedding failed", "info")
+            display_message("  export <path> - Save the index to a snapshot file", "info")
+            display_message("  import <path> - Replace the index with a snapshot file", "info")
             display_message("  exit - Exit the application", "info")
             display_message("  Any other input will be treated as a question about your documents", "info")
+            display_message("Questions can be scoped with filters, for example:", "info")
+            display_message("  @file:manual.pdf @page:3-7 @tag:hr @type:pdf @since:2024-01-01 @until:2024-12-31", "code")
+            if shard_manager:
+                display_message("  @shard:name - Search only this shard (repeat for several; default is all)", "info")
+        elif query.lower() == 'reset':
+            if session:
+                session.reset()
+            display_message("Started a new conversation.", "info")
+        elif query.lower() == 'memory':
+            display_message(f"Current RSS: {get_rss_mb():.1f} MB", "info")
+            if not shard_manager:
+                usage = processor.node_store.memory_usage()
+                index_usage = processor.metadata_index.memory_usage()
+                display_message(f"Node store: {usage['chunks']} chunks, {usage['text_bytes'] / 1024:.0f} KB "
+                                f"compressed text, {usage['bytes_per_chunk']:.0f} bytes per chunk besides text",
+                                "info")
+                display_message(f"Metadata index: {index_usage['bytes_per_chunk']:.0f} bytes per chunk "
+                                f"(node IDs, ordinal lookup and filter columns)", "info")
+                display_message(f"Total per chunk besides text: "
+                                f"{usage['bytes_per_chunk'] + index_usage['bytes_per_chunk']:.0f} bytes", "info")
+            if shard_manager or not processor.memory_profiler.enabled:
+                display_message("Set PROFILE_MEMORY=1 to measure memory during ingestion.", "info")
+                continue
+            for line in processor.memory_profiler.format_report():
+                display_message(line, "info")
+        elif query.lower() == 'tables':
+            if shard_manager or processor.tables is None:
+                display_message("Set TABLE_EXTRACTION=on to extract tables during ingestion.", "info")
+                continue
+            if not processor.tables.tables:
+                display_message("No tables were found in the documents.", "info")
+            for table in processor.tables.tables:
+                title = f" ({table.title})" if table.title else ""
+                display_message(f"  {table.source()}{title}: {len(table)} rows, columns: "
+                                f"{', '.join(table.columns)}", "info")
+        elif query.lower() == 'stats':
+            try:
+                report = get_client().latency_report()
+            except ValueError:
+                # No API key configured; only local backends are in use
+                report = {}
+            if not report:
+                display_message("No Gemini API calls made yet.", "info")
+            for operation, summary in report.items():
+                latency = ""
+                if "p50_ms" in summary:
+                    latency = (f", p50 {summary['p50_ms']:.0f} ms, p95 {summary['p95_ms']:.0f} ms"
+                               f", mean {summary['mean_ms']:.0f} ms")
+                display_message(f"  {operation}: {summary['calls']} calls, {summary['errors']} errors{latency}", "info")
+            if not shard_manager and processor.extractive is not None:
+                display_message(f"  extractive answers: {processor.extractive.answered} answered, "
+                                f"{processor.extractive.declined} passed to generation", "info")
+            if not shard_manager and processor.tables is not None:
+                display_message(f"  table answers: {processor.tables.matched}", "info")
+            if not shard_manager and processor.router is not None:
+                for route, summary in processor.router.report().items():
+                    display_message(f"  route {route} ({summary['model']}): {summary['calls']} answers, "
+                                    f"p50 {summary.get('p50_ms', 0):.0f} ms, p95 {summary.get('p95_ms', 0):.0f} ms, "
+                                    f"est. cost ${summary['cost_usd']:.4f}", "info")
+            # Time spent queued behind the scheduler's API budget and CPU slots
+            for name, summary in get_scheduler().report().items():
+                display_message(f"  waiting for {name}: {summary['acquired']} acquired, mean "
+                                f"{summary['mean_wait_ms']:.0f} ms, max {summary['max_wait_ms']:.0f} ms", "info")
+        elif query.lower() in ('health', 'retry'):
+            if shard_manager:
+                display_message("The health and retry commands are not available in sharded mode.", "warning")
+                continue
+            if query.lower() == 'retry':
+                indexed, remaining = processor.retry_failed_embeddings()
+                display_message(f"Indexed {indexed} queued chunks; {remaining} still queued.", "info")
+            report = processor.index_health()
+            invalid = report["total"] - report["valid"]
+            display_message(f"Vectors: {report['total']} stored, {report['valid']} valid, {invalid} invalid "
+                            f"(missing {report['missing']}, wrong dimension {report['dimension']}, "
+                            f"non-finite {report['non-finite']}, zero {report['zero']})",
+                            "warning" if invalid else "success")
+            display_message(f"Chunks waiting for embedding: {report['pending_retry']}",
+                            "warning" if report["pending_retry"] else "info")
+        elif query.split(" ", 1)[0].lower() in ('export', 'import') and len(query.split()) == 2:
+            command, path = query.split()
+            if shard_manager:
+                display_message("Snapshots are not available in sharded mode.", "warning")
+                continue
+            try:
+                if command.lower() == 'export':
+                    header = processor.export_snapshot(path)
+                    display_message(f"Exported {header['count']} chunks to {path}", "success")
+                else:
+                    count = processor.import_snapshot(path)
+                    # Earlier turns refer to chunks of the replaced index
+                    session.reset()
+                    display_message(f"Imported {count} chunks from {path}", "success")
+            except (SnapshotError, OSError) as e:
+                display_message(f"Error: {str(e)}", "error")
         elif query.strip():
+            query, shards = parse_shard_selection(query)
+            try:
+                question, filters = parse_query_filters(query)
+            except ValueError as e:
+                display_message(f"Error: {str(e)}", "error")
+                continue
+            if not question:
+                display_message("Please enter a question after the filters.", "warning")
+                continue
             display_message("Processing your question...", "info")
-            answer = processor.query_documents(query)
+            if shard_manager:
+                answer = shard_manager.query_documents(question, shards, filters)
+            else:
+                answer = session.ask(question, filters)
             display_message("\nAnswer:", "success")
             print(answer)
 
@@ -0,0 +1,206 @@
+"""
+Compact node store for the PDF Document Processor
+-------------------------------------------------
+Keeps the text and metadata of every indexed chunk in a few flat buffers
+instead of one TextNode object per chunk:
+
+    text      UTF-8 chunk texts packed into blocks of ``block_chunks`` chunks;
+              full blocks are zlib-compressed, and each chunk is located by
+              (block, offset, length) in three integer arrays
+    metadata  one integer array per metadata key, holding IDs into a table of
+              interned values (0 means the key is absent)
+    IDs       chunks are addressed by integer ordinals, shared with the
+              MetadataIndex, which holds the only copy of the string node IDs
+
+TextNodes are built on demand, only for the chunks that reach the prompt.
+"""
+
+import sys
+import zlib
+import threading
+from array import array
+from collections import OrderedDict
+
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+
+MISSING = 0
+
+
+class NodeStore:
+    """Append-only store of chunk texts and metadata addressed by ordinal."""
+
+    def __init__(self, block_chunks=64, cache_blocks=8, compression_level=6):
+        """
+        Initialize an empty store.
+
+        Args:
+            block_chunks (int): Number of chunks compressed together
+            cache_blocks (int): Number of decompressed blocks kept for reuse
+            compression_level (int): zlib compression level
+        """
+        self.block_chunks = block_chunks
+        self.cache_blocks = cache_blocks
+        self.compression_level = compression_level
+        self._lock = threading.Lock()
+        self._init_buffers()
+
+    def _init_buffers(self):
+        self._blocks = []
+        self._open = []
+        self._open_size = 0
+        self._block = array("I")
+        self._offset = array("I")
+        self._length = array("I")
+        # Interned values; ID 0 is reserved for missing keys
+        self._values = [None]
+        self._value_ids = {}
+        self._columns = {}
+        self._excluded_embed = array("I")
+        self._excluded_llm = array("I")
+        self._source = array("I")
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self._block)
+
+    def clear(self):
+        """Remove all chunks."""
+        with self._lock:
+            self._init_buffers()
+
+    def _intern(self, value):
+        # The type is part of the key so that True, 1 and 1.0 stay distinct
+        key = (type(value).__name__, value if isinstance(value, (str, int, float, bool, tuple)) else repr(value))
+        value_id = self._value_ids.get(key)
+        if value_id is None:
+            value_id = len(self._values)
+            self._values.append(value)
+            self._value_ids[key] = value_id
+        return value_id
+
+    def _seal_block(self):
+        self._blocks.append(zlib.compress(b"".join(self._open), self.compression_level))
+        self._open = []
+        self._open_size = 0
+
+    def append(self, node):
+        """
+        Add a chunk.
+
+        Args:
+            node (TextNode): The chunk; its text, metadata, excluded metadata keys
+                and source document are kept
+
+        Returns:
+            int: The ordinal of the chunk
+        """
+        data = node.get_content().encode("utf-8")
+        with self._lock:
+            ordinal = len(self._block)
+            self._block.append(len(self._blocks))
+            self._offset.append(self._open_size)
+            self._length.append(len(data))
+            self._open.append(data)
+            self._open_size += len(data)
+
+            for key, value in node.metadata.items():
+                column = self._columns.get(key)
+                if column is None:
+                    column = self._columns[key] = array("I", bytes(4 * ordinal))
+                column.append(self._intern(value))
+            for column in self._columns.values():
+                if len(column) == ordinal:
+                    column.append(MISSING)
+
+            self._excluded_embed.append(self._intern(tuple(node.excluded_embed_metadata_keys)))
+            self._excluded_llm.append(self._intern(tuple(node.excluded_llm_metadata_keys)))
+            self._source.append(self._intern(node.ref_doc_id) if node.ref_doc_id else MISSING)
+
+            if len(self._open) >= self.block_chunks:
+                self._seal_block()
+        return ordinal
+
+    def _block_bytes(self, block):
+        if block == len(self._blocks):
+            return b"".join(self._open)
+        data = self._cache.get(block)
+        if data is None:
+            data = zlib.decompress(self._blocks[block])
+            self._cache[block] = data
+            while len(self._cache) > self.cache_blocks:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(block)
+        return data
+
+    def text(self, ordinal):
+        """Return the text of a chunk."""
+        with self._lock:
+            data = self._block_bytes(self._block[ordinal])
+            start = self._offset[ordinal]
+            return data[start:start + self._length[ordinal]].decode("utf-8")
+
+    def metadata(self, ordinal):
+        """Return the metadata of a chunk as a new dict."""
+        with self._lock:
+            return {
+                key: self._values[column[ordinal]]
+                for key, column in self._columns.items()
+                if column[ordinal] != MISSING
+            }
+
+    def node(self, ordinal, node_id):
+        """
+        Build a TextNode for a chunk.
+
+        Args:
+            ordinal (int): The chunk ordinal
+            node_id (str): The node ID to give the TextNode
+
+        Returns:
+            TextNode: The chunk
+        """
+        text = self.text(ordinal)
+        metadata = self.metadata(ordinal)
+        with self._lock:
+            excluded_embed = list(self._values[self._excluded_embed[ordinal]])
+            excluded_llm = list(self._values[self._excluded_llm[ordinal]])
+            source = self._values[self._source[ordinal]]
+        relationships = {}
+        if source:
+            relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id=source)
+        return TextNode(
+            id_=node_id,
+            text=text,
+            metadata=metadata,
+            excluded_embed_metadata_keys=excluded_embed,
+            excluded_llm_metadata_keys=excluded_llm,
+            relationships=relationships
+        )
+
+    def memory_usage(self):
+        """
+        Estimate the memory held by the store.
+
+        Returns:
+            dict: Bytes of compressed and open text, of per-chunk arrays and of
+                interned values, and the per-chunk overhead excluding text
+        """
+        with self._lock:
+            text_bytes = sum(len(block) for block in self._blocks) + self._open_size
+            arrays = [self._block, self._offset, self._length, self._excluded_embed,
+                      self._excluded_llm, self._source, *self._columns.values()]
+            array_bytes = sum(len(column) * column.itemsize for column in arrays)
+            # Shallow sizes of the values and their lookup keys; strings inside
+            # tuples are mostly the metadata keys, which are shared
+            value_bytes = (sys.getsizeof(self._values) + sys.getsizeof(self._value_ids)
+                           + sum(sys.getsizeof(value) for value in self._values)
+                           + sum(sys.getsizeof(key) for key in self._value_ids))
+            count = len(self._block)
+        return {
+            "chunks": count,
+            "text_bytes": text_bytes,
+            "array_bytes": array_bytes,
+            "interned_bytes": value_bytes,
+            "bytes_per_chunk": (array_bytes + value_bytes) / count if count else 0.0,
+        }
@@ -0,0 +1,237 @@
+"""
+Memory profiling for the PDF Document Processor
+-----------------------------------------------
+MemoryProfiler measures the ingest pipeline stage by stage: a background
+thread samples the process RSS while a stage runs, and tracemalloc records
+the peak of Python allocations. Results are aggregated per stage and per
+file. Stages can be nested; the largest allocation sites are collected from
+a tracemalloc snapshot, which is costly, so one is only taken when a
+top-level stage ends or when a stage has gone over the memory budget.
+
+MemoryBudget tells the pipeline when RSS is close to a configured limit so
+that it can index and release what it holds before the process is killed.
+"""
+
+import time
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+from utils import get_rss_mb
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+class MemoryBudget:
+    """A soft RSS limit checked between batches."""
+
+    def __init__(self, limit_mb=None, high_water=0.85):
+        """
+        Initialize the budget.
+
+        Args:
+            limit_mb (float): The RSS limit in megabytes (no limit if not given)
+            high_water (float): Fraction of the limit at which batches are flushed
+        """
+        self.limit_mb = limit_mb
+        self.high_water = high_water
+        self.flushes = 0
+
+    @property
+    def enabled(self):
+        return bool(self.limit_mb)
+
+    def exceeded(self, rss_mb):
+        """Return True if an RSS value is at or above the high-water mark of the limit."""
+        return self.enabled and rss_mb >= self.limit_mb * self.high_water
+
+    def near_limit(self):
+        """Return True if RSS has reached the high-water mark of the limit."""
+        if not self.enabled:
+            return False
+        rss = get_rss_mb()
+        if self.exceeded(rss):
+            self.flushes += 1
+            logger.info(f"RSS {rss:.0f} MB is close to the {self.limit_mb:.0f} MB budget; flushing early")
+            return True
+        return False
+
+
+class MemoryProfiler:
+    """
+    Records peak memory per pipeline stage and per file.
+
+    ``stage`` blocks may be nested; an outer stage's peaks include those of
+    its inner stages. Stages are measured on one thread at a time. When the
+    profiler is disabled, ``stage`` does nothing.
+    """
+
+    def __init__(self, enabled=False, top_n=10, sample_interval=0.05, frames=1, budget=None):
+        """
+        Initialize the profiler.
+
+        Args:
+            enabled (bool): Whether to measure anything
+            top_n (int): Number of allocation sites to report
+            sample_interval (float): Seconds between RSS samples
+            frames (int): Traceback depth recorded by tracemalloc
+            budget (MemoryBudget): Stages whose RSS peak goes over this budget also
+                record their allocation sites
+        """
+        self.enabled = enabled
+        self.top_n = top_n
+        self.sample_interval = sample_interval
+        self.frames = frames
+        self.budget = budget
+        self.stages = {}
+        self.files = {}
+        self._sites = {}
+        self._lock = threading.Lock()
+        # Open stages, outermost first, as [traced before, traced peak, RSS before, RSS peak]
+        self._open = []
+        self.snapshots = 0
+        self._stopped = threading.Event()
+        self._sampler = None
+        self._started_tracing = False
+
+    def start(self):
+        """Start tracing allocations and sampling RSS."""
+        if not self.enabled or self._sampler is not None:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+        self._stopped.clear()
+        self._sampler = threading.Thread(target=self._sample, name="memory-sampler", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        """Stop sampling and, if this profiler started it, tracemalloc."""
+        if self._sampler is None:
+            return
+        self._stopped.set()
+        self._sampler.join()
+        self._sampler = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _sample(self):
+        while not self._stopped.wait(self.sample_interval):
+            rss = get_rss_mb()
+            with self._lock:
+                if self._open and rss > self._open[-1][3]:
+                    self._open[-1][3] = rss
+
+    @contextmanager
+    def stage(self, name, file_name=None):
+        """
+        Measure one run of a pipeline stage.
+
+        Args:
+            name (str): The stage, e.g. "read", "split", "embed" or "index"
+            file_name (str): The file being processed, if any
+        """
+        if not self.enabled or not tracemalloc.is_tracing():
+            yield
+            return
+        rss_before = get_rss_mb()
+        traced_before, traced_peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            if self._open:
+                # Resetting the peak below would lose the enclosing stage's peak so far
+                self._open[-1][1] = max(self._open[-1][1], traced_peak)
+            frame = [traced_before, traced_before, rss_before, rss_before]
+            self._open.append(frame)
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            traced_after, traced_peak = tracemalloc.get_traced_memory()
+            rss_after = get_rss_mb()
+            with self._lock:
+                self._open.pop()
+                frame[1] = max(frame[1], traced_peak)
+                frame[3] = max(frame[3], rss_after)
+                if self._open:
+                    parent = self._open[-1]
+                    parent[1] = max(parent[1], frame[1])
+                    parent[3] = max(parent[3], frame[3])
+                top_level = not self._open
+            self._record(name, file_name, {
+                "calls": 1,
+                "seconds": elapsed,
+                "peak_rss_mb": frame[3],
+                "rss_growth_mb": rss_after - rss_before,
+                "peak_traced_mb": (frame[1] - traced_before) / MB,
+                "retained_traced_mb": (traced_after - traced_before) / MB,
+            })
+            if top_level or (self.budget is not None and self.budget.exceeded(frame[3])):
+                self._record_sites(name)
+
+    def _record(self, name, file_name, sample):
+        with self._lock:
+            for totals, key in ((self.stages, name), (self.files, file_name)):
+                if key is None:
+                    continue
+                entry = totals.get(key)
+                if entry is None:
+                    totals[key] = dict(sample)
+                    continue
+                entry["calls"] += 1
+                entry["seconds"] += sample["seconds"]
+                entry["rss_growth_mb"] += sample["rss_growth_mb"]
+                entry["retained_traced_mb"] += sample["retained_traced_mb"]
+                entry["peak_rss_mb"] = max(entry["peak_rss_mb"], sample["peak_rss_mb"])
+                entry["peak_traced_mb"] = max(entry["peak_traced_mb"], sample["peak_traced_mb"])
+
+    def _record_sites(self, name):
+        # Keep the largest size seen per allocation site across stage ends
+        self.snapshots += 1
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        statistics = snapshot.statistics("lineno")[:self.top_n]
+        with self._lock:
+            for stat in statistics:
+                frame = stat.traceback[0]
+                site = f"{frame.filename}:{frame.lineno}"
+                size_mb = stat.size / MB
+                if size_mb > self._sites.get(site, (0.0, None))[0]:
+                    self._sites[site] = (size_mb, name)
+
+    def report(self):
+        """
+        Summarize the measurements.
+
+        Returns:
+            dict: Per-stage and per-file measurements, and the largest allocation
+                sites as (site, size in MB, stage) tuples
+        """
+        with self._lock:
+            sites = sorted(self._sites.items(), key=lambda item: item[1][0], reverse=True)[:self.top_n]
+            return {
+                "stages": {name: dict(entry) for name, entry in self.stages.items()},
+                "files": {name: dict(entry) for name, entry in self.files.items()},
+                "top_allocations": [(site, size, stage) for site, (size, stage) in sites],
+            }
+
+    def format_report(self):
+        """Return the report as lines of text."""
+        report = self.report()
+        lines = ["Peak memory per stage:"]
+        for name, entry in report["stages"].items():
+            lines.append(f"  {name}: RSS peak {entry['peak_rss_mb']:.1f} MB, traced peak "
+                         f"{entry['peak_traced_mb']:.1f} MB, retained {entry['retained_traced_mb']:.1f} MB, "
+                         f"{entry['calls']} runs, {entry['seconds']:.2f} s")
+        lines.append("Peak memory per file:")
+        for name, entry in report["files"].items():
+            lines.append(f"  {name}: RSS peak {entry['peak_rss_mb']:.1f} MB, traced peak "
+                         f"{entry['peak_traced_mb']:.1f} MB")
+        lines.append("Largest allocation sites:")
+        for site, size, stage in report["top_allocations"]:
+            lines.append(f"  {size:.2f} MB at {site} ({stage})")
+        return lines
@@ -0,0 +1,201 @@
+"""
+Embedding retry queue for the PDF Document Processor
+----------------------------------------------------
+Chunks whose embedding fails during ingestion are never written to the index
+with a placeholder vector. Instead they are appended to a JSON-lines file so
+they survive a restart, and are re-embedded later in batches.
+"""
+
+import os
+import json
+import hashlib
+import time
+import logging
+import threading
+
+import numpy as np
+from llama_index.core.schema import TextNode
+
+logger = logging.getLogger(__name__)
+
+
+def cache_dir(document_dir):
+    """
+    Return the per-user cache directory for a document directory.
+
+    Used for state that has no persist directory to live in, so that nothing
+    is written into the user's Document folder.
+
+    Args:
+        document_dir (str): The document directory
+
+    Returns:
+        str: A directory under XDG_CACHE_HOME (default ~/.cache), unique per document directory
+    """
+    base = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    digest = hashlib.sha1(os.path.abspath(document_dir).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(base, "pdf-processor", digest)
+
+
+def invalid_embedding_reason(embedding, dimension):
+    """
+    Check an embedding before it is written to the index.
+
+    Args:
+        embedding (list): The embedding to check
+        dimension (int): The expected dimension
+
+    Returns:
+        str: Why the embedding is invalid ('missing', 'dimension', 'non-finite'
+            or 'zero'), or None if it is valid
+    """
+    if embedding is None or len(embedding) == 0:
+        return "missing"
+    if len(embedding) != dimension:
+        return "dimension"
+    vector = np.asarray(embedding, dtype=np.float64)
+    if not np.all(np.isfinite(vector)):
+        return "non-finite"
+    if not np.any(vector):
+        return "zero"
+    return None
+
+
+class RetryQueue:
+    """
+    Durable queue of chunks waiting to be embedded.
+
+    Entries are appended and fsynced as they fail. A retry reads entries with
+    ``pending`` and reports the outcome with ``resolve``, which rewrites the
+    file atomically, so a crash mid-retry never loses a queued chunk.
+    """
+
+    def __init__(self, path):
+        """
+        Open the queue stored at ``path``; the file is created on first use.
+
+        Args:
+            path (str): Location of the JSON-lines queue file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # A partially written last line after a crash
+                    logger.warning(f"Skipping unreadable entry in {self.path}")
+        return entries
+
+    def _write(self, entries):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._read())
+
+    def add(self, nodes, error, attempts=1):
+        """
+        Record chunks that could not be embedded.
+
+        Args:
+            nodes (list): The TextNodes that failed
+            error (str): The error that caused the failure
+            attempts (int): Number of embedding attempts made so far
+        """
+        if not nodes:
+            return
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                for node in nodes:
+                    node_dict = node.to_dict()
+                    node_dict["embedding"] = None
+                    entry = {
+                        "node": node_dict,
+                        "error": str(error),
+                        "attempts": attempts,
+                        "queued_at": time.time(),
+                    }
+                    f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        logger.warning(f"Queued {len(nodes)} chunks for embedding retry: {error}")
+
+    def pending(self, limit=None):
+        """
+        Return queued chunks without removing them.
+
+        Args:
+            limit (int): Maximum number of chunks to return (all if not given)
+
+        Returns:
+            list: (TextNode, attempts) pairs, oldest first
+        """
+        with self._lock:
+            entries = self._read()
+        if limit is not None:
+            entries = entries[:limit]
+        return [(TextNode.from_dict(entry["node"]), entry.get("attempts", 1)) for entry in entries]
+
+    def resolve(self, succeeded, failed, error=None):
+        """
+        Record the outcome of a retry.
+
+        Args:
+            succeeded (list): Node IDs that were embedded and indexed; removed from the queue
+            failed (list): Node IDs that failed again; their attempt count is increased
+            error (str): The error of the failed attempt
+        """
+        succeeded, failed = set(succeeded), set(failed)
+        with self._lock:
+            entries = []
+            for entry in self._read():
+                node_id = entry["node"].get("id_")
+                if node_id in succeeded:
+                    continue
+                if node_id in failed:
+                    entry["attempts"] = entry.get("attempts", 1) + 1
+                    if error:
+                        entry["error"] = str(error)
+                entries.append(entry)
+            self._write(entries)
+
+    def clear(self):
+        """Remove all queued entries."""
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def summary(self):
+        """
+        Summarize the queue.
+
+        Returns:
+            dict: Number of pending chunks, files they belong to and the last error
+        """
+        with self._lock:
+            entries = self._read()
+        files = sorted({entry["node"].get("metadata", {}).get("file_name", "") for entry in entries})
+        return {
+            "pending": len(entries),
+            "files": [name for name in files if name],
+            "last_error": entries[-1]["error"] if entries else None,
+        }
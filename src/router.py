@@ -0,0 +1,204 @@
+"""
+Model routing for the PDF Document Processor
+--------------------------------------------
+Sends each question to the cheapest route that can answer it, judged from
+local signals that cost nothing to compute:
+
+    extractive  answered by the caller from the best matching sentence of the
+                retrieved chunks, without a model call; for short lookups
+                whose words all appear in a clearly best chunk. Only offered
+                when the caller has an extractive answer stage
+    fast        a small, fast model (gemini-1.5-flash by default) for short
+                questions that the retrieved context covers well
+    large       the configured generation model for everything else, and for
+                questions asking for reasoning, comparison or summaries
+
+Latency and an estimate of the cost are recorded per route.
+"""
+
+import os
+import time
+import logging
+import threading
+
+from backends import GeminiGenerator
+from gemini_client import DEFAULT_GENERATION_MODEL, LatencyStats
+from utils import content_words, estimate_tokens, tokenize
+
+logger = logging.getLogger(__name__)
+
+ROUTES = ("extractive", "fast", "large")
+
+DEFAULT_FAST_GENERATION_MODEL = "models/gemini-1.5-flash-001"
+
+# USD per million input and output tokens, for prompts up to 128k tokens
+MODEL_PRICES = {
+    "models/gemini-1.5-pro-001": (3.50, 10.50),
+    "models/gemini-1.5-flash-001": (0.35, 1.05),
+}
+
+# Words that signal a question needs more than a lookup
+REASONING_WORDS = frozenset("""
+why how explain compare comparison difference differences versus vs summarize summary summarise
+analyze analyse evaluate implications pros cons advantages disadvantages relationship impact
+""".split())
+
+
+class ModelRouter:
+    """Chooses a generation route per question and accounts for latency and cost."""
+
+    # Extractive answers need a confident, clearly best chunk covering the question
+    extractive_max_words = 8
+    extractive_min_overlap = 0.8
+    extractive_min_score = 0.6
+    extractive_min_margin = 0.02
+
+    # The fast model takes short questions the context covers well
+    fast_max_words = 20
+    fast_min_overlap = 0.5
+
+    def __init__(self, generators, extractive=False):
+        """
+        Initialize the router.
+
+        Args:
+            generators (dict): Route name to GenerationBackend for the fast and large
+                routes; a missing fast route falls back to the large one
+            extractive (bool): Whether the caller answers the extractive route itself;
+                if not, only the fast and large routes are chosen
+        """
+        if "large" not in generators:
+            raise ValueError("The large route needs a generator")
+        self.generators = generators
+        self.extractive = extractive
+        self.stats = {route: LatencyStats() for route in ROUTES}
+        self.costs = {route: 0.0 for route in ROUTES}
+        self._lock = threading.Lock()
+
+    def signals(self, query, nodes):
+        """
+        Compute the routing signals for a question.
+
+        Args:
+            query (str): The question
+            nodes (list): Retrieved NodeWithScore results, best first
+
+        Returns:
+            dict: Number of content words, whether reasoning is asked for, top score,
+                margin over the second chunk and the share of question words in the top chunk
+        """
+        words = content_words(query)
+        scores = [node.score or 0.0 for node in nodes]
+        top_words = set(tokenize(nodes[0].node.get_content())) if nodes else set()
+        return {
+            "words": len(words),
+            "reasoning": bool(REASONING_WORDS & set(tokenize(query))),
+            "top_score": scores[0] if scores else 0.0,
+            "margin": scores[0] - scores[1] if len(scores) > 1 else (scores[0] if scores else 0.0),
+            "overlap": sum(word in top_words for word in words) / len(words) if words else 0.0,
+        }
+
+    def choose(self, query, nodes, follow_up=False):
+        """
+        Choose the route for a question.
+
+        Args:
+            query (str): The question
+            nodes (list): Retrieved NodeWithScore results, best first
+            follow_up (bool): Whether the question refers back to earlier turns;
+                follow-ups are never answered extractively
+
+        Returns:
+            tuple: (route name, signals)
+        """
+        signals = self.signals(query, nodes)
+        route = "large"
+        if not signals["reasoning"]:
+            if (self.extractive
+                    and not follow_up
+                    and signals["words"] <= self.extractive_max_words
+                    and signals["overlap"] >= self.extractive_min_overlap
+                    and signals["top_score"] >= self.extractive_min_score
+                    and signals["margin"] >= self.extractive_min_margin):
+                route = "extractive"
+            elif signals["words"] <= self.fast_max_words and signals["overlap"] >= self.fast_min_overlap:
+                route = "fast"
+        if route == "fast" and "fast" not in self.generators:
+            route = "large"
+        return route, signals
+
+    def fallback(self, route):
+        """Return the model route to use when ``route`` cannot answer."""
+        for candidate in ROUTES[ROUTES.index(route) + 1:]:
+            if candidate in self.generators:
+                return candidate
+        return "large"
+
+    def record(self, route, seconds):
+        """Record an answer produced outside the router, such as an extractive one."""
+        self.stats[route].record(seconds)
+
+    def generate(self, route, prompt):
+        """
+        Generate an answer on a route and record its latency and estimated cost.
+
+        Args:
+            route (str): The route chosen by ``choose``
+            prompt (str): The prompt
+
+        Returns:
+            str: The answer
+        """
+        generator = self.generators[route]
+        start = time.perf_counter()
+        try:
+            answer = generator.generate(prompt)
+        except Exception:
+            self.stats[route].record(time.perf_counter() - start, error=True)
+            raise
+        self.stats[route].record(time.perf_counter() - start)
+        input_price, output_price = MODEL_PRICES.get(generator.model_name, (0.0, 0.0))
+        cost = (estimate_tokens(prompt) * input_price + estimate_tokens(answer) * output_price) / 1_000_000
+        with self._lock:
+            self.costs[route] += cost
+        return answer
+
+    def report(self):
+        """
+        Summarize the routes used.
+
+        Returns:
+            dict: Per route, the model, call counts, latency percentiles and estimated cost in USD
+        """
+        with self._lock:
+            costs = dict(self.costs)
+        report = {}
+        for route in ROUTES:
+            summary = self.stats[route].summary()
+            if summary["calls"]:
+                summary["model"] = self.generators[route].model_name if route in self.generators else route
+                summary["cost_usd"] = costs[route]
+                report[route] = summary
+        return report
+
+
+def create_router(generation_backend, generator, client=None, fast_model=None, extractive=False):
+    """
+    Build the router for a processor.
+
+    Args:
+        generation_backend (str): The processor's generation backend name
+        generator (GenerationBackend): The processor's generator, used as the large route
+        client: Gemini client for the fast route
+        fast_model (str): Fast model name (defaults to FAST_GENERATION_MODEL or gemini-1.5-flash)
+        extractive (bool): Whether the caller serves the extractive route
+
+    Returns:
+        ModelRouter: The router
+    """
+    generators = {"large": generator}
+    if generation_backend == "gemini":
+        fast_model = fast_model or os.getenv("FAST_GENERATION_MODEL", DEFAULT_FAST_GENERATION_MODEL)
+        if fast_model != getattr(generator, "model_name", DEFAULT_GENERATION_MODEL):
+            generators["fast"] = GeminiGenerator(client, fast_model)
+    return ModelRouter(generators, extractive=extractive)
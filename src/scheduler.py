@@ -0,0 +1,271 @@
+"""
+Priority scheduler for the PDF Document Processor
+-------------------------------------------------
+Interactive questions and bulk ingestion share one process, one API quota
+and one CPU. The scheduler arbitrates both:
+
+    API rate budget   a token bucket shared by every Gemini call; interactive
+                      calls are served first and bulk calls may not dip into
+                      a reserve kept for interactive traffic
+    CPU worker slots  a fixed number of slots for CPU-heavy work (PDF parsing,
+                      splitting, local embedding); bulk work is capped below
+                      the total so interactive work always finds a free slot
+
+Work is interactive unless it runs inside ``with priority(BULK):``; the
+ingestion paths of PDFProcessor mark themselves as bulk. Bulk work is
+pre-empted between calls, never in the middle of one.
+
+The API budget defaults to DEFAULT_REQUESTS_PER_MINUTE, below the per-minute
+quota of the paid Gemini generation models, so that the priority ordering
+applies out of the box; API_REQUESTS_PER_MINUTE=0 turns the budget off.
+"""
+
+import os
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+DEFAULT_REQUESTS_PER_MINUTE = 300
+
+_priority = contextvars.ContextVar("scheduler_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level):
+    """Run the enclosed work with the given priority class."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    """Return the priority class of the calling code."""
+    return _priority.get()
+
+
+class WaitStats:
+    """Time spent waiting for the scheduler, per priority class."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def record(self, waited):
+        self.count += 1
+        self.total += waited
+        self.maximum = max(self.maximum, waited)
+
+    def summary(self):
+        return {
+            "acquired": self.count,
+            "mean_wait_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "max_wait_ms": self.maximum * 1000,
+        }
+
+
+class RateBudget:
+    """Token bucket shared by all API calls, served in priority order."""
+
+    def __init__(self, requests_per_minute=None, burst=None, bulk_reserve=0.2):
+        """
+        Initialize the budget.
+
+        Args:
+            requests_per_minute (float): Sustained request rate (unlimited if not given)
+            burst (float): Bucket capacity (defaults to ten seconds of requests)
+            bulk_reserve (float): Fraction of the bucket bulk calls may not use
+        """
+        self.rate = requests_per_minute / 60.0 if requests_per_minute else None
+        self.capacity = burst or (max(1.0, self.rate * 10) if self.rate else 0.0)
+        self.bulk_floor = min(self.capacity * bulk_reserve, max(self.capacity - 1.0, 0.0))
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._waiting = {INTERACTIVE: 0, BULK: 0}
+        self._condition = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, level):
+        """
+        Take one request from the budget, waiting as needed.
+
+        Args:
+            level (int): INTERACTIVE or BULK
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        if self.rate is None:
+            return 0.0
+        start = time.monotonic()
+        with self._condition:
+            self._waiting[level] += 1
+            try:
+                while True:
+                    self._refill()
+                    floor = 0.0 if level == INTERACTIVE else self.bulk_floor
+                    ahead = any(self._waiting[other] for other in self._waiting if other < level)
+                    if not ahead and self.tokens >= floor + 1.0:
+                        self.tokens -= 1.0
+                        return time.monotonic() - start
+                    shortfall = floor + 1.0 - self.tokens
+                    self._condition.wait(shortfall / self.rate if shortfall > 0 else 0.05)
+            finally:
+                self._waiting[level] -= 1
+                self._condition.notify_all()
+
+
+class WorkerSlots:
+    """Counting gate for CPU-heavy work with a cap on bulk use."""
+
+    def __init__(self, slots, interactive_reserve=1):
+        """
+        Initialize the slots.
+
+        Args:
+            slots (int): Total number of concurrent CPU-heavy tasks
+            interactive_reserve (int): Slots bulk work may never take
+        """
+        self.slots = max(1, slots)
+        self.bulk_limit = max(1, self.slots - interactive_reserve)
+        self._in_use = {INTERACTIVE: 0, BULK: 0}
+        self._waiting = {INTERACTIVE: 0, BULK: 0}
+        self._condition = threading.Condition()
+        self._held = threading.local()
+
+    def _available(self, level):
+        if sum(self._in_use.values()) >= self.slots:
+            return False
+        if level == INTERACTIVE:
+            return True
+        return self._in_use[BULK] < self.bulk_limit and not self._waiting[INTERACTIVE]
+
+    @contextmanager
+    def slot(self, level):
+        """Hold a slot for the enclosed work; nested use in one thread holds a single slot."""
+        depth = getattr(self._held, "depth", 0)
+        if depth:
+            self._held.depth = depth + 1
+            try:
+                yield 0.0
+            finally:
+                self._held.depth -= 1
+            return
+        start = time.monotonic()
+        with self._condition:
+            self._waiting[level] += 1
+            try:
+                while not self._available(level):
+                    self._condition.wait()
+                self._in_use[level] += 1
+            finally:
+                self._waiting[level] -= 1
+        self._held.depth = 1
+        try:
+            yield time.monotonic() - start
+        finally:
+            self._held.depth = 0
+            with self._condition:
+                self._in_use[level] -= 1
+                self._condition.notify_all()
+
+
+class Scheduler:
+    """Shares the API rate budget and CPU worker slots between priority classes."""
+
+    def __init__(self, requests_per_minute=None, cpu_slots=None, bulk_reserve=0.2):
+        """
+        Initialize the scheduler.
+
+        Args:
+            requests_per_minute (float): Global API request rate (unlimited if not given)
+            cpu_slots (int): Number of CPU worker slots (defaults to the CPU count, at least 2)
+            bulk_reserve (float): Fraction of the API budget kept for interactive calls
+        """
+        self.rate_budget = RateBudget(requests_per_minute, bulk_reserve=bulk_reserve)
+        self.worker_slots = WorkerSlots(cpu_slots or max(2, os.cpu_count() or 1))
+        self._stats = {(resource, level): WaitStats() for resource in ("api", "cpu") for level in PRIORITY_NAMES}
+        self._stats_lock = threading.Lock()
+
+    def _record(self, resource, waited):
+        with self._stats_lock:
+            self._stats[(resource, current_priority())].record(waited)
+
+    def acquire_api(self):
+        """Wait for the API budget to allow one request at the caller's priority."""
+        self._record("api", self.rate_budget.acquire(current_priority()))
+
+    @contextmanager
+    def cpu_slot(self):
+        """Hold a CPU worker slot at the caller's priority for the enclosed work."""
+        with self.worker_slots.slot(current_priority()) as waited:
+            self._record("cpu", waited)
+            yield
+
+    def queue_depths(self):
+        """Return the number of callers currently waiting per resource and priority class."""
+        depths = {}
+        for resource, gate in (("api", self.rate_budget), ("cpu", self.worker_slots)):
+            with gate._condition:
+                for level, waiting in gate._waiting.items():
+                    depths[f"{resource} {PRIORITY_NAMES[level]}"] = waiting
+        return depths
+
+    def report(self):
+        """Return the waiting times per resource and priority class."""
+        with self._stats_lock:
+            return {
+                f"{resource} {PRIORITY_NAMES[level]}": stats.summary()
+                for (resource, level), stats in self._stats.items()
+                if stats.count
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """
+    Return the shared scheduler, creating it on first use.
+
+    Settings are read from API_REQUESTS_PER_MINUTE (DEFAULT_REQUESTS_PER_MINUTE
+    if unset, 0 for no limit) and CPU_WORKER_SLOTS.
+
+    Returns:
+        Scheduler: The shared scheduler
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler(
+                requests_per_minute=float(os.getenv("API_REQUESTS_PER_MINUTE", DEFAULT_REQUESTS_PER_MINUTE)) or None,
+                cpu_slots=int(os.getenv("CPU_WORKER_SLOTS", "0")) or None
+            )
+        return _scheduler
+
+
+def set_scheduler(scheduler):
+    """
+    Replace the shared scheduler.
+
+    Args:
+        scheduler (Scheduler): The scheduler to use, or None to recreate it on next use
+    """
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
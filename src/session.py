@@ -0,0 +1,192 @@
+"""
+Conversation sessions for the PDF Document Processor
+----------------------------------------------------
+A ChatSession wraps a PDFProcessor for multi-turn use. It keeps the recent
+turns, rewrites follow-up questions into standalone queries, keeps every
+turn's query embedding and retrieved chunks, and reuses those chunks when a
+new question is close enough to an earlier one, so follow-ups skip the
+vector search. Query embeddings come from the processor's query cache. The
+conversation starts over when the processor's index is replaced.
+"""
+
+import re
+import logging
+from collections import deque
+
+import numpy as np
+
+from utils import content_words, estimate_tokens, tokenize
+
+logger = logging.getLogger(__name__)
+
+# Pronouns that refer back to an earlier turn when they open a question
+REFERRING_PRONOUNS = frozenset([
+    "it", "its", "they", "them", "their", "this", "that", "these", "those", "he", "she", "him", "her", "his",
+])
+# Number of leading words searched for a referring pronoun, as in "How are they trained?"
+PRONOUN_WINDOW = 3
+FOLLOW_UP_PREFIX = re.compile(r"^\s*(and|also|what about|how about|why|how so|then|so)\b", re.IGNORECASE)
+
+
+class Turn:
+    """One question and answer with the work done to produce it."""
+
+    def __init__(self, question, standalone_query, query_embedding, nodes, answer, filters_key):
+        self.question = question
+        self.standalone_query = standalone_query
+        self.query_embedding = query_embedding
+        self.nodes = nodes
+        self.answer = answer
+        self.filters_key = filters_key
+
+
+class ChatSession:
+    """
+    Multi-turn conversation over a PDFProcessor.
+    """
+
+    def __init__(self, processor, max_turns=10, history_token_budget=1500, reuse_threshold=0.9):
+        """
+        Initialize the session.
+
+        Args:
+            processor (PDFProcessor): The processor to query
+            max_turns (int): Number of recent turns kept for reuse and history
+            history_token_budget (int): Maximum estimated tokens of history added to the prompt
+            reuse_threshold (float): Cosine similarity above which an earlier turn's
+                chunks are reused instead of retrieving again
+        """
+        self.processor = processor
+        self.turns = deque(maxlen=max_turns)
+        self.history_token_budget = history_token_budget
+        self.reuse_threshold = reuse_threshold
+        self.retrievals = 0
+        self.reuses = 0
+        self.index_version = processor.index_version
+
+    def reset(self):
+        """Forget the conversation."""
+        self.turns.clear()
+        self.index_version = self.processor.index_version
+
+    def is_follow_up(self, question):
+        """
+        Return True if a question appears to refer back to the previous turn.
+
+        A question is a follow-up if it opens with a continuation such as "and"
+        or "what about", or has a pronoun among its first few words.
+        """
+        if not self.turns:
+            return False
+        if FOLLOW_UP_PREFIX.match(question):
+            return True
+        return any(token in REFERRING_PRONOUNS for token in tokenize(question)[:PRONOUN_WINDOW])
+
+    def rewrite(self, question):
+        """
+        Rewrite a follow-up question into a standalone query.
+
+        The topic words of the previous standalone query are appended, so
+        "How are they trained?" after "What are neural networks?" becomes
+        "How are they trained? (neural networks)".
+
+        Args:
+            question (str): The question as asked
+
+        Returns:
+            str: A query that can be retrieved on its own
+        """
+        if not self.is_follow_up(question):
+            return question
+        topic = [word for word in content_words(self.turns[-1].standalone_query)
+                 if word not in set(tokenize(question))]
+        if not topic:
+            return question
+        return f"{question} ({' '.join(dict.fromkeys(topic))})"
+
+    def _find_reusable(self, query_embedding, filters_key):
+        """Return the cached turn most similar to the query, if similar enough."""
+        best, best_score = None, self.reuse_threshold
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query_vector)
+        if not query_norm:
+            return None
+        for turn in self.turns:
+            if turn.filters_key != filters_key or not turn.nodes:
+                continue
+            vector = np.asarray(turn.query_embedding, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            if not norm:
+                continue
+            score = float(vector @ query_vector / (norm * query_norm))
+            if score >= best_score:
+                best, best_score = turn, score
+        return best
+
+    def history(self):
+        """
+        Format the most recent turns that fit in the history token budget.
+
+        Returns:
+            str: The conversation so far, oldest turn first
+        """
+        lines = []
+        used = 0
+        for turn in reversed(self.turns):
+            entry = f"User: {turn.question}\nAssistant: {turn.answer}"
+            cost = estimate_tokens(entry)
+            if used + cost > self.history_token_budget:
+                break
+            lines.append(entry)
+            used += cost
+        return "\n".join(reversed(lines))
+
+    def ask(self, question, filters=None):
+        """
+        Answer a question in the context of the conversation.
+
+        Args:
+            question (str): The question as asked
+            filters (QueryFilter): Optional metadata filter
+
+        Returns:
+            str: The answer
+        """
+        if not self.processor.index:
+            return "No documents have been indexed. Please add PDF files to the Document directory."
+        if self.processor.index_version != self.index_version:
+            logger.info("The index was replaced; starting a new conversation")
+            self.reset()
+        try:
+            follow_up = self.is_follow_up(question)
+            standalone = self.rewrite(question)
+            if standalone != question:
+                logger.info(f"Rewrote follow-up as: {standalone}")
+            filters_key = repr(filters) if filters is not None and not filters.is_empty() else None
+
+            # Questions about extracted tables are answered from their rows, without retrieval
+            if self.processor.tables is not None:
+                answer = self.processor.answer_from_tables(standalone, filters, history=self.history())
+                if answer is not None:
+                    self.turns.append(Turn(question, standalone, None, [], answer, filters_key))
+                    return answer
+
+            query_embedding = self.processor.embed_query(standalone)
+
+            cached = self._find_reusable(query_embedding, filters_key)
+            if cached is not None:
+                nodes = cached.nodes
+                self.reuses += 1
+                logger.info(f"Reusing chunks retrieved for: {cached.standalone_query}")
+            else:
+                nodes = self.processor.retrieve_for_answer(standalone, filters, query_embedding=query_embedding)
+                self.retrievals += 1
+            if not nodes:
+                return "No indexed content matches the given filters."
+
+            answer = self.processor.generate_answer(standalone, nodes, history=self.history(), follow_up=follow_up)
+            self.turns.append(Turn(question, standalone, query_embedding, nodes, answer, filters_key))
+            return answer
+        except Exception as e:
+            logger.error(f"Error querying documents: {str(e)}")
+            return f"Error processing your query: {str(e)}"
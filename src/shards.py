@@ -0,0 +1,287 @@
+"""
+Sharded collections for the PDF Document Processor
+--------------------------------------------------
+Serves several tenants' corpora from one deployment. Each shard is a
+directory under a common root with its own PDFs and its own persistent
+ChromaDB store:
+
+    <root>/<shard>/Document/*.pdf
+    <root>/<shard>/chroma/
+
+Shards are loaded lazily on first use, picking up PDFs added or changed
+since their index was built, and evicted least-recently-used when more
+than ``max_loaded`` are open or the estimated size of the open shards
+exceeds the memory limit. Queries are embedded once, scattered over several
+shards concurrently, and the best chunks from all of them are gathered.
+"""
+
+import os
+import re
+import gc
+import heapq
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+SHARD_PATTERN = re.compile(r"@shard:(\S+)", re.IGNORECASE)
+SHARD_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def parse_shard_selection(text):
+    """
+    Split ``@shard:name`` tokens out of console input.
+
+    Args:
+        text (str): The raw user input
+
+    Returns:
+        tuple: (remaining text, list of shard names)
+    """
+    shards = SHARD_PATTERN.findall(text)
+    remaining = " ".join(SHARD_PATTERN.sub("", text).split())
+    return remaining, shards
+
+
+class ShardManager:
+    """
+    Lazily loads per-shard PDFProcessor instances and queries them in parallel.
+    """
+
+    def __init__(self, root_dir, max_loaded=8, memory_limit_mb=None, max_workers=4,
+                 processor_factory=None):
+        """
+        Initialize the shard manager.
+
+        Args:
+            root_dir (str): Directory containing one subdirectory per shard
+            max_loaded (int): Maximum number of shards kept open at once
+            memory_limit_mb (float): Evict shards while their estimated total size is above this limit
+            max_workers (int): Number of threads used for scatter-gather queries
+            processor_factory (callable): Builds a processor from
+                (collection_name, document_dir, persist_dir); defaults to PDFProcessor
+        """
+        if processor_factory is None:
+            from main import PDFProcessor
+            processor_factory = PDFProcessor
+        self.root_dir = root_dir
+        self.max_loaded = max_loaded
+        self.memory_limit_mb = memory_limit_mb
+        self.processor_factory = processor_factory
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard")
+        self._loaded = OrderedDict()
+        self._sizes = {}
+        self._in_use = {}
+        self._shard_locks = {}
+        self._lock = threading.Lock()
+
+    def list_shards(self):
+        """Return the names of all shards under the root directory."""
+        if not os.path.isdir(self.root_dir):
+            return []
+        return sorted(
+            name for name in os.listdir(self.root_dir)
+            if SHARD_NAME_PATTERN.match(name) and os.path.isdir(os.path.join(self.root_dir, name))
+        )
+
+    def loaded_shards(self):
+        """Return the names of the currently open shards, least recently used first."""
+        with self._lock:
+            return list(self._loaded)
+
+    def _open(self, name):
+        """Create the processor for a shard and attach to or build its index."""
+        shard_dir = os.path.join(self.root_dir, name)
+        processor = self.processor_factory(
+            collection_name=f"pdf_documents_{name}",
+            document_dir=os.path.join(shard_dir, "Document"),
+            persist_dir=os.path.join(shard_dir, "chroma")
+        )
+        if processor.load_index():
+            # PDFs added to or edited in the shard since its index was built
+            processor.sync_documents()
+        elif not processor.load_documents():
+            processor.close()
+            raise ValueError(f"Shard '{name}' has no indexed documents")
+        logger.info(f"Opened shard '{name}'")
+        return processor
+
+    @staticmethod
+    def estimate_size_mb(processor):
+        """
+        Estimate the memory held by an open shard.
+
+        Args:
+            processor (PDFProcessor): The shard's processor
+
+        Returns:
+            float: Node store, metadata index and vector memory in MB
+        """
+        usage = processor.node_store.memory_usage()
+        index_usage = processor.metadata_index.memory_usage()
+        chunks = index_usage["chunks"]
+        index_bytes = index_usage["bytes_per_chunk"] * chunks
+        # Vectors are held by the HNSW index and by ChromaDB's record cache
+        vector_bytes = chunks * processor.embed_model.dimension * 4 * 2
+        return (usage["text_bytes"] + usage["array_bytes"] + usage["interned_bytes"]
+                + index_bytes + vector_bytes) / (1024 * 1024)
+
+    def acquire(self, name):
+        """
+        Get the processor for a shard, loading it if needed, and pin it.
+
+        Every call must be paired with ``release``; pinned shards are never evicted.
+
+        Args:
+            name (str): The shard name
+
+        Returns:
+            PDFProcessor: The shard's processor
+
+        Raises:
+            ValueError: If the shard does not exist or has no documents
+        """
+        if not SHARD_NAME_PATTERN.match(name) or not os.path.isdir(os.path.join(self.root_dir, name)):
+            raise ValueError(f"Unknown shard: {name}")
+
+        with self._lock:
+            shard_lock = self._shard_locks.setdefault(name, threading.Lock())
+
+        # Only one thread loads a given shard; others wait for it
+        with shard_lock:
+            with self._lock:
+                processor = self._loaded.get(name)
+                if processor is not None:
+                    self._loaded.move_to_end(name)
+                    self._in_use[name] = self._in_use.get(name, 0) + 1
+                    return processor
+            processor = self._open(name)
+            size = self.estimate_size_mb(processor)
+            with self._lock:
+                self._loaded[name] = processor
+                self._sizes[name] = size
+                self._in_use[name] = self._in_use.get(name, 0) + 1
+        self._evict()
+        return processor
+
+    def release(self, name):
+        """Unpin a shard previously returned by ``acquire``."""
+        with self._lock:
+            self._in_use[name] = max(self._in_use.get(name, 0) - 1, 0)
+        self._evict()
+
+    def _over_budget(self):
+        """Return True if more shards are open than the configured limits allow."""
+        if len(self._loaded) > self.max_loaded:
+            return True
+        return bool(self.memory_limit_mb) and sum(self._sizes.values()) > self.memory_limit_mb
+
+    def _evict(self):
+        """Close least recently used shards until the limits are respected."""
+        evicted = []
+        with self._lock:
+            while len(self._loaded) > 1 and self._over_budget():
+                victim = next((name for name in self._loaded if not self._in_use.get(name)), None)
+                if victim is None:
+                    break
+                evicted.append((victim, self._loaded.pop(victim), self._sizes.pop(victim, 0.0)))
+        # Closing happens outside the manager lock so queries on other shards
+        # continue; the shard's own lock keeps it from being reopened meanwhile
+        for name, processor, size in evicted:
+            with self._shard_locks[name]:
+                processor.close()
+            logger.info(f"Evicted shard '{name}' (about {size:.0f} MB)")
+        if evicted:
+            gc.collect()
+
+    def _embed_query(self, query, shards):
+        """Embed a query once with the first shard that opens; all shards share the embedding model."""
+        error = None
+        for name in shards:
+            try:
+                processor = self.acquire(name)
+            except ValueError as e:
+                error = e
+                continue
+            try:
+                return processor.embed_query(query)
+            finally:
+                self.release(name)
+        raise error or ValueError("No shards to search")
+
+    def _retrieve_shard(self, name, query, filters, top_k, query_embedding):
+        """Retrieve from one shard, tagging each result with the shard name."""
+        processor = self.acquire(name)
+        try:
+            nodes = processor.retrieve(query, filters, top_k, query_embedding=query_embedding)
+            for node in nodes:
+                node.node.metadata["shard"] = name
+            return nodes
+        finally:
+            self.release(name)
+
+    def retrieve(self, query, shards=None, filters=None, top_k=3):
+        """
+        Retrieve the best chunks across several shards concurrently.
+
+        Args:
+            query (str): The question
+            shards (list): Shards to search (all shards if not given)
+            filters (QueryFilter): Optional metadata filter applied in every shard
+            top_k (int): Number of chunks to return overall
+
+        Returns:
+            list: NodeWithScore results merged across shards, best first
+        """
+        shards = shards or self.list_shards()
+        query_embedding = self._embed_query(query, shards)
+        futures = {
+            name: self.executor.submit(self._retrieve_shard, name, query, filters, top_k, query_embedding)
+            for name in shards
+        }
+        results = []
+        for name, future in futures.items():
+            try:
+                results.extend(future.result())
+            except Exception as e:
+                logger.error(f"Error querying shard '{name}': {e}")
+        return heapq.nlargest(top_k, results, key=lambda node: node.score or 0.0)
+
+    def query_documents(self, query, shards=None, filters=None):
+        """
+        Answer a question from the best chunks across several shards.
+
+        Args:
+            query (str): The question
+            shards (list): Shards to search (all shards if not given)
+            filters (QueryFilter): Optional metadata filter applied in every shard
+
+        Returns:
+            str: The answer
+        """
+        shards = shards or self.list_shards()
+        if not shards:
+            return "No shards are available. Please add shard directories with PDF files."
+        try:
+            nodes = self.retrieve(query, shards, filters)
+            if not nodes:
+                return "No indexed content matches the given shards and filters."
+            name = nodes[0].node.metadata["shard"]
+            processor = self.acquire(name)
+            try:
+                return processor.generate_answer(query, nodes)
+            finally:
+                self.release(name)
+        except Exception as e:
+            logger.error(f"Error querying shards: {str(e)}")
+            return f"Error processing your query: {str(e)}"
+
+    def close(self):
+        """Close all open shards and stop the worker threads."""
+        self.executor.shutdown(wait=True)
+        with self._lock:
+            while self._loaded:
+                _, processor = self._loaded.popitem(last=False)
+                processor.close()
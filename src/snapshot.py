@@ -0,0 +1,207 @@
+"""
+Index snapshots for the PDF Document Processor
+----------------------------------------------
+A snapshot bundles everything needed to serve queries from a built index
+into one versioned file, so a new process can skip parsing and embedding.
+
+File layout:
+
+    offset 0   preamble (32 bytes): magic, format version, header offset, header length
+    offset 64  vectors: count x dimension float32, little-endian, row-major
+    ...        records: one JSON line per chunk with its ID, text and metadata
+    ...        header: JSON with the embedding model ID, dimension, counts,
+               section offsets, checksum, the ingestion manifest and the
+               extracted tables
+
+The vector block starts at a fixed, aligned offset so it can be memory-mapped
+directly with numpy. Importing reads the mapped vectors in batches into
+ChromaDB, which indexes its own copy; queries do not use the mapping.
+"""
+
+import os
+import json
+import struct
+import hashlib
+import logging
+import tempfile
+from datetime import datetime
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PDFSNAP\0"
+FORMAT_VERSION = 1
+PREAMBLE = struct.Struct("<8sIIQQ")
+VECTORS_OFFSET = 64
+
+
+class SnapshotError(ValueError):
+    """Raised when a snapshot is invalid or incompatible with the processor."""
+
+
+def export_snapshot(path, collection, embedding_model, dimension, manifest=None, batch_size=1000, tables=None):
+    """
+    Write the contents of a ChromaDB collection to a snapshot file.
+
+    Args:
+        path (str): Where to write the snapshot
+        collection: The ChromaDB collection to export
+        embedding_model (str): ID of the model that produced the vectors
+        dimension (int): The embedding dimension
+        manifest (dict): The ingestion manifest to include
+        batch_size (int): Number of records fetched per request
+        tables (list): Extracted tables as dicts, restored on import
+
+    Returns:
+        dict: The snapshot header
+    """
+    count = collection.count()
+    checksum = hashlib.sha256()
+    tmp_path = f"{path}.tmp"
+    written = 0
+    with open(tmp_path, "wb") as f, tempfile.TemporaryFile() as records:
+        f.write(b"\0" * VECTORS_OFFSET)
+        for offset in range(0, count, batch_size):
+            batch = collection.get(
+                include=["embeddings", "documents", "metadatas"],
+                limit=batch_size,
+                offset=offset
+            )
+            vectors = np.asarray(batch["embeddings"], dtype="<f4")
+            if vectors.ndim != 2 or vectors.shape[1] != dimension:
+                raise SnapshotError(f"Stored vectors do not have dimension {dimension}")
+            data = vectors.tobytes()
+            f.write(data)
+            checksum.update(data)
+            for node_id, text, metadata in zip(batch["ids"], batch["documents"], batch["metadatas"]):
+                line = (json.dumps({"id": node_id, "text": text, "metadata": metadata}) + "\n").encode("utf-8")
+                records.write(line)
+            written += len(batch["ids"])
+
+        records_offset = f.tell()
+        records.seek(0)
+        while True:
+            data = records.read(1024 * 1024)
+            if not data:
+                break
+            f.write(data)
+            checksum.update(data)
+        header_offset = f.tell()
+
+        header = {
+            "format_version": FORMAT_VERSION,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "embedding_model": embedding_model,
+            "dimension": dimension,
+            "count": written,
+            "dtype": "float32",
+            "vectors_offset": VECTORS_OFFSET,
+            "records_offset": records_offset,
+            "records_length": header_offset - records_offset,
+            "sha256": checksum.hexdigest(),
+            "manifest": manifest or {},
+            "tables": tables or [],
+        }
+        header_bytes = json.dumps(header).encode("utf-8")
+        f.write(header_bytes)
+        f.seek(0)
+        f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, 0, header_offset, len(header_bytes)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    logger.info(f"Exported snapshot of {written} chunks to {path}")
+    return header
+
+
+class Snapshot:
+    """A snapshot file opened for reading."""
+
+    def __init__(self, path):
+        """
+        Open a snapshot and read its header.
+
+        Args:
+            path (str): The snapshot file
+
+        Raises:
+            SnapshotError: If the file is not a readable snapshot of a supported version
+        """
+        self.path = path
+        try:
+            with open(path, "rb") as f:
+                magic, version, _, header_offset, header_length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+                if magic != MAGIC:
+                    raise SnapshotError(f"{path} is not an index snapshot")
+                if version != FORMAT_VERSION:
+                    raise SnapshotError(f"Unsupported snapshot format version {version} (expected {FORMAT_VERSION})")
+                f.seek(header_offset)
+                self.header = json.loads(f.read(header_length).decode("utf-8"))
+        except (OSError, struct.error, ValueError) as e:
+            if isinstance(e, SnapshotError):
+                raise
+            raise SnapshotError(f"Could not read snapshot {path}: {e}")
+
+    def check_compatible(self, embedding_model, dimension):
+        """
+        Refuse snapshots built with a different embedding model or dimension.
+
+        Raises:
+            SnapshotError: If the snapshot does not match
+        """
+        if self.header["embedding_model"] != embedding_model:
+            raise SnapshotError(
+                f"Snapshot was built with embedding model '{self.header['embedding_model']}', "
+                f"but the processor uses '{embedding_model}'"
+            )
+        if self.header["dimension"] != dimension:
+            raise SnapshotError(
+                f"Snapshot has {self.header['dimension']}-dimensional vectors, "
+                f"but the processor uses {dimension} dimensions"
+            )
+
+    def verify(self):
+        """
+        Check the vectors and records against the stored checksum.
+
+        Raises:
+            SnapshotError: If the data is corrupted
+        """
+        checksum = hashlib.sha256()
+        end = self.header["records_offset"] + self.header["records_length"]
+        with open(self.path, "rb") as f:
+            f.seek(self.header["vectors_offset"])
+            remaining = end - self.header["vectors_offset"]
+            while remaining > 0:
+                data = f.read(min(remaining, 1024 * 1024))
+                if not data:
+                    break
+                checksum.update(data)
+                remaining -= len(data)
+        if checksum.hexdigest() != self.header["sha256"]:
+            raise SnapshotError(f"Snapshot {self.path} is corrupted (checksum mismatch)")
+
+    def vectors(self):
+        """Return the vectors as a read-only memory-mapped (count, dimension) array."""
+        if self.header["count"] == 0:
+            return np.zeros((0, self.header["dimension"]), dtype="<f4")
+        return np.memmap(
+            self.path,
+            dtype="<f4",
+            mode="r",
+            offset=self.header["vectors_offset"],
+            shape=(self.header["count"], self.header["dimension"])
+        )
+
+    def records(self):
+        """Yield (id, text, metadata) for every chunk, in vector order."""
+        with open(self.path, "rb") as f:
+            f.seek(self.header["records_offset"])
+            remaining = self.header["records_length"]
+            while remaining > 0:
+                line = f.readline()
+                if not line:
+                    break
+                remaining -= len(line)
+                record = json.loads(line)
+                yield record["id"], record["text"], record["metadata"]
@@ -0,0 +1,515 @@
+"""
+Table extraction for the PDF Document Processor
+-----------------------------------------------
+PDF tables come out of the PDF reader as flattened text, which the sentence
+splitter then cuts apart. This module finds tables in the page text during
+ingestion and keeps them in a columnar side store:
+
+    detection  runs of lines with the same cell layout, either cells separated
+               by tabs, pipes or runs of spaces, or a label followed by the same
+               number of numeric cells; with pdfplumber installed, its table
+               finder is used on the PDF instead
+    storage    one list of cell texts per column, plus a float array for every
+               mostly numeric column, so aggregates are single numpy calls
+    querying   questions naming a numeric column and the table itself (by its
+               caption, its label column or row labels), with rows or an
+               aggregate such as total or highest, are answered from the
+               table, and only the matching rows reach the prompt; weaker
+               matches are left to retrieval
+"""
+
+import os
+import re
+import json
+import logging
+import threading
+
+import numpy as np
+
+from utils import content_words, tokenize
+
+logger = logging.getLogger(__name__)
+
+CELL_DELIMITER = re.compile(r"\s*\|\s*|\t+|\s{2,}")
+NUMBER_PATTERN = re.compile(r"^\(?[-+]?[$€£]?\d[\d,]*(\.\d+)?%?\)?$")
+
+# Question words that ask for an aggregate over a column. Words common in
+# ordinary questions ("most", "top", "best", "overall") are left out.
+OPERATION_WORDS = {
+    "sum": {"total", "sum", "combined", "altogether"},
+    "mean": {"average", "mean", "avg"},
+    "max": {"highest", "largest", "maximum", "max", "biggest", "greatest"},
+    "min": {"lowest", "smallest", "minimum", "min", "least", "fewest", "worst"},
+    "count": {"count"},
+}
+OPERATION_NAMES = {"sum": "total", "mean": "average", "max": "highest", "min": "lowest"}
+
+# Question words that pick the operation rather than name part of a table
+OPERATION_TERMS = set().union(*OPERATION_WORDS.values(), {"many"})
+
+# Row labels of summary rows, left out of aggregates over a column
+TOTAL_LABELS = {"total", "totals", "sum", "overall", "grand total"}
+
+
+def parse_number(text):
+    """
+    Parse a table cell as a number.
+
+    Thousands separators, currency symbols and percent signs are dropped, and
+    parentheses mark negative values as in financial tables.
+
+    Args:
+        text (str): The cell text
+
+    Returns:
+        float: The value, or NaN if the cell is not a number
+    """
+    text = text.strip()
+    if not NUMBER_PATTERN.match(text):
+        return float("nan")
+    negative = text.startswith("(") and text.endswith(")")
+    value = float(text.strip("()").lstrip("$€£").replace("$", "").replace(",", "").rstrip("%"))
+    return -value if negative else value
+
+
+def format_number(value):
+    """Format a number for an answer, without decimals when it is whole."""
+    if float(value).is_integer():
+        return f"{value:,.0f}"
+    return f"{round(value, 4):,}"
+
+
+def _terms(text):
+    """Content words of a text with a plural s removed, for matching names against questions."""
+    return {word[:-1] if len(word) > 3 and word.endswith("s") else word for word in content_words(text)}
+
+
+class Table:
+    """A table held column by column."""
+
+    def __init__(self, columns, rows, metadata, title=None):
+        """
+        Build a table from its header and rows.
+
+        Args:
+            columns (list): Column names; empty or repeated names are made unique
+            rows (list): Rows as lists of cell texts, padded or cut to the header width
+            metadata (dict): Metadata of the page the table is on (file name, page and
+                the filter fields)
+            title (str): Line preceding the table, if it looks like a caption
+        """
+        names = []
+        for i, name in enumerate(columns):
+            name = " ".join(str(name or "").split()) or f"Column {i + 1}"
+            while name in names:
+                name += f" {i + 1}"
+            names.append(name)
+        self.columns = names
+        self.metadata = metadata
+        self.title = title
+        width = len(names)
+        rows = [(list(row) + [""] * width)[:width] for row in rows]
+        self.cells = {name: [str(row[i] or "").strip() for row in rows] for i, name in enumerate(names)}
+        self.numbers = {}
+        for name, values in self.cells.items():
+            parsed = np.array([parse_number(value) for value in values], dtype=np.float64)
+            if np.count_nonzero(~np.isnan(parsed)) * 2 >= len(values):
+                self.numbers[name] = parsed
+        text_columns = [name for name in names if name not in self.numbers]
+        self.label_column = text_columns[0] if text_columns else names[0]
+
+    def __len__(self):
+        return len(self.cells[self.columns[0]])
+
+    def source(self):
+        """Return the file and page the table is on, for citations."""
+        source = self.metadata.get("file_name", "the document")
+        if self.metadata.get("page_label"):
+            source += f", page {self.metadata['page_label']}"
+        return source
+
+    def format_rows(self, rows):
+        """
+        Format the header and some rows as pipe-separated lines.
+
+        Args:
+            rows (list): Row positions to include, in order
+
+        Returns:
+            str: The header followed by the rows
+        """
+        lines = [" | ".join(self.columns)]
+        lines.extend(" | ".join(self.cells[name][row] for name in self.columns) for row in rows)
+        return "\n".join(lines)
+
+    def to_dict(self):
+        """Return the table as a JSON-serializable dict."""
+        return {
+            "columns": self.columns,
+            "cells": [self.cells[name] for name in self.columns],
+            "metadata": self.metadata,
+            "title": self.title,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a table saved with ``to_dict``."""
+        rows = [list(row) for row in zip(*data["cells"])]
+        return cls(data["columns"], rows, data["metadata"], data.get("title"))
+
+
+class TableMatch:
+    """The part of a table that answers a question."""
+
+    def __init__(self, table, rows, columns, operation=None, value=None, aggregated_rows=0):
+        self.table = table
+        self.rows = rows
+        self.columns = columns
+        self.operation = operation
+        self.value = value
+        self.aggregated_rows = aggregated_rows
+
+    def summary(self):
+        """Describe the match in one line, for logging."""
+        parts = [f"table on {self.table.source()}", f"columns {self.columns}", f"{len(self.rows)} rows"]
+        if self.operation:
+            parts.append(f"{self.operation} = {self.value}")
+        return ", ".join(parts)
+
+    def context(self, max_rows=20):
+        """
+        Format the matching rows and any computed value for the prompt.
+
+        Args:
+            max_rows (int): Most rows included; aggregates over larger tables are
+                passed as the computed value only
+
+        Returns:
+            str: The prompt context
+        """
+        title = f" ({self.table.title})" if self.table.title else ""
+        lines = [f"Table on {self.table.source()}{title}:"]
+        if self.rows and len(self.rows) <= max_rows:
+            lines.append(self.table.format_rows(self.rows))
+        if self.operation == "count":
+            lines.append(f"Computed from the table: number of rows = {self.value}")
+        elif self.operation:
+            lines.append(f"Computed from the table: {OPERATION_NAMES[self.operation]} "
+                         f"{', '.join(self.columns)} of {self.aggregated_rows} rows = "
+                         f"{format_number(self.value)}")
+        return "\n".join(lines)
+
+
+def _split_cells(line):
+    """Split a line on tabs, pipes or runs of spaces; None if it has fewer than two cells."""
+    cells = [cell for cell in CELL_DELIMITER.split(line.strip().strip("|")) if cell]
+    return cells if len(cells) >= 2 else None
+
+
+def _numeric_row(line, max_label_words=6):
+    """Split a line into a label and its trailing numeric cells; None if it does not end in numbers."""
+    tokens = line.split()
+    count = 0
+    while count < len(tokens) and NUMBER_PATTERN.match(tokens[-1 - count]):
+        count += 1
+    if count == len(tokens) and count >= 2:
+        # A numeric label such as a year
+        count -= 1
+    if count == 0 or count == len(tokens) or len(tokens) - count > max_label_words:
+        return None
+    return [" ".join(tokens[:-count])] + tokens[-count:]
+
+
+def _header_cells(line):
+    """Split a header line into cells, keeping units such as "ms" or "(USD)" with their column name."""
+    cells = _split_cells(line)
+    if cells is not None:
+        return cells
+    cells = []
+    for token in line.split():
+        is_unit = token.startswith("(") or token == "%" or (token.islower() and len(token) <= 3)
+        if cells and is_unit:
+            cells[-1] += f" {token}"
+        else:
+            cells.append(token)
+    return cells
+
+
+def _caption(lines, index):
+    """Return the line at ``index`` if it reads like a table caption."""
+    if index < 0:
+        return None
+    line = lines[index]
+    if len(line.split()) <= 10 and not line.endswith((".", "!", "?")):
+        return line.rstrip(":")
+    return None
+
+
+def detect_tables(text, metadata, min_rows=2):
+    """
+    Find tables in the text of a page.
+
+    Args:
+        text (str): The page text
+        metadata (dict): Metadata to attach to the tables found
+        min_rows (int): Fewest data rows a table needs
+
+    Returns:
+        list: The Tables found, in page order
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    layouts = []
+    for line in lines:
+        cells = _split_cells(line)
+        if cells is not None:
+            layouts.append(("delimited", len(cells), cells))
+            continue
+        cells = _numeric_row(line)
+        layouts.append(("numeric", len(cells), cells) if cells is not None else None)
+
+    tables = []
+    i = 0
+    while i < len(lines):
+        if layouts[i] is None:
+            i += 1
+            continue
+        kind, width, _ = layouts[i]
+        end = i + 1
+        while end < len(lines) and layouts[end] is not None and layouts[end][:2] == (kind, width):
+            end += 1
+        run = [layout[2] for layout in layouts[i:end]]
+
+        header_at = None
+        if kind == "delimited" and len(run) > min_rows:
+            header_at, header, rows = i, run[0], run[1:]
+        elif kind == "numeric" and len(run) >= min_rows and (width > 2 or len(run) > min_rows) and i > 0:
+            # The header is the line above the numeric rows
+            tokens = _header_cells(lines[i - 1])
+            if len(tokens) == width:
+                header = tokens
+            elif len(tokens) == width - 1:
+                header = [""] + tokens
+            elif len(tokens) > width and len(tokens) - width < 6:
+                header = [" ".join(tokens[:len(tokens) - width + 1])] + tokens[len(tokens) - width + 1:]
+            else:
+                header = None
+            if header is not None:
+                header_at, rows = i - 1, run
+        if header_at is not None:
+            tables.append(Table(header, rows, metadata, _caption(lines, header_at - 1)))
+        i = end
+    return tables
+
+
+def extract_pdf_tables(path, documents):
+    """
+    Find the tables of a PDF with pdfplumber, if it is installed.
+
+    Args:
+        path (str): Path of the PDF
+        documents (list): The loaded pages, in page order, whose metadata is attached
+
+    Returns:
+        list: The Tables found, or None if pdfplumber is not available
+    """
+    try:
+        import pdfplumber
+    except ImportError:
+        return None
+    tables = []
+    with pdfplumber.open(path) as pdf:
+        for page, document in zip(pdf.pages, documents):
+            for cells in page.extract_tables():
+                rows = [row for row in cells if row and any(cell for cell in row)]
+                if len(rows) > 2:
+                    tables.append(Table(rows[0], rows[1:], document.metadata))
+    return tables
+
+
+class TableStore:
+    """Tables extracted during ingestion, answering questions about their columns."""
+
+    def __init__(self, max_prompt_rows=20, min_score=0.5):
+        """
+        Initialize an empty store.
+
+        Args:
+            max_prompt_rows (int): Most table rows passed to the prompt for one question
+            min_score (float): Share of the question's content words a table has to
+                account for; questions matching less are answered by retrieval
+        """
+        self.max_prompt_rows = max_prompt_rows
+        self.min_score = min_score
+        self.tables = []
+        self.matched = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.tables)
+
+    def clear(self):
+        """Remove all tables."""
+        with self._lock:
+            self.tables = []
+
+    def remove_files(self, file_names):
+        """Remove the tables of the given files."""
+        file_names = set(file_names)
+        with self._lock:
+            self.tables = [table for table in self.tables if table.metadata.get("file_name") not in file_names]
+
+    def extract(self, documents, path=None):
+        """
+        Find and store the tables of one file's pages.
+
+        Args:
+            documents (list): The loaded pages of the file
+            path (str): Path of the file, for pdfplumber
+
+        Returns:
+            int: Number of tables found
+        """
+        tables = None
+        if path and path.lower().endswith(".pdf"):
+            try:
+                tables = extract_pdf_tables(path, documents)
+            except Exception as e:
+                logger.warning(f"pdfplumber could not read tables from {path}: {e}")
+        if tables is None:
+            tables = []
+            for document in documents:
+                tables.extend(detect_tables(document.get_content(), document.metadata))
+        with self._lock:
+            self.tables.extend(tables)
+        return len(tables)
+
+    def to_list(self):
+        """Return the tables as JSON-serializable dicts."""
+        with self._lock:
+            return [table.to_dict() for table in self.tables]
+
+    def from_list(self, data):
+        """Replace the tables with dicts returned by ``to_list``."""
+        tables = [Table.from_dict(table) for table in data]
+        with self._lock:
+            self.tables = tables
+
+    def save(self, path):
+        """Write the tables to a JSON file, replacing it atomically."""
+        data = self.to_list()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"tables": data}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """Replace the tables with those saved in a JSON file."""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.from_list(data["tables"])
+
+    def _match_table(self, table, terms, operation):
+        """Return (score, TableMatch) for one table, or None if it does not answer the question."""
+        overlaps = {name: len(_terms(name) & terms) for name in table.numbers}
+        best = max(overlaps.values(), default=0)
+        columns = [name for name, overlap in overlaps.items() if overlap == best] if best else []
+
+        rows = []
+        row_terms = set()
+        for row in range(len(table)):
+            # A total row named by "total" is recomputed from the other rows instead
+            if operation and table.cells[table.label_column][row].lower() in TOTAL_LABELS:
+                continue
+            for name in table.columns:
+                if name in table.numbers:
+                    continue
+                label = _terms(table.cells[name][row])
+                if label and label <= terms:
+                    rows.append(row)
+                    row_terms |= label
+                    break
+
+        # Besides a column, the question has to name the table: its caption, its
+        # label column or some of its rows, with words other than the column's
+        column_terms = set().union(*(_terms(name) for name in columns)) & terms
+        named = (_terms(table.title or "") | _terms(table.label_column) | row_terms) & terms
+        if operation == "count":
+            # The question has to name what is counted, by the label column or the caption
+            if not (_terms(table.label_column) | _terms(table.title or "")) & terms:
+                return None
+        else:
+            named -= column_terms
+            if not columns or not named or not (operation or rows):
+                return None
+        # Weak matches, where most of the question is about something else, go to retrieval
+        if len(column_terms | named) < self.min_score * len(terms):
+            return None
+        score = 2 * best * len(columns) + 2 * len(rows) + len(named)
+        if operation is None:
+            return score, TableMatch(table, rows, columns)
+
+        # Aggregates run over the named rows, or over every row except totals
+        selected = rows or [
+            row for row in range(len(table))
+            if table.cells[table.label_column][row].lower() not in TOTAL_LABELS
+        ]
+        if operation == "count":
+            return score, TableMatch(table, selected, [table.label_column], "count", len(selected), len(selected))
+        # Of columns the question matches equally, the first in table order is
+        # computed, and only that one is reported
+        values = table.numbers[columns[0]][selected]
+        valid = ~np.isnan(values)
+        if not valid.any():
+            return None
+        if operation in ("max", "min"):
+            position = int(np.nanargmax(values) if operation == "max" else np.nanargmin(values))
+            return score, TableMatch(table, [selected[position]], columns[:1], operation, float(values[position]),
+                                     int(valid.sum()))
+        value = float(np.nansum(values) if operation == "sum" else np.nanmean(values))
+        return score, TableMatch(table, selected, columns[:1], operation, value, int(valid.sum()))
+
+    def match(self, query, filters=None):
+        """
+        Find the table rows that answer a question.
+
+        A table matches when the question names one of its numeric columns and
+        the table (by its caption, label column or row labels), and either names
+        rows or asks for an aggregate (total, average, highest, lowest), or when
+        it asks how many rows a named table has. The column and the names have
+        to account for at least ``min_score`` of the question's content words.
+
+        Args:
+            query (str): The question
+            filters (QueryFilter): Optional metadata filter on the table's page
+
+        Returns:
+            TableMatch: The best match, or None if no table answers the question
+        """
+        tokens = tokenize(query)
+        terms = _terms(query) - OPERATION_TERMS
+        if not terms:
+            return None
+        operation = next((name for name, words in OPERATION_WORDS.items() if words & set(tokens)), None)
+        operations = [operation]
+        if operation is None and "how many" in " ".join(tokens):
+            # "How many" asks for a value in a named column ("how many units") or for a count
+            operations = [None, "count"]
+        with self._lock:
+            tables = list(self.tables)
+        best = None
+        for table in tables:
+            if filters is not None and not filters.is_empty() and not filters.matches(table.metadata):
+                continue
+            for candidate in operations:
+                found = self._match_table(table, terms, candidate)
+                if found is not None:
+                    break
+            if found is not None and (best is None or found[0] > best[0]):
+                best = found
+        if best is None:
+            return None
+        with self._lock:
+            self.matched += 1
+        return best[1]
@@ -3,6 +3,7 @@ Utility functions for the PDF Document Processor
 """
 
 import os
+import re
 import sys
 import logging
 from dotenv import load_dotenv
@@ -26,8 +27,9 @@ def check_environment():
         load_dotenv(env_file)
         logger.info("Loaded environment variables from .env file")
     
-    # Check if GOOGLE_API_KEY is set
-    if not os.getenv("GOOGLE_API_KEY"):
+    # Check if GOOGLE_API_KEY is set (not needed when only local backends are used)
+    backends = (os.getenv("EMBEDDING_BACKEND", "gemini"), os.getenv("GENERATION_BACKEND", "gemini"))
+    if "gemini" in backends and not os.getenv("GOOGLE_API_KEY"):
         display_message("GOOGLE_API_KEY environment variable not set", "error")
         display_message("Please set the GOOGLE_API_KEY environment variable.", "info")
         display_message("You can create a .env file with your API key or run:", "info")
@@ -36,6 +38,63 @@ def check_environment():
     
     return True
 
+# Common English words ignored when comparing questions and text
+STOPWORDS = frozenset("""
+a about above after again all also am an and any are as at be because been before being below between both
+but by can could did do does doing down during each few for from further had has have having he her here hers
+him his how i if in into is it its itself just me more most my no nor not of off on once only or other our ours
+out over own please same she should so some such than that the their theirs them then there these they this
+those through to too under until up very was we were what when where which while who whom why will with would
+you your yours tell explain describe give show
+""".split())
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+def tokenize(text):
+    """
+    Split text into lowercase word tokens.
+
+    Args:
+        text (str): The text to split
+
+    Returns:
+        list: The tokens
+    """
+    return WORD_PATTERN.findall(text.lower())
+
+def content_words(text):
+    """
+    Get the tokens of a text that are not stopwords.
+
+    Args:
+        text (str): The text to split
+
+    Returns:
+        list: The content words, in order
+    """
+    return [token for token in tokenize(text) if token not in STOPWORDS]
+
+def estimate_tokens(text):
+    """Roughly estimate the number of model tokens in a text (about four characters per token)."""
+    return len(text) // 4 + 1
+
+def get_rss_mb():
+    """
+    Get the resident set size of the current process.
+
+    Returns:
+        float: The RSS in megabytes, or the peak RSS where the current value is unavailable
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
 def display_header():
     """Display the application header."""
     header = """
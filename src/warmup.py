@@ -0,0 +1,246 @@
+"""
+Query embedding warm-up for the PDF Document Processor
+------------------------------------------------------
+Common questions should not pay for a query embedding round trip. At startup
+a list of frequent queries is embedded in one batch and kept in memory,
+keyed by a normalized form of the query: case, whitespace, quotes and
+sentence punctuation are ignored, while symbols that belong to a token are
+kept, so "C++" and "C" or "3.5" and "35" stay distinct. A background tracker
+counts the queries that are asked, periodically saves the most popular ones
+to the warm-up file for the next start, and embeds newly popular queries
+ahead of time.
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+from collections import Counter, OrderedDict
+
+from scheduler import BULK, priority
+
+logger = logging.getLogger(__name__)
+
+# Stripped from the end of each token; inside a token ("3.5") they are kept
+SENTENCE_PUNCTUATION = "?.!,;:"
+QUOTES = "\"'`\u201c\u201d\u2018\u2019"
+
+
+def normalize_query(query):
+    """
+    Normalize a query for cache lookups.
+
+    Args:
+        query (str): The query
+
+    Returns:
+        str: The query in lowercase with single spaces, without quotes around
+            tokens and without sentence punctuation at the end of tokens
+    """
+    tokens = []
+    for token in query.lower().split():
+        token = token.strip(QUOTES).rstrip(SENTENCE_PUNCTUATION).strip(QUOTES)
+        if token:
+            tokens.append(token)
+    return " ".join(tokens)
+
+
+def load_queries(path):
+    """
+    Read a warm-up file.
+
+    Each line is either a query or a count and a query separated by a tab,
+    as written by PopularityTracker. Blank lines and lines starting with #
+    are ignored.
+
+    Args:
+        path (str): The file to read
+
+    Returns:
+        Counter: Query counts (1 for lines without a count)
+    """
+    counts = Counter()
+    if not os.path.exists(path):
+        return counts
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            count, sep, query = line.partition("\t")
+            if sep and count.isdigit():
+                counts[query] += int(count)
+            else:
+                counts[line] += 1
+    return counts
+
+
+class QueryEmbeddingCache:
+    """Thread-safe LRU cache of query embeddings keyed by normalized query."""
+
+    def __init__(self, max_entries=10000):
+        """Initialize an empty cache holding at most ``max_entries`` embeddings."""
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, query):
+        with self._lock:
+            return normalize_query(query) in self._entries
+
+    def get(self, query):
+        """Return the cached embedding for a query, or None."""
+        key = normalize_query(query)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, query, embedding):
+        """Cache the embedding of a query."""
+        key = normalize_query(query)
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def warm(self, queries, embed_queries):
+        """
+        Embed queries that are not cached yet in one batch.
+
+        Args:
+            queries (iterable): The queries to warm
+            embed_queries (callable): Embeds a list of queries and returns their embeddings
+
+        Returns:
+            int: Number of queries embedded
+        """
+        missing = list(OrderedDict(
+            (normalize_query(query), query) for query in queries if query not in self
+        ).values())
+        if not missing:
+            return 0
+        embeddings = embed_queries(missing)
+        for query, embedding in zip(missing, embeddings):
+            self.put(query, embedding)
+        return len(missing)
+
+
+class PopularityTracker:
+    """
+    Counts asked queries on a background thread.
+
+    Every ``flush_interval`` seconds the most popular queries are written to
+    the warm-up file and any of them not yet cached are embedded.
+    """
+
+    def __init__(self, path, cache, embed_queries, top_n=200, flush_interval=60.0, initial_counts=None):
+        """
+        Start the tracker thread.
+
+        Args:
+            path (str): Warm-up file the popular queries are saved to
+            cache (QueryEmbeddingCache): Cache to warm with popular queries
+            embed_queries (callable): Embeds a list of queries
+            top_n (int): Number of popular queries kept in the file and cache
+            flush_interval (float): Seconds between saves
+            initial_counts (Counter): Counts loaded from an earlier run
+        """
+        self.path = path
+        self.cache = cache
+        self.embed_queries = embed_queries
+        self.top_n = top_n
+        self.flush_interval = flush_interval
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        # Counts are kept per normalized query; the first spelling seen is saved
+        self._spellings = {}
+        for query, count in (initial_counts or {}).items():
+            self._count(query, count)
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._dirty = False
+        self._thread = threading.Thread(target=self._run, name="query-popularity", daemon=True)
+        self._thread.start()
+
+    def _count(self, query, count=1):
+        key = normalize_query(query)
+        if not key:
+            return
+        with self._lock:
+            self._spellings.setdefault(key, query.strip())
+            self.counts[key] += count
+
+    def record(self, query):
+        """Record an asked query; returns immediately."""
+        self._queue.put(query)
+
+    def top(self, n=None):
+        """Return the most popular queries with their counts."""
+        with self._lock:
+            return [(self._spellings[key], count) for key, count in self.counts.most_common(n or self.top_n)]
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while not self._stopped.is_set():
+            timeout = max(self.flush_interval - (time.monotonic() - last_flush), 0.01)
+            try:
+                query = self._queue.get(timeout=timeout)
+                if query is not None:
+                    self._count(query)
+                    self._dirty = True
+            except queue.Empty:
+                pass
+            if self._dirty and time.monotonic() - last_flush >= self.flush_interval:
+                self.flush()
+                last_flush = time.monotonic()
+
+    def flush(self):
+        """Save the popular queries and warm the cache with them."""
+        top = self.top()
+        self._dirty = False
+        try:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write("# Most frequent queries, written by the PDF Document Processor\n")
+                for query, count in top:
+                    f.write(f"{count}\t{query}\n")
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save popular queries to {self.path}: {e}")
+        try:
+            # Pre-embedding is background work and must not delay live queries
+            with priority(BULK):
+                warmed = self.cache.warm([query for query, _ in top], self.embed_queries)
+            if warmed:
+                logger.info(f"Pre-embedded {warmed} popular queries")
+        except Exception as e:
+            logger.warning(f"Could not pre-embed popular queries: {e}")
+
+    def stop(self):
+        """Stop the tracker, counting and saving any pending queries."""
+        self._stopped.set()
+        # Wake the thread so it notices the stop, then count what is left
+        self._queue.put(None)
+        self._thread.join()
+        while True:
+            try:
+                query = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if query is not None:
+                self._count(query)
+                self._dirty = True
+        if self._dirty:
+            self.flush()
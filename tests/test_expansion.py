@@ -0,0 +1,134 @@
+import threading
+
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from expansion import QueryExpander, reciprocal_rank_fusion
+
+
+def result(node_id, score):
+    return NodeWithScore(node=TextNode(id_=node_id, text=node_id), score=score)
+
+
+def test_rrf_ranks_chunks_found_by_several_lists_first():
+    fused = reciprocal_rank_fusion([
+        [result("a", 0.9), result("b", 0.5)],
+        [result("b", 0.6), result("c", 0.4)],
+    ], top_k=3)
+    assert [node.node.node_id for node in fused] == ["b", "a", "c"]
+    # The best similarity score of a chunk is kept
+    assert fused[0].score == 0.6
+
+
+class FakeEmbedModel:
+    def __init__(self):
+        self.calls = []
+
+    def get_query_embedding(self, text):
+        self.calls.append(text)
+        return [0.0]
+
+
+class FakeGenerator:
+    def __init__(self):
+        self.prompts = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def generate(self, prompt):
+        self.prompts.append(prompt)
+        self.release.wait(5)
+        return "A draft passage"
+
+
+class FakeProcessor:
+    similarity_top_k = 3
+
+    def __init__(self, scores):
+        self.scores = scores
+        self.embed_model = FakeEmbedModel()
+        self.generator = FakeGenerator()
+
+    def retrieve(self, query, filters=None, top_k=None, query_embedding=None):
+        if query_embedding is None:
+            return [result("original", self.scores.get("original", 0.0))]
+        return [result(query, self.scores.get(query, self.scores.get("variant", 0.0)))]
+
+
+def expander(scores, use_hyde=True):
+    processor = FakeProcessor(scores)
+    return processor, QueryExpander(processor, synonyms={"ml": ["machine learning"]},
+                                    use_hyde=use_hyde, early_answer_score=0.7)
+
+
+QUESTION = "What are the uses of ML?"
+
+
+def test_hyde_is_used_when_variants_score_low():
+    processor, low = expander({"original": 0.2, "variant": 0.3})
+    low.retrieve(QUESTION)
+    low.close()
+    assert len(processor.generator.prompts) == 1
+    assert "A draft passage" in processor.embed_model.calls
+    assert low.hyde_drafts == 1
+
+
+def test_hyde_starts_with_the_variants():
+    processor, slow = expander({"original": 0.2, "variant": 0.3})
+    started = threading.Event()
+    overlapped = []
+    retrieve = processor.retrieve
+
+    def retrieve_original_after_draft_started(query, *args, **kwargs):
+        # The original retrieval only returns once the draft is being generated
+        overlapped.append(started.wait(5))
+        return retrieve(query, *args, **kwargs)
+
+    processor.retrieve = retrieve_original_after_draft_started
+    generate = processor.generator.generate
+
+    def generate_and_signal(prompt):
+        started.set()
+        return generate(prompt)
+
+    processor.generator.generate = generate_and_signal
+    slow.retrieve(QUESTION)
+    slow.close()
+    assert overlapped[0]
+    assert slow.hyde_drafts == 1
+
+
+def draft_blocked_expander(scores):
+    processor, blocked = expander(scores)
+    processor.generator.release.clear()
+    return processor, blocked
+
+
+def test_good_variant_cancels_the_draft():
+    processor, good = draft_blocked_expander({"original": 0.2, "variant": 0.9})
+    good.retrieve(QUESTION)
+    processor.generator.release.set()
+    good.close()
+    assert good.hyde_cancelled == 1
+    assert good.hyde_drafts == 0
+    assert "A draft passage" not in processor.embed_model.calls
+
+
+def test_early_answer_cancels_the_draft():
+    processor, early = draft_blocked_expander({"original": 0.9})
+    early.retrieve(QUESTION)
+    processor.generator.release.set()
+    early.close()
+    assert early.early_answers == 1
+    assert early.hyde_cancelled == 1
+    assert "A draft passage" not in processor.embed_model.calls
+
+
+def test_cancelled_variants_make_no_model_calls():
+    processor, cancelled = expander({})
+    cancel = threading.Event()
+    cancel.set()
+    assert cancelled._retrieve_variant("machine learning uses", None, 3, cancel) == []
+    assert cancelled._retrieve_hyde(QUESTION, None, 3, cancel) == []
+    cancelled.close()
+    assert processor.embed_model.calls == []
+    assert processor.generator.prompts == []
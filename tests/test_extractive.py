@@ -0,0 +1,64 @@
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from backends import HashingEmbedding
+from extractive import ExtractiveAnswerer, split_sentences
+
+
+def test_split_sentences_joins_wrapped_lines_and_drops_headings():
+    text = (
+        "Machine Learning\n"
+        "Machine learning is a subset of artificial intelligence that\n"
+        "learns from data. It improves with experience.\n"
+    )
+    assert split_sentences(text) == [
+        "Machine learning is a subset of artificial intelligence that learns from data.",
+        "It improves with experience.",
+    ]
+
+
+def test_split_sentences_drops_questions_list_intros_and_fragments():
+    text = (
+        "What is supervised learning?\n"
+        "Supervised learning uses labeled examples to train models.\n"
+        "Common applications include: 1.\n"
+        "Image recognition. Too short.\n"
+    )
+    assert split_sentences(text) == [
+        "Supervised learning uses labeled examples to train models.",
+    ]
+
+
+def node(text, score=0.8, page="3"):
+    return NodeWithScore(
+        node=TextNode(text=text, metadata={"file_name": "guide.pdf", "page_label": page}),
+        score=score
+    )
+
+
+NODES = [
+    node("Python was created by Guido van Rossum and first released in 1991. "
+         "It emphasizes code readability.", page="2"),
+    node("Java was released by Sun Microsystems in 1995. It runs on the JVM.", score=0.5),
+]
+
+
+def test_answer_returns_the_best_sentence_with_its_citation():
+    answerer = ExtractiveAnswerer(HashingEmbedding(), threshold=0.5)
+    answer = answerer.answer("Who created Python?", NODES)
+    assert answer == ("Python was created by Guido van Rossum and first released in 1991.\n\n"
+                      "(Source: guide.pdf, page 2)")
+    assert answerer.answered == 1
+
+
+def test_answer_declines_when_no_sentence_covers_the_question():
+    answerer = ExtractiveAnswerer(HashingEmbedding(), threshold=0.5)
+    assert answerer.answer("How does garbage collection work in Rust?", NODES) is None
+    assert answerer.answer("Who created Python?", []) is None
+    assert answerer.declined == 2
+
+
+def test_sentence_embeddings_are_cached():
+    embed_model = HashingEmbedding()
+    answerer = ExtractiveAnswerer(embed_model, threshold=0.5, cache_size=2)
+    answerer.answer("Who created Python?", NODES)
+    assert len(answerer._cache) == 2
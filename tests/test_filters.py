@@ -0,0 +1,139 @@
+import sys
+import uuid
+
+import numpy as np
+import pytest
+from llama_index.core.schema import TextNode
+
+from filters import MetadataIndex, NodeIdTable, QueryFilter, parse_query_filters
+from node_store import NodeStore
+
+
+def test_parse_query_filters_splits_question_and_filters():
+    query, query_filter = parse_query_filters(
+        "@file:manual.pdf What is the leave policy? @page:3-7 @tag:hr @type:.PDF"
+    )
+    assert query == "What is the leave policy?"
+    assert query_filter.file_names == {"manual.pdf"}
+    assert (query_filter.page_min, query_filter.page_max) == (3, 7)
+    assert query_filter.tags == {"hr"}
+    assert query_filter.doc_types == {"pdf"}
+
+
+@pytest.mark.parametrize("value, expected", [("5", (5, 5)), ("5-", (5, None)), ("-9", (None, 9))])
+def test_parse_query_filters_page_ranges(value, expected):
+    _, query_filter = parse_query_filters(f"@page:{value} question")
+    assert (query_filter.page_min, query_filter.page_max) == expected
+
+
+def test_parse_query_filters_date_sets_both_bounds():
+    _, query_filter = parse_query_filters("@date:2024-03-01 question")
+    assert query_filter.since == query_filter.until == "2024-03-01"
+
+
+@pytest.mark.parametrize("text", ["@page:three question", "@since:2024-13-01 question"])
+def test_parse_query_filters_rejects_invalid_values(text):
+    with pytest.raises(ValueError):
+        parse_query_filters(text)
+
+
+def test_plain_question_has_empty_filter():
+    query, query_filter = parse_query_filters("What is an email@example.com address?")
+    assert query == "What is an email@example.com address?"
+    assert query_filter.is_empty()
+    assert query_filter.to_chroma_where() == {}
+
+
+def test_to_chroma_where_combines_clauses():
+    query_filter = QueryFilter(file_names=["a.pdf"], page_min=2, tags=["hr"])
+    assert query_filter.to_chroma_where() == {"$and": [
+        {"file_name": {"$in": ["a.pdf"]}},
+        {"page_number": {"$gte": 2}},
+        {"tag_hr": True},
+    ]}
+
+
+@pytest.fixture
+def index():
+    index = MetadataIndex()
+    for i in range(30):
+        index.add(f"node-{i}", {
+            "file_name": f"file{i % 3}.pdf",
+            "doc_type": "pdf",
+            "page_number": i,
+            "ingest_day": 20240101 + i,
+            "tags": "hr" if i % 2 == 0 else "",
+        })
+    return index
+
+
+def test_metadata_index_select_matches_brute_force(index):
+    _, query_filter = parse_query_filters("@file:file1.pdf @page:4-25 @tag:hr @since:2024-01-10 question")
+    selected = index.node_ids_for(index.select(query_filter))
+    expected = [f"node-{i}" for i in range(30) if i % 3 == 1 and 4 <= i <= 25 and i % 2 == 0 and i >= 9]
+    assert selected == expected
+    assert index.count(index.select(query_filter)) == len(expected)
+
+
+def test_metadata_index_unknown_values_match_nothing(index):
+    assert index.count(index.select(QueryFilter(file_names=["missing.pdf"]))) == 0
+    assert index.count(index.select(QueryFilter(tags=["missing"]))) == 0
+
+
+def test_metadata_index_ignores_duplicates_and_counts_files(index):
+    index.add("node-0", {"file_name": "other.pdf"})
+    assert len(index) == 30
+    assert index.file_counts() == {"file0.pdf": 10, "file1.pdf": 10, "file2.pdf": 10}
+
+
+def test_metadata_index_memory_usage_counts_ids_and_columns(index):
+    usage = index.memory_usage()
+    assert usage["chunks"] == 30
+    # Node ID strings alone take more than the four integer columns
+    assert usage["id_bytes"] > usage["column_bytes"] >= 30 * (4 + 4 + 8 + 8)
+    assert usage["bytes_per_chunk"] * 30 == pytest.approx(usage["id_bytes"] + usage["lookup_bytes"] + usage["column_bytes"])
+
+
+def test_node_id_table_packs_uuids_and_keeps_other_ids():
+    table = NodeIdTable()
+    table.merge_min = 4
+    ids = [str(uuid.uuid4()) for _ in range(20)]
+    # Trailing zero bytes must survive the fixed-width byte strings
+    ids[5] = "12345678-1234-5678-1234-567812340000"
+    ids[7] = "node-7"
+    ids[9] = ids[9].upper()
+    for node_id in ids:
+        table.append(node_id)
+
+    assert [table.ordinal(node_id) for node_id in ids] == list(range(20))
+    assert [table.node_id(ordinal) for ordinal in range(20)] == ids
+    assert table.ordinal(str(uuid.uuid4())) is None
+    assert table.ordinal("node-8") is None
+    usage = table.memory_usage()
+    assert usage["string_bytes"] >= sys.getsizeof("node-7")
+
+
+def test_metadata_index_memory_per_chunk_stays_small():
+    index = MetadataIndex()
+    for i in range(5000):
+        index.add(str(uuid.uuid4()), {"file_name": f"file{i % 5}.pdf", "page_number": i, "ingest_day": 20240101})
+    usage = index.memory_usage()
+    assert usage["chunks"] == 5000
+    # Packed IDs take 16 bytes plus growth headroom, not a str object per chunk
+    assert usage["id_bytes"] < 5000 * 24
+    assert usage["bytes_per_chunk"] == pytest.approx(
+        (usage["id_bytes"] + usage["lookup_bytes"] + usage["column_bytes"]) / 5000
+    )
+    assert usage["bytes_per_chunk"] < 100
+
+    mask = np.zeros(len(index), dtype=bool)
+    mask[[0, 4999]] = True
+    selected = index.node_ids_for(mask)
+    assert [index.ordinal(node_id) for node_id in selected] == [0, 4999]
+
+
+def test_node_store_counts_interned_values_at_their_object_size():
+    store = NodeStore()
+    value = "a" * 100
+    store.append(TextNode(id_=str(uuid.uuid4()), text="text", metadata={"file_name": value}))
+    assert store.memory_usage()["interned_bytes"] >= sys.getsizeof(value)
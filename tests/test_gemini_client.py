@@ -0,0 +1,145 @@
+import time
+
+import pytest
+from google.api_core import exceptions as api_exceptions
+
+import gemini_client
+from gemini_client import BaseClient, CircuitBreaker, CircuitBreakerOpenError, GeminiClient, StubClient
+
+
+class CountingScheduler:
+    def __init__(self):
+        self.acquired = 0
+
+    def acquire_api(self):
+        self.acquired += 1
+
+
+class ScriptedClient(BaseClient):
+    """Raises the scripted errors in turn, then succeeds."""
+
+    def __init__(self, errors=(), **kwargs):
+        kwargs.setdefault("backoff", 0.0)
+        super().__init__(**kwargs)
+        self.errors = list(errors)
+        self.attempts = 0
+
+    def _generate(self, prompt, model_name):
+        self.attempts += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = CountingScheduler()
+    monkeypatch.setattr(gemini_client, "get_scheduler", lambda: scheduler)
+    return scheduler
+
+
+def test_breaker_opens_after_threshold_and_half_opens_after_timeout():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitBreakerOpenError):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    assert breaker.state == "half-open"
+    breaker.before_call()
+    # Only one trial call is let through while it is in flight
+    with pytest.raises(CircuitBreakerOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+
+
+def test_failed_trial_reopens_and_released_trial_allows_another():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.release_trial()
+    # The released trial did not judge the service, so another one may run
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+@pytest.mark.parametrize("error", [
+    api_exceptions.InvalidArgument("bad request"),
+    api_exceptions.ResourceExhausted("quota"),
+])
+def test_rejected_requests_do_not_count_towards_the_breaker(scheduler, error):
+    client = ScriptedClient([error] * 4, max_retries=0, breaker=CircuitBreaker(failure_threshold=1))
+    with pytest.raises(type(error)):
+        client.generate("prompt")
+    assert client.breaker.failures == 0
+    assert client.breaker.state == "closed"
+
+
+def test_server_errors_count_once_per_call_after_retries(scheduler):
+    client = ScriptedClient([api_exceptions.ServiceUnavailable("down")] * 3, max_retries=2)
+    with pytest.raises(api_exceptions.ServiceUnavailable):
+        client.generate("prompt")
+    assert client.attempts == 3
+    assert client.breaker.failures == 1
+    assert scheduler.acquired == 3
+
+
+def test_transient_errors_are_retried(scheduler):
+    client = ScriptedClient([api_exceptions.ResourceExhausted("quota")], max_retries=1)
+    assert client.generate("prompt") == "ok"
+    assert client.attempts == 2
+    assert client.stats["generate"].summary()["errors"] == 1
+
+
+def test_open_breaker_rejects_calls_before_using_the_rate_budget(scheduler):
+    client = ScriptedClient(breaker=CircuitBreaker(failure_threshold=1, reset_timeout=60))
+    client.breaker.record_failure()
+    with pytest.raises(CircuitBreakerOpenError):
+        client.generate("prompt")
+    assert client.attempts == 0
+    assert scheduler.acquired == 0
+
+
+def test_failed_half_open_trial_for_a_bad_request_is_released(scheduler):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    client = ScriptedClient([api_exceptions.InvalidArgument("bad request")], max_retries=0, breaker=breaker)
+    with pytest.raises(api_exceptions.InvalidArgument):
+        client.generate("prompt")
+    assert client.generate("prompt") == "ok"
+    assert breaker.state == "closed"
+
+
+def test_stub_latency_over_the_deadline_times_out(scheduler):
+    client = StubClient(dimension=8, latency=0.2, timeout=0.01)
+    with pytest.raises(api_exceptions.DeadlineExceeded):
+        client.embed_one("hello")
+    assert client.breaker.failures == 1
+
+
+class RecordingApiClient:
+    def __init__(self):
+        self.calls = []
+
+    def batch_embed_contents(self, request, timeout=None, retry=None):
+        self.calls.append(("embed", timeout, retry))
+        return type("Response", (), {"embeddings": [type("E", (), {"values": [0.5, 0.5]})()
+                                                    for _ in request.requests]})()
+
+
+def test_gemini_client_passes_the_deadline_to_the_api(scheduler, monkeypatch):
+    api = RecordingApiClient()
+    monkeypatch.setattr(gemini_client.genai_client, "get_default_generative_client", lambda: api)
+    monkeypatch.setattr(gemini_client.genai, "configure", lambda **kwargs: None)
+    client = GeminiClient("key", timeout=7.5)
+    assert client.embed(["a", "b"]) == [[0.5, 0.5], [0.5, 0.5]]
+    # Retries are left to the wrapper, so the transport does not retry on its own
+    assert api.calls == [("embed", 7.5, None)]
@@ -0,0 +1,34 @@
+from profiling import MemoryBudget, MemoryProfiler
+
+
+def run_file(profiler, inner_stages=3):
+    with profiler.stage("file"):
+        for _ in range(inner_stages):
+            with profiler.stage("embed", "a.pdf"):
+                data = [bytearray(1024) for _ in range(1000)]
+                del data
+
+
+def test_snapshots_are_taken_only_for_top_level_stages():
+    profiler = MemoryProfiler(enabled=True)
+    profiler.start()
+    try:
+        run_file(profiler)
+    finally:
+        profiler.stop()
+    report = profiler.report()
+    assert profiler.snapshots == 1
+    assert report["stages"]["embed"]["calls"] == 3
+    assert report["files"]["a.pdf"]["calls"] == 3
+    # The outer stage's peak includes the allocations of its inner stages
+    assert report["stages"]["file"]["peak_traced_mb"] >= report["stages"]["embed"]["peak_traced_mb"] > 0.5
+
+
+def test_stages_over_the_budget_record_their_allocation_sites():
+    profiler = MemoryProfiler(enabled=True, budget=MemoryBudget(limit_mb=1))
+    profiler.start()
+    try:
+        run_file(profiler)
+    finally:
+        profiler.stop()
+    assert profiler.snapshots == 4
@@ -0,0 +1,70 @@
+import os
+
+from llama_index.core.schema import TextNode
+
+from retry_queue import RetryQueue, cache_dir, invalid_embedding_reason
+
+
+def make_nodes(*names):
+    return [TextNode(id_=name, text=f"text of {name}", metadata={"file_name": f"{name}.pdf"}) for name in names]
+
+
+def test_queued_chunks_survive_reopening(tmp_path):
+    path = str(tmp_path / "queue.jsonl")
+    RetryQueue(path).add(make_nodes("a", "b"), "429 quota exceeded")
+
+    reopened = RetryQueue(path)
+    assert len(reopened) == 2
+    nodes = [node for node, _ in reopened.pending()]
+    assert [node.node_id for node in nodes] == ["a", "b"]
+    assert nodes[0].text == "text of a"
+    assert reopened.summary() == {"pending": 2, "files": ["a.pdf", "b.pdf"], "last_error": "429 quota exceeded"}
+
+
+def test_partially_written_line_is_skipped(tmp_path):
+    path = str(tmp_path / "queue.jsonl")
+    queue = RetryQueue(path)
+    queue.add(make_nodes("a"), "timeout")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"node": {"id_": "b"')
+    assert [node.node_id for node, _ in queue.pending()] == ["a"]
+
+
+def test_resolve_drops_succeeded_and_counts_failed_attempts(tmp_path):
+    path = str(tmp_path / "queue.jsonl")
+    queue = RetryQueue(path)
+    queue.add(make_nodes("a", "b", "c"), "timeout")
+    queue.resolve(["a"], ["b"], "503 unavailable")
+
+    pending = {node.node_id: attempts for node, attempts in RetryQueue(path).pending()}
+    assert pending == {"b": 2, "c": 1}
+    assert queue.summary()["last_error"] == "timeout"
+    assert not os.path.exists(path + ".tmp")
+
+
+def test_clear_removes_the_file(tmp_path):
+    path = str(tmp_path / "nested" / "queue.jsonl")
+    queue = RetryQueue(path)
+    queue.clear()
+    queue.add(make_nodes("a"), "timeout")
+    queue.clear()
+    assert not os.path.exists(path)
+    assert len(queue) == 0
+
+
+def test_cache_dir_is_outside_the_document_folder(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    documents = str(tmp_path / "Document")
+    directory = cache_dir(documents)
+    assert directory.startswith(str(tmp_path / "cache"))
+    assert not directory.startswith(documents)
+    assert cache_dir(documents) == directory
+    assert cache_dir(str(tmp_path / "Other")) != directory
+
+
+def test_invalid_embeddings_are_detected():
+    assert invalid_embedding_reason(None, 3) == "missing"
+    assert invalid_embedding_reason([1.0, 0.0], 3) == "dimension"
+    assert invalid_embedding_reason([1.0, float("nan"), 0.0], 3) == "non-finite"
+    assert invalid_embedding_reason([0.0, 0.0, 0.0], 3) == "zero"
+    assert invalid_embedding_reason([0.1, 0.2, 0.3], 3) is None
@@ -0,0 +1,44 @@
+import pytest
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from router import ModelRouter
+
+
+class FakeGenerator:
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def generate(self, prompt):
+        return "answer"
+
+
+NODES = [
+    NodeWithScore(node=TextNode(text="Python was created by Guido van Rossum in 1991."), score=0.9),
+    NodeWithScore(node=TextNode(text="Java was released by Sun Microsystems."), score=0.5),
+]
+
+
+@pytest.fixture
+def generators():
+    return {"fast": FakeGenerator("fast-model"), "large": FakeGenerator("large-model")}
+
+
+def test_lookups_are_extractive_only_when_the_caller_serves_them(generators):
+    assert ModelRouter(generators, extractive=True).choose("Who created Python?", NODES)[0] == "extractive"
+    assert ModelRouter(generators).choose("Who created Python?", NODES)[0] == "fast"
+
+
+def test_follow_ups_are_never_extractive(generators):
+    router = ModelRouter(generators, extractive=True)
+    assert router.choose("Who created Python?", NODES, follow_up=True)[0] == "fast"
+
+
+def test_reasoning_questions_go_to_the_large_model(generators):
+    router = ModelRouter(generators, extractive=True)
+    assert router.choose("Why was Python created?", NODES)[0] == "large"
+
+
+def test_missing_fast_route_falls_back_to_large():
+    router = ModelRouter({"large": FakeGenerator("large-model")})
+    assert router.choose("Who created Python?", NODES)[0] == "large"
+    assert router.fallback("extractive") == "large"
@@ -0,0 +1,121 @@
+import threading
+import time
+
+from scheduler import (
+    BULK, DEFAULT_REQUESTS_PER_MINUTE, INTERACTIVE, RateBudget, WorkerSlots, get_scheduler, set_scheduler
+)
+
+
+def run_in_thread(fn, *args):
+    thread = threading.Thread(target=fn, args=args, daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+def test_unlimited_budget_never_waits():
+    budget = RateBudget()
+    assert all(budget.acquire(BULK) == 0.0 for _ in range(1000))
+
+
+def test_interactive_calls_are_served_before_waiting_bulk_calls():
+    budget = RateBudget(requests_per_minute=600, burst=1)
+    budget.acquire(INTERACTIVE)
+    order = []
+
+    def acquire(level):
+        budget.acquire(level)
+        order.append(level)
+
+    bulk = run_in_thread(acquire, BULK)
+    wait_until(lambda: budget._waiting[BULK] == 1)
+    interactive = run_in_thread(acquire, INTERACTIVE)
+    bulk.join(2)
+    interactive.join(2)
+    assert order == [INTERACTIVE, BULK]
+
+
+def test_bulk_calls_leave_the_reserve_to_interactive_calls():
+    budget = RateBudget(requests_per_minute=6, burst=5, bulk_reserve=0.2)
+    for _ in range(4):
+        assert budget.acquire(BULK) < 0.05
+    blocked = run_in_thread(budget.acquire, BULK)
+    blocked.join(0.2)
+    assert blocked.is_alive()
+    assert budget.acquire(INTERACTIVE) < 0.05
+
+
+def hold_slot(slots, level, entered, release, order=None):
+    with slots.slot(level):
+        if order is not None:
+            order.append(level)
+        entered.set()
+        release.wait(2)
+
+
+def test_bulk_work_cannot_take_the_interactive_slot():
+    slots = WorkerSlots(2, interactive_reserve=1)
+    entered, release = threading.Event(), threading.Event()
+    run_in_thread(hold_slot, slots, BULK, entered, release)
+    assert entered.wait(1)
+
+    second_bulk = threading.Event()
+    run_in_thread(hold_slot, slots, BULK, second_bulk, release)
+    interactive = threading.Event()
+    run_in_thread(hold_slot, slots, INTERACTIVE, interactive, release)
+    assert interactive.wait(1)
+    assert not second_bulk.is_set()
+    release.set()
+    assert second_bulk.wait(1)
+
+
+def test_waiting_interactive_work_pre_empts_waiting_bulk_work():
+    slots = WorkerSlots(3, interactive_reserve=1)
+    holders = [(level, threading.Event(), threading.Event()) for level in (BULK, INTERACTIVE, INTERACTIVE)]
+    for level, entered, release in holders:
+        run_in_thread(hold_slot, slots, level, entered, release)
+        assert entered.wait(1)
+
+    order = []
+    done = threading.Event()
+    waiters = []
+    for level in (BULK, INTERACTIVE):
+        waiters.append(run_in_thread(hold_slot, slots, level, threading.Event(), done, order))
+        wait_until(lambda: slots._waiting[level] == 1)
+
+    # Freeing one slot goes to the interactive waiter although the bulk one queued first
+    holders[1][2].set()
+    wait_until(lambda: len(order) == 1)
+    assert order == [INTERACTIVE]
+    holders[2][2].set()
+    wait_until(lambda: len(order) == 2)
+    assert order == [INTERACTIVE, BULK]
+    done.set()
+    holders[0][2].set()
+
+
+def test_nested_slots_in_one_thread_hold_a_single_slot():
+    slots = WorkerSlots(1)
+    with slots.slot(INTERACTIVE):
+        with slots.slot(BULK) as waited:
+            assert waited == 0.0
+            assert slots._in_use == {INTERACTIVE: 1, BULK: 0}
+    assert slots._in_use == {INTERACTIVE: 0, BULK: 0}
+
+
+def test_default_scheduler_has_an_api_budget(monkeypatch):
+    monkeypatch.delenv("API_REQUESTS_PER_MINUTE", raising=False)
+    set_scheduler(None)
+    try:
+        assert get_scheduler().rate_budget.rate == DEFAULT_REQUESTS_PER_MINUTE / 60.0
+        monkeypatch.setenv("API_REQUESTS_PER_MINUTE", "0")
+        set_scheduler(None)
+        assert get_scheduler().rate_budget.rate is None
+    finally:
+        set_scheduler(None)
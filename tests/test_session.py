@@ -0,0 +1,66 @@
+import pytest
+
+from session import ChatSession, Turn
+
+
+class FakeProcessor:
+    index = True
+    index_version = 1
+
+
+@pytest.fixture
+def session():
+    session = ChatSession(FakeProcessor())
+    session.turns.append(Turn("What are neural networks?", "What are neural networks?", [1.0], [], "...", None))
+    return session
+
+
+@pytest.mark.parametrize("question", [
+    "How are they trained?",
+    "What is it used for?",
+    "And for images?",
+    "What about deep learning?",
+])
+def test_follow_ups_are_rewritten_with_the_previous_topic(session, question):
+    assert session.is_follow_up(question)
+    assert session.rewrite(question) == f"{question} (neural networks)"
+
+
+@pytest.mark.parametrize("question", [
+    "Is there a difference between supervised and unsupervised learning?",
+    "Which one of the algorithms is fastest on large datasets?",
+    "What problems can reinforcement learning solve that this paper mentions?",
+])
+def test_standalone_questions_are_left_alone(session, question):
+    assert not session.is_follow_up(question)
+    assert session.rewrite(question) == question
+
+
+def test_first_question_is_never_a_follow_up():
+    assert not ChatSession(FakeProcessor()).is_follow_up("How are they trained?")
+
+
+class AnsweringProcessor(FakeProcessor):
+    tables = None
+
+    def __init__(self):
+        self.follow_ups = []
+
+    def embed_query(self, query):
+        return [1.0, 0.0] if "neural" in query else [0.0, 1.0]
+
+    def retrieve_for_answer(self, query, filters=None, query_embedding=None):
+        return ["chunk"]
+
+    def generate_answer(self, query, nodes, history=None, follow_up=False):
+        self.follow_ups.append(follow_up)
+        return "answer"
+
+
+def test_only_follow_ups_are_flagged_to_the_processor():
+    processor = AnsweringProcessor()
+    session = ChatSession(processor)
+    session.ask("What are neural networks?")
+    session.ask("How are they trained?")
+    session.ask("Which optimizers does the guide recommend for transformers?")
+    assert processor.follow_ups == [False, True, False]
@@ -0,0 +1,118 @@
+import pytest
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from shards import ShardManager, parse_shard_selection
+
+
+class StubUsage:
+    def __init__(self, usage):
+        self.usage = usage
+
+    def memory_usage(self):
+        return self.usage
+
+
+class StubEmbedModel:
+    dimension = 4
+
+
+class StubProcessor:
+    """Stands in for a PDFProcessor; each shard holds chunks of 1 MB of text."""
+
+    opened = []
+    embedded = []
+
+    def __init__(self, collection_name, document_dir, persist_dir):
+        self.name = collection_name[len("pdf_documents_"):]
+        self.closed = False
+        self.synced = False
+        self.embed_model = StubEmbedModel()
+        self.node_store = StubUsage({"text_bytes": 1024 * 1024, "array_bytes": 0, "interned_bytes": 0})
+        self.metadata_index = StubUsage({"chunks": 0, "bytes_per_chunk": 0.0})
+        StubProcessor.opened.append(self.name)
+
+    def load_index(self):
+        return self.name != "new"
+
+    def sync_documents(self):
+        self.synced = True
+        return [], []
+
+    def load_documents(self):
+        return self.name == "new"
+
+    def close(self):
+        self.closed = True
+
+    def embed_query(self, query):
+        StubProcessor.embedded.append(query)
+        return [1.0, 0.0, 0.0, 0.0]
+
+    def retrieve(self, query, filters, top_k, query_embedding=None):
+        assert query_embedding == [1.0, 0.0, 0.0, 0.0]
+        score = {"a": 0.9, "b": 0.5, "c": 0.7, "new": 0.1}[self.name]
+        return [NodeWithScore(node=TextNode(text=f"{self.name} chunk"), score=score)]
+
+
+@pytest.fixture
+def manager(tmp_path):
+    for name in ("a", "b", "c", "new"):
+        (tmp_path / name).mkdir()
+    StubProcessor.opened = []
+    StubProcessor.embedded = []
+    manager = ShardManager(str(tmp_path), max_loaded=2, processor_factory=StubProcessor)
+    yield manager
+    manager.close()
+
+
+def test_shards_open_lazily_and_sync_their_documents(manager):
+    assert manager.list_shards() == ["a", "b", "c", "new"]
+    assert StubProcessor.opened == []
+    processor = manager.acquire("a")
+    manager.release("a")
+    assert StubProcessor.opened == ["a"]
+    assert processor.synced
+    # A shard without a stored index is built from its documents instead
+    assert not manager.acquire("new").synced
+    manager.release("new")
+    with pytest.raises(ValueError):
+        manager.acquire("missing")
+
+
+def test_least_recently_used_shards_are_evicted(manager):
+    first = manager.acquire("a")
+    manager.release("a")
+    manager.acquire("b")
+    manager.release("b")
+    manager.acquire("a")
+    manager.release("a")
+    manager.acquire("c")
+    manager.release("c")
+    assert manager.loaded_shards() == ["a", "c"]
+    assert not first.closed
+
+
+def test_eviction_by_estimated_size_skips_pinned_shards(tmp_path):
+    for name in ("a", "b", "c"):
+        (tmp_path / name).mkdir()
+    manager = ShardManager(str(tmp_path), max_loaded=8, memory_limit_mb=2.5, processor_factory=StubProcessor)
+    pinned = manager.acquire("a")
+    manager.acquire("b")
+    manager.release("b")
+    manager.acquire("c")
+    manager.release("c")
+    assert manager.loaded_shards() == ["a", "c"]
+    assert not pinned.closed
+    manager.release("a")
+    manager.close()
+
+
+def test_queries_are_embedded_once_across_shards(manager):
+    nodes = manager.retrieve("What is AI?", ["a", "b", "c"], top_k=2)
+    assert StubProcessor.embedded == ["What is AI?"]
+    assert [node.node.metadata["shard"] for node in nodes] == ["a", "c"]
+
+
+def test_parse_shard_selection():
+    assert parse_shard_selection("@shard:hr What is the PTO policy? @shard:legal") == (
+        "What is the PTO policy?", ["hr", "legal"])
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from snapshot import Snapshot, SnapshotError, export_snapshot
+
+
+class FakeCollection:
+    def __init__(self, count, dimension):
+        self.ids = [f"node-{i}" for i in range(count)]
+        self.embeddings = np.arange(count * dimension, dtype=np.float32).reshape(count, dimension)
+        self.documents = [f"Chunk {i} text" for i in range(count)]
+        self.metadatas = [{"file_name": f"file{i % 2}.pdf", "page_number": i} for i in range(count)]
+
+    def count(self):
+        return len(self.ids)
+
+    def get(self, include, limit, offset):
+        window = slice(offset, offset + limit)
+        return {
+            "ids": self.ids[window],
+            "embeddings": self.embeddings[window].tolist(),
+            "documents": self.documents[window],
+            "metadatas": self.metadatas[window],
+        }
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    path = str(tmp_path / "index.snap")
+    export_snapshot(path, FakeCollection(5, 4), "hashing-4", 4, manifest={"files": {}}, batch_size=2,
+                    tables=[{"columns": ["A"], "cells": [["1"]], "metadata": {}, "title": None}])
+    return path
+
+
+def test_round_trip(snapshot_path):
+    collection = FakeCollection(5, 4)
+    snapshot = Snapshot(snapshot_path)
+    snapshot.check_compatible("hashing-4", 4)
+    snapshot.verify()
+    assert np.array_equal(snapshot.vectors(), collection.embeddings)
+    assert list(snapshot.records()) == list(zip(collection.ids, collection.documents, collection.metadatas))
+    assert snapshot.header["manifest"] == {"files": {}}
+    assert snapshot.header["tables"][0]["columns"] == ["A"]
+
+
+def test_incompatible_model_is_refused(snapshot_path):
+    with pytest.raises(SnapshotError):
+        Snapshot(snapshot_path).check_compatible("other-model", 4)
+    with pytest.raises(SnapshotError):
+        Snapshot(snapshot_path).check_compatible("hashing-4", 8)
+
+
+def test_corruption_is_detected(snapshot_path):
+    with open(snapshot_path, "r+b") as f:
+        f.seek(64)
+        f.write(b"\xff\xff\xff\xff")
+    with pytest.raises(SnapshotError):
+        Snapshot(snapshot_path).verify()
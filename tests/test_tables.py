@@ -0,0 +1,102 @@
+import math
+
+import pytest
+
+from filters import QueryFilter
+from tables import TableStore, detect_tables, parse_number
+
+PAGE = """Regional sales 2023
+Region  Q1 revenue  Q2 revenue  Units
+North  1,200  1,500  40
+South  900  1,100  35
+East  1,500  (200)  52
+Total  3,600  2,400  127
+Revenue grew in every region except the East in the second quarter."""
+
+METADATA = {"file_name": "report.pdf", "page_label": "4", "page_number": 4, "doc_type": "pdf"}
+
+
+@pytest.fixture
+def store():
+    store = TableStore()
+    store.tables = detect_tables(PAGE, METADATA)
+    return store
+
+
+def test_parse_number():
+    assert parse_number("$1,234.5") == 1234.5
+    assert parse_number("(200)") == -200
+    assert parse_number("12%") == 12
+    assert math.isnan(parse_number("North"))
+
+
+def test_detect_tables_finds_header_caption_and_numeric_columns(store):
+    [table] = store.tables
+    assert table.columns == ["Region", "Q1 revenue", "Q2 revenue", "Units"]
+    assert table.title == "Regional sales 2023"
+    assert table.label_column == "Region"
+    assert len(table) == 4
+    assert set(table.numbers) == {"Q1 revenue", "Q2 revenue", "Units"}
+
+
+def test_aggregates_skip_the_total_row(store):
+    match = store.match("Which region had the highest Q1 revenue?")
+    assert (match.operation, match.value, match.rows) == ("max", 1500, [2])
+    match = store.match("What was the total Q2 revenue in 2023?")
+    assert (match.operation, match.value, match.aggregated_rows) == ("sum", 2400, 3)
+
+
+def test_max_over_tied_columns_reports_the_column_it_computed(store):
+    match = store.match("Which region had the highest revenue in 2023?")
+    assert match.columns == ["Q1 revenue"]
+    assert (match.operation, match.value, match.rows) == ("max", 1500, [2])
+
+
+def test_named_rows_are_looked_up(store):
+    match = store.match("How many units did North sell?")
+    assert match.operation is None
+    assert match.rows == [0]
+    assert match.columns == ["Units"]
+
+
+@pytest.mark.parametrize("question", [
+    "What are the most common applications of machine learning?",
+    "How does revenue scale overall?",
+    "What are the top revenue models for startups?",
+    "What is the highest revenue a subscription business can reach?",
+    "Which region had the highest revenue growth according to the new pricing model analysis?",
+])
+def test_questions_not_about_the_table_fall_back_to_retrieval(store, question):
+    assert store.match(question) is None
+
+
+def test_filters_apply_to_tables(store):
+    assert store.match("Which region had the highest Q1 revenue?", QueryFilter(page_min=4, page_max=4))
+    assert store.match("Which region had the highest Q1 revenue?", QueryFilter(file_names=["other.pdf"])) is None
+
+
+def test_tables_round_trip(store):
+    copy = TableStore()
+    copy.from_list(store.to_list())
+    [table] = copy.tables
+    assert table.cells == store.tables[0].cells
+    assert table.title == store.tables[0].title
+    assert copy.match("Which region had the highest Q1 revenue?").value == 1500
+
+
+def test_save_replaces_the_file_atomically(store, tmp_path):
+    path = str(tmp_path / "tables.json")
+    (tmp_path / "tables.json").write_text("stale", encoding="utf-8")
+    store.save(path)
+    assert not (tmp_path / "tables.json.tmp").exists()
+    loaded = TableStore()
+    loaded.load(path)
+    assert loaded.tables[0].cells == store.tables[0].cells
+
+
+def test_query_filter_matches_metadata():
+    assert QueryFilter(file_names=["report.pdf"], page_min=2, doc_types=[".PDF"]).matches(METADATA)
+    assert not QueryFilter(page_max=3).matches(METADATA)
+    assert not QueryFilter(tags=["hr"]).matches(METADATA)
+    assert QueryFilter(tags=["hr"]).matches({**METADATA, "tag_hr": True})
+    assert not QueryFilter(since="2024-01-01").matches(METADATA)
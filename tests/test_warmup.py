@@ -0,0 +1,61 @@
+import pytest
+
+from scheduler import BULK, current_priority
+from warmup import PopularityTracker, QueryEmbeddingCache, normalize_query
+
+
+def test_normalize_query_ignores_case_and_whitespace():
+    assert normalize_query("  What are   NEURAL networks? ") == "what are neural networks"
+
+
+@pytest.mark.parametrize("query", [
+    "What are neural networks",
+    "what are neural networks!",
+    'What are "neural networks"?',
+    "What are neural networks ?",
+])
+def test_normalize_query_ignores_sentence_punctuation(query):
+    assert normalize_query(query) == normalize_query("What are neural networks?")
+
+
+@pytest.mark.parametrize("first, second", [
+    ("What is C++?", "What is C?"),
+    ("Python 3.5 features", "Python 35 features"),
+])
+def test_normalize_query_keeps_symbols_inside_tokens(first, second):
+    assert normalize_query(first) != normalize_query(second)
+
+
+def test_unpunctuated_query_hits_the_cached_question():
+    cache = QueryEmbeddingCache()
+    cache.warm(["What are neural networks?"], lambda queries: [[1.0] for _ in queries])
+    assert cache.get("What are neural networks") == [1.0]
+
+
+def test_warm_embeds_missing_queries_once():
+    cache = QueryEmbeddingCache()
+    calls = []
+
+    def embed(queries):
+        calls.append(list(queries))
+        return [[float(len(query))] for query in queries]
+
+    assert cache.warm(["What is C++?", "what is c++?", "What is C?"], embed) == 2
+    assert cache.warm(["WHAT IS C++?"], embed) == 0
+    assert [normalize_query(query) for query in calls[0]] == ["what is c++", "what is c"]
+    assert len(calls) == 1
+    assert cache.get("what is c?") == [10.0]
+
+
+def test_tracker_pre_embeds_at_bulk_priority(tmp_path):
+    levels = []
+
+    def embed(queries):
+        levels.append(current_priority())
+        return [[0.0] for _ in queries]
+
+    tracker = PopularityTracker(str(tmp_path / "warmup.txt"), QueryEmbeddingCache(), embed)
+    tracker.record("What is C++?")
+    tracker.stop()
+    assert levels == [BULK]
+    assert "What is C++?" in (tmp_path / "warmup.txt").read_text(encoding="utf-8")